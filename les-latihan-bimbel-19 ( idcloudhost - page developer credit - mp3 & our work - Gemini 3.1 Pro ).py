@@ -1,48 +1,212 @@
 import os
+import sys
 from dotenv import load_dotenv
 load_dotenv()
+import base64
 import datetime
-from flask import Flask, request, send_from_directory, render_template_string, redirect, url_for, Response, jsonify
-from werkzeug.utils import secure_filename
+import functools
+import hashlib
+import sqlite3
+import json
+import math
+import mimetypes
+import re
+import secrets
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import click
+from flask import Flask, request, send_from_directory, send_file, render_template, redirect, url_for, Response, jsonify, abort
+from flask.signals import appcontext_pushed
+from jinja2 import DictLoader, FileSystemBytecodeCache
+from werkzeug.exceptions import ClientDisconnected, HTTPException
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError, OperationalError
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+try:
+    from PIL import Image, ImageOps
+    from PIL import features as pil_features
+except ImportError:  # optional: without Pillow uploads are only served at original size
+    Image = ImageOps = pil_features = None
+np = None  # optional NumPy, imported on first use by require_numpy(): only media jobs need it
+try:
+    import fcntl
+except ImportError:  # Windows: resumable uploads fall back to an in-process lock
+    fcntl = None
 
 # --- KONFIGURASI FLASK ---
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB Limit
 app.secret_key = os.environ.get('FLASK_SECRET_KEY') or "supersecretkey"
 app.config['UPLOAD_FOLDER'] = 'uploads'
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+app.config['SITE_CONFIG_FILE'] = os.environ.get('SITE_CONFIG_FILE') or 'site_config.json'
+app.config['SITE_CONFIG_CHECK_INTERVAL'] = 1.0  # seconds between mtime checks per worker
+app.config['PAGE_CACHE_ENABLED'] = os.environ.get('PAGE_CACHE_ENABLED', '1') != '0'
+app.config['PAGE_CACHE_FILE'] = os.environ.get('PAGE_CACHE_FILE') or 'page_cache.sqlite3'
+app.config['PAGE_CACHE_MAX_BYTES'] = 32 * 1024 * 1024  # LRU eviction above this total size
+app.config['LISTING_PAGE_SIZE'] = 24  # items per page for gallery/tutors/news (HTML and /api)
+app.config['LISTING_MAX_PAGE_SIZE'] = 100
+app.config['IMAGE_VARIANT_WIDTHS'] = (320, 640, 1280)  # resized copies for srcset
+app.config['IMAGE_WORKERS'] = 2  # background threads per process that resize uploads
+app.config['MEDIA_WORKER_POLL_SECONDS'] = 2.0  # idle sleep of the `media-worker` process
+app.config['MEDIA_JOB_MAX_ATTEMPTS'] = 3
+app.config['MEDIA_JOB_STALE_SECONDS'] = 3600  # running jobs older than this were orphaned by a crash
+app.config['FFMPEG_TIMEOUT'] = 1800  # seconds per ffmpeg invocation
+app.config['VIDEO_RENDITION'] = {'max_width': 854, 'video_bitrate': '1000k', 'max_bitrate': '1200k', 'audio_bitrate': '96k'}
+app.config['VIDEO_PREVIEW'] = {'width': 320, 'seconds': 3}
+app.config['AUDIO_FOLDER'] = 'static/audio'
+# Let the front proxy stream /uploads and /static/audio bytes (see MEDIA SERVING):
+# 'x-accel-redirect' for nginx, 'x-sendfile' for Apache/lighttpd, unset to serve from Python
+app.config['MEDIA_OFFLOAD'] = os.environ.get('MEDIA_OFFLOAD') or None
+app.config['MEDIA_OFFLOAD_PREFIXES'] = {'uploads': '/_protected/uploads/', 'audio': '/_protected/audio/'}
+app.config['MEDIA_MAX_RANGES'] = 16  # more ranges than this get the whole file (overlapping-range abuse)
+app.config['RESUMABLE_UPLOAD_MAX_BYTES'] = 1024 * 1024 * 1024  # total size of one resumable upload
+# YIN pitch tracker for recordings: 64 ms frames every 16 ms, voice/instrument range
+app.config['PITCH_ANALYSIS'] = {'sample_rate': 16000, 'frame': 1024, 'hop': 256, 'fmin': 65.0, 'fmax': 1000.0,
+                                'threshold': 0.15, 'min_rms': 0.01, 'in_tune_cents': 5}
+app.config['RESUMABLE_CHUNK_SIZE'] = 4 * 1024 * 1024  # suggested PATCH size, well under MAX_CONTENT_LENGTH
+app.config['SAMPLE_BANK'] = {'sample_rate': 48000, 'formats': ('opus', 'aac')}  # see SAMPLE BANK
+# Waveform zoom levels (samples per pixel at 48 kHz) stored for media uploads, see WAVEFORM PEAKS
+app.config['MEDIA_PEAKS'] = {'levels': (256, 1024, 4096, 16384), 'default_width': 1000}
+# Backing tracks in AUDIO_FOLDER with the key and tempo they were recorded in; other
+# keys/tempos are rendered on demand and kept in a bounded cache (see JAM VARIANTS)
+app.config['JAM_TRACKS'] = {'pop_rock.mp3': {'key': 'C', 'bpm': 100}, 'jazz_swing.mp3': {'key': 'C', 'bpm': 120}}
+app.config['JAM_VARIANT_MAX_BYTES'] = 512 * 1024 * 1024
+app.config['JAM_RENDER_WORKERS'] = 2  # concurrent ffmpeg renders per web process
+app.config['JAM_RENDER_WAIT_SECONDS'] = 1.0  # the request starting a render waits this long, then 202 + Retry-After
+# --- TEMPLATE REGISTRY ---
+# All HTML string constants are registered here by name (see the bottom of the file)
+# and compiled by create_app(), the music tools on first use; the bytecode cache lets
+# new workers skip recompiling.
+TEMPLATE_SOURCES = {}
+app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache())
+app.jinja_loader = DictLoader(TEMPLATE_SOURCES)
+
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff', 'ico', 'svg', 'mp3', 'wav', 'ogg', 'mp4', 'webm', 'm4a', 'flac', 'srt', 'vtt'}
+VIDEO_EXTENSIONS = {'mp4', 'webm'}
+AUDIO_EXTENSIONS = {'mp3', 'wav', 'ogg', 'm4a', 'flac'}
 
 # --- DATABASE SETUP ---
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI') or 'sqlite:///bimbel.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# Per-connection PRAGMAs for SQLite, picked with SQLITE_PROFILE. 'production' lets
+# readers run alongside a writer (WAL) and makes writers wait instead of failing
+# with "database is locked"; 'legacy' keeps SQLite's defaults.
+SQLITE_PROFILES = {
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,          # ms
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,      # negative = KiB, i.e. 64 MiB page cache
+        'temp_store': 'MEMORY',
+    },
+    'legacy': {},
+}
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE') or 'production'
+db = SQLAlchemy()  # bound to the app in create_app()
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    pragmas = SQLITE_PROFILES.get(app.config['SQLITE_PROFILE'])
+    if pragmas is None:
+        raise RuntimeError(f"Unknown SQLITE_PROFILE {app.config['SQLITE_PROFILE']!r}")
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
 
 # --- MODELS ---
 class BaseModel(db.Model):
     __abstract__ = True
+    API_FIELDS = ()
     def __getitem__(self, item):
         return getattr(self, item)
 
+    def to_dict(self):
+        data = {}
+        for field in self.API_FIELDS:
+            value = getattr(self, field)
+            data[field] = value.isoformat() if isinstance(value, datetime.datetime) else value
+        if 'image' in self.API_FIELDS:
+            data['image_url'] = url_for('uploaded_file', filename=self.image) if self.image else None
+            webp_widths = self.blob.variant_map().get('webp') if self.blob is not None else None
+            data['image_srcset'] = upload_srcset(self.image, 'webp', webp_widths) if webp_widths else None
+        return data
+
 class Gallery(BaseModel):
     __tablename__ = 'gallery'
+    __table_args__ = (db.Index('ix_gallery_created_at_id', 'created_at', 'id'),
+                      db.Index('ux_gallery_idempotency_key', 'idempotency_key', unique=True))
+    blob = db.relationship('UploadBlob', primaryjoin='foreign(Gallery.image) == UploadBlob.name', viewonly=True, lazy='selectin')
+    API_FIELDS = ('id', 'image', 'student_name', 'title', 'created_at', 'media_status')
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     image = db.Column(db.Text, nullable=False)
     student_name = db.Column(db.Text, nullable=False)
     title = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # Video/audio uploads only: set by the `media-worker` (see MEDIA JOBS)
+    media_status = db.Column(db.Text)  # queued / processing / ready / failed
+    media_info = db.Column(db.Text)    # JSON summary from ffprobe
+    poster = db.Column(db.Text)        # upload name of the poster frame (jpg)
+    preview = db.Column(db.Text)       # upload name of the short muted preview clip (mp4)
+    rendition = db.Column(db.Text)     # upload name of the bitrate-capped H.264/Opus mp4
+    idempotency_key = db.Column(db.Text)  # client-chosen, so retried uploads map to this row
+
+    @property
+    def media_kind(self):
+        ext = self.image.rsplit('.', 1)[-1].lower()
+        return 'video' if ext in VIDEO_EXTENSIONS else 'audio' if ext in AUDIO_EXTENSIONS else 'image'
+
+    @property
+    def video_url(self):
+        """What a click plays: the rendition once ready, the original until then."""
+        if self.media_kind == 'image':
+            return None
+        return url_for('uploaded_file', filename=self.rendition or self.image)
+
+    @property
+    def poster_url(self):
+        return url_for('uploaded_file', filename=self.poster) if self.poster else None
+
+    @property
+    def preview_url(self):
+        return url_for('uploaded_file', filename=self.preview) if self.preview else None
+
+    def to_dict(self):
+        data = super().to_dict()
+        data.update(media_kind=self.media_kind, video_url=self.video_url,
+                    poster_url=self.poster_url, preview_url=self.preview_url,
+                    media_pending=self.media_status in ('queued', 'processing'))
+        if self.media_kind != 'image':
+            # Cards show the poster (if any) where images show the upload itself
+            data['image_url'], data['image_srcset'] = self.poster_url, None
+        return data
 
 class Tutors(BaseModel):
     __tablename__ = 'tutors'
+    __table_args__ = (db.Index('ix_tutors_created_at_id', 'created_at', 'id'),
+                      db.Index('ux_tutors_idempotency_key', 'idempotency_key', unique=True))
+    blob = db.relationship('UploadBlob', primaryjoin='foreign(Tutors.image) == UploadBlob.name', viewonly=True, lazy='selectin')
+    API_FIELDS = ('id', 'image', 'name', 'bio', 'created_at')
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     image = db.Column(db.Text, nullable=False)
     name = db.Column(db.Text, nullable=False)
     bio = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    idempotency_key = db.Column(db.Text)  # client-chosen, so retried uploads map to this row
 
 class Pricing(BaseModel):
     __tablename__ = 'pricing'
+    __table_args__ = (db.Index('ix_pricing_created_at', 'created_at'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     title = db.Column(db.Text, nullable=False)
     price = db.Column(db.Text, nullable=False)
@@ -51,6 +215,7 @@ class Pricing(BaseModel):
 
 class Slots(BaseModel):
     __tablename__ = 'slots'
+    __table_args__ = (db.Index('ix_slots_day_time', 'day', 'time'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     day = db.Column(db.Text, nullable=False)
     time = db.Column(db.Text, nullable=False)
@@ -69,16 +234,176 @@ class JoinRequests(BaseModel):
 
 class News(BaseModel):
     __tablename__ = 'news'
+    __table_args__ = (db.Index('ix_news_date_created_at_id', 'date', 'created_at', 'id'),
+                      db.Index('ux_news_idempotency_key', 'idempotency_key', unique=True))
+    blob = db.relationship('UploadBlob', primaryjoin='foreign(News.image) == UploadBlob.name', viewonly=True, lazy='selectin')
+    API_FIELDS = ('id', 'title', 'content', 'date', 'image', 'created_at')
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     title = db.Column(db.Text, nullable=False)
     content = db.Column(db.Text, nullable=False)
     date = db.Column(db.Text, nullable=False)
     image = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    idempotency_key = db.Column(db.Text)  # client-chosen, so retried uploads map to this row
+
+# Reference counts of content-addressed uploads (see UPLOAD STORE)
+class UploadBlob(BaseModel):
+    __tablename__ = 'upload_blobs'
+    name = db.Column(db.Text, primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    variants = db.Column(db.Text)  # JSON {format: [widths]} once resized copies exist
+    media_meta = db.Column(db.Text)  # JSON duration/loudness/peak levels of audio and video (see WAVEFORM PEAKS)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def variant_map(self):
+        try:
+            data = json.loads(self.variants) if self.variants else {}
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def media_meta_dict(self):
+        try:
+            data = json.loads(self.media_meta) if self.media_meta else {}
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+# One encoded ear-training sample (see SAMPLE BANK); rows of older banks are dropped
+class SampleBankEntry(BaseModel):
+    __tablename__ = 'sample_bank'
+    bank = db.Column(db.Text, primary_key=True)  # sample_bank_id() it was rendered for
+    name = db.Column(db.Text, primary_key=True)  # key of SAMPLE_BANK_VOICES
+    fmt = db.Column(db.Text, primary_key=True)   # key of SAMPLE_BANK_FORMATS
+    filename = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+# Model columns that hold upload names
+UPLOAD_REFERENCES = ((Gallery, 'image'), (Gallery, 'poster'), (Gallery, 'preview'), (Gallery, 'rendition'),
+                     (Tutors, 'image'), (News, 'image'), (SampleBankEntry, 'filename'))
+
+# Background media work (ffmpeg etc.) queued in the database and executed by the
+# separate `media-worker` process, never by web workers
+class MediaJob(BaseModel):
+    __tablename__ = 'media_jobs'
+    __table_args__ = (db.Index('ix_media_jobs_status_id', 'status', 'id'),)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.Text, nullable=False)
+    target = db.Column(db.Text, nullable=False)
+    status = db.Column(db.Text, nullable=False, default='queued')  # queued / running / done / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    worker = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+# Pitch contour and intonation summary of a Gallery recording (see PITCH ANALYSIS)
+class PitchAnalysis(BaseModel):
+    __tablename__ = 'pitch_analyses'
+    API_FIELDS = ('gallery_id', 'upload', 'hop_seconds', 'analysed_at')
+    gallery_id = db.Column(db.Integer, primary_key=True)
+    upload = db.Column(db.Text, nullable=False)  # the upload that was analysed
+    hop_seconds = db.Column(db.Float, nullable=False)
+    contour = db.Column(db.Text, nullable=False)  # JSON list of Hz per hop, null when unvoiced
+    summary = db.Column(db.Text, nullable=False)  # JSON, see pitch_summary()
+    analysed_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def to_dict(self):
+        data = super().to_dict()
+        data.update(summary=json.loads(self.summary), contour=json.loads(self.contour))
+        return data
+
+# An upload sent in chunks through /api/uploads (see RESUMABLE UPLOADS)
+class ResumableUpload(BaseModel):
+    __tablename__ = 'resumable_uploads'
+    __table_args__ = (db.Index('ix_resumable_uploads_updated_at', 'updated_at'),)
+    id = db.Column(db.Text, primary_key=True)
+    target = db.Column(db.Text, nullable=False)    # key of UPLOAD_TARGETS
+    filename = db.Column(db.Text, nullable=False)  # client's name, only its extension is used
+    length = db.Column(db.Integer)  # NULL while deferred (streamed recording), set by a PATCH's Upload-Length
+    offset = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.Text, nullable=False, default='uploading')  # uploading / finalizing / done / failed
+    result = db.Column(db.Text)  # stored upload name once done
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
-# Ensure tables are created
-with app.app_context():
-    db.create_all()
+# Keyset ordering of each paginated listing (all descending, unique thanks to id)
+LISTING_ORDER = {
+    'gallery': (Gallery, (Gallery.created_at, Gallery.id)),
+    'tutors': (Tutors, (Tutors.created_at, Tutors.id)),
+    'news': (News, (News.date, News.created_at, News.id)),
+}
+
+def pricing_listing():
+    return Pricing.query.order_by(Pricing.created_at.asc())
+
+def slots_listing():
+    return Slots.query.order_by(Slots.day, Slots.time)
+
+# --- SCHEMA MIGRATIONS ---
+# db.create_all() only creates missing tables, so changes to existing bimbel.db
+# files are applied here. Each migration runs once, is recorded by name in
+# schema_migrations, and must be idempotent (another worker may race us).
+class SchemaMigration(BaseModel):
+    __tablename__ = 'schema_migrations'
+    name = db.Column(db.Text, primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+def _create_indexes(*names):
+    # By name, never "every model index": later indexes may cover columns that
+    # only a later migration adds
+    indexes = {index.name: index for table in db.metadata.sorted_tables for index in table.indexes}
+    for name in names:
+        indexes[name].create(db.engine, checkfirst=True)
+
+def _add_missing_column(table, column, ddl_type):
+    if column not in {c['name'] for c in db.inspect(db.engine).get_columns(table)}:
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}")
+
+def _migrate_resumable_deferred_length():
+    # SQLite cannot drop NOT NULL in place: rebuild the table, keeping in-flight uploads
+    columns = db.inspect(db.engine).get_columns('resumable_uploads')
+    if next(c for c in columns if c['name'] == 'length')['nullable']:
+        return
+    names = ', '.join(f'"{c["name"]}"' for c in columns)
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX IF EXISTS ix_resumable_uploads_updated_at")
+        conn.exec_driver_sql("ALTER TABLE resumable_uploads RENAME TO resumable_uploads_old")
+        ResumableUpload.__table__.create(conn)
+        conn.exec_driver_sql(f"INSERT INTO resumable_uploads ({names}) SELECT {names} FROM resumable_uploads_old")
+        conn.exec_driver_sql("DROP TABLE resumable_uploads_old")
+
+MIGRATIONS = [
+    ('0001_listing_indexes', lambda: _create_indexes('ix_gallery_created_at_id', 'ix_tutors_created_at_id',
+                                                      'ix_pricing_created_at', 'ix_slots_day_time',
+                                                      'ix_news_date_created_at_id')),
+    ('0002_upload_blob_variants', lambda: _add_missing_column('upload_blobs', 'variants', 'TEXT')),
+    ('0003_gallery_media', lambda: [_add_missing_column('gallery', column, 'TEXT')
+                                    for column in ('media_status', 'media_info', 'poster', 'preview', 'rendition')]),
+    ('0004_gallery_idempotency_key', lambda: (_add_missing_column('gallery', 'idempotency_key', 'TEXT'),
+                                              _create_indexes('ux_gallery_idempotency_key'))),
+    ('0005_resumable_deferred_length', _migrate_resumable_deferred_length),
+    ('0006_upload_blob_media_meta', lambda: _add_missing_column('upload_blobs', 'media_meta', 'TEXT')),
+    ('0007_tutors_news_idempotency_key', lambda: (_add_missing_column('tutors', 'idempotency_key', 'TEXT'),
+                                                  _add_missing_column('news', 'idempotency_key', 'TEXT'),
+                                                  _create_indexes('ux_tutors_idempotency_key', 'ux_news_idempotency_key'))),
+]
+
+def run_migrations():
+    applied = {m.name for m in SchemaMigration.query.all()}
+    for name, migrate in MIGRATIONS:
+        if name in applied:
+            continue
+        migrate()
+        db.session.add(SchemaMigration(name=name))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # recorded concurrently by another worker
+        app.logger.info("Applied schema migration %s", name)
 
 # --- PWA CONFIGURATION ---
 MANIFEST_CONTENT = """
@@ -104,18 +429,1175 @@ MANIFEST_CONTENT = """
 }
 """
 
+# Rendered by /service-worker.js (see service_worker()). The version changes with
+# the template build and the wallpaper/logo, which makes browsers install a new
+# worker that re-precaches the shell and drops the previous version's caches.
 SW_CONTENT = """
+const VERSION = {{ version|tojson }};
+const PRECACHE = 'bimbel-precache-' + VERSION;
+const PAGES = 'bimbel-pages-' + VERSION;
+const ASSETS = 'bimbel-assets';  // content-hashed URLs never change, so this survives versions
+const PRECACHE_URLS = {{ precache_urls|tojson }};
+const SWR_PATHS = new Set({{ swr_paths|tojson }});
+const CDN_ORIGINS = new Set({{ cdn_origins|tojson }});
+const HASHED_UPLOAD = /^\\/uploads\\/[0-9a-f]{64}(\\.w[0-9]{2,4})?\\.[a-z0-9]+$/;
+const BUDGETS = {{ budgets|tojson }};  // cache name prefix -> max bytes
+const MAX_ENTRY_BYTES = {{ max_entry_bytes|tojson }};
+
 self.addEventListener('install', (e) => {
-  console.log('[Service Worker] Install');
+  // One missing file (e.g. no wallpaper uploaded yet) must not abort the install
+  e.waitUntil(caches.open(PRECACHE).then(cache => Promise.allSettled(
+    PRECACHE_URLS.map(url => cache.add(new Request(url, { cache: 'reload' })))
+  )).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', (e) => {
+  const keep = new Set([PRECACHE, PAGES, ASSETS]);
+  e.waitUntil(caches.keys()
+    .then(names => Promise.all(names.filter(n => n.startsWith('bimbel-') && !keep.has(n)).map(n => caches.delete(n))))
+    .then(() => self.clients.claim()));
+});
+
+function entrySize(response) {
+  const length = Number(response.headers.get('Content-Length'));
+  return Number.isFinite(length) && length > 0 ? Promise.resolve(length) : response.clone().blob().then(b => b.size);
+}
+
+// Cache.keys() lists entries in insertion order, so eviction drops the oldest first
+const trimming = {};
+function trimCache(name, maxBytes) {
+  if (trimming[name]) return trimming[name];
+  trimming[name] = caches.open(name).then(async cache => {
+    const keys = await cache.keys();
+    const sizes = await Promise.all(keys.map(k => cache.match(k).then(r => r ? entrySize(r) : 0)));
+    let total = sizes.reduce((a, b) => a + b, 0);
+    for (let i = 0; i < keys.length && total > maxBytes; i++) {
+      await cache.delete(keys[i]);
+      total -= sizes[i];
+    }
+  }).finally(() => { delete trimming[name]; });
+  return trimming[name];
+}
+
+async function store(name, request, response) {
+  if (!response || !response.ok || response.status !== 200) return;
+  const size = await entrySize(response);
+  if (size > MAX_ENTRY_BYTES) return;
+  const cache = await caches.open(name);
+  await cache.put(request, response);
+  const budget = Object.keys(BUDGETS).find(prefix => name.startsWith(prefix));
+  if (budget) await trimCache(name, BUDGETS[budget]);
+}
+
+async function cacheFirst(event, name) {
+  const cached = await caches.match(event.request);
+  if (cached) return cached;
+  const response = await fetch(event.request);
+  event.waitUntil(store(name, event.request, response.clone()));
+  return response;
+}
+
+async function staleWhileRevalidate(event, name) {
+  const cached = await caches.match(event.request);
+  const network = fetch(event.request).then(response => {
+    event.waitUntil(store(name, event.request, response.clone()));
+    return response;
+  });
+  if (cached) {
+    event.waitUntil(network.catch(() => null));
+    return cached;
+  }
+  return network;
+}
+
+async function networkFirst(event) {
+  try {
+    return await fetch(event.request);
+  } catch (err) {
+    const cached = await caches.match(event.request, { ignoreSearch: event.request.mode === 'navigate' });
+    if (cached) return cached;
+    if (event.request.mode === 'navigate') {
+      const home = await caches.match('/');
+      if (home) return home;
+    }
+    throw err;
+  }
+}
+
+{% include 'outbox.js' %}
+
+self.addEventListener('sync', (e) => {
+  // A rejection makes the browser retry the sync later with backoff
+  if (e.tag === OUTBOX_SYNC_TAG) e.waitUntil(outboxFlush().then(() => caches.delete(PAGES)));
 });
+
 self.addEventListener('fetch', (e) => {
-  e.respondWith(fetch(e.request));
+  const request = e.request;
+  const url = new URL(request.url);
+  if (request.method !== 'GET') {
+    if (url.origin !== self.location.origin) return;
+    if (url.pathname.startsWith('/api/uploads')) {
+      // Chunks (a PATCH every few seconds while streaming a take) change no page; a finalize that stored one does
+      if (url.pathname.endsWith('/finalize')) {
+        e.respondWith(fetch(request).then(res => res.ok ? caches.delete(PAGES).then(() => res) : res));
+      }
+      return;
+    }
+    // A write may change any listing: drop cached pages before its redirect is followed
+    e.respondWith(fetch(request).finally(() => caches.delete(PAGES)));
+    return;
+  }
+  // Media seeks go straight to the network; partial responses are never cached
+  if (request.headers.has('Range')) return;
+  if (url.origin === self.location.origin) {
+    if (HASHED_UPLOAD.test(url.pathname)) return e.respondWith(cacheFirst(e, ASSETS));
+    if (SWR_PATHS.has(url.pathname)) return e.respondWith(staleWhileRevalidate(e, PAGES));
+    if (PRECACHE_URLS.includes(url.pathname + url.search)) return e.respondWith(cacheFirst(e, PRECACHE));
+    return e.respondWith(networkFirst(e));
+  }
+  if (CDN_ORIGINS.has(url.origin)) return e.respondWith(cacheFirst(e, ASSETS));
 });
 """
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+IDEMPOTENCY_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,128}$')
+
+def request_idempotency_key():
+    """The Idempotency-Key header (or idempotency_key form field) of a write; 400 if malformed."""
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    if not key:
+        return None
+    if not IDEMPOTENCY_KEY_PATTERN.match(key):
+        abort(400)
+    return key
+
+def idempotent_retry_won(model, idempotency_key):
+    """After a rolled-back IntegrityError: whether a row with this key exists, i.e. the
+    failure was a concurrent retry of the same write rather than a real error."""
+    return bool(idempotency_key) and model.query.filter_by(idempotency_key=idempotency_key).first() is not None
+
+# --- SITE SETTINGS ---
+# Wallpaper/logo choices live in one JSON file. Each worker keeps a parsed copy in
+# memory and only re-reads it when the file identity (inode/mtime/size) changes,
+# checked at most once per SITE_CONFIG_CHECK_INTERVAL. Writes go through a temp
+# file + os.replace so readers never see a half-written file.
+LEGACY_SETTING_FILES = {'bg_image': 'bg_config.txt', 'logo_file': 'logo_config.txt'}
+_site_settings_lock = threading.Lock()
+_site_settings_cache = {'stamp': None, 'checked_at': 0.0, 'values': {}}
+
+def _site_config_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return 'missing'
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _read_site_config(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        # Seed from the old one-value-per-file configs if they exist
+        values = {}
+        for key, legacy_path in LEGACY_SETTING_FILES.items():
+            if os.path.exists(legacy_path):
+                with open(legacy_path, 'r') as f:
+                    c = f.read().strip()
+                    if c: values[key] = c
+        return values
+    except (OSError, ValueError):
+        app.logger.exception("Could not read site config %s", path)
+        return {}
+
+def get_site_settings():
+    path = app.config['SITE_CONFIG_FILE']
+    cache = _site_settings_cache
+    now = time.monotonic()
+    if cache['stamp'] is not None and now - cache['checked_at'] < app.config['SITE_CONFIG_CHECK_INTERVAL']:
+        return cache['values']
+    with _site_settings_lock:
+        stamp = _site_config_stamp(path)
+        if stamp != cache['stamp']:
+            cache['values'] = _read_site_config(path)
+            cache['stamp'] = stamp
+        cache['checked_at'] = now
+        return cache['values']
+
+def get_site_setting(key, default=None):
+    return get_site_settings().get(key) or default
+
+def update_site_settings(**values):
+    path = app.config['SITE_CONFIG_FILE']
+    directory = os.path.dirname(os.path.abspath(path))
+    with _site_settings_lock:
+        data = dict(_read_site_config(path))
+        data.update(values)
+        fd, tmp_path = tempfile.mkstemp(prefix='.site_config.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        _site_settings_cache.update(stamp=_site_config_stamp(path), checked_at=time.monotonic(), values=data)
+    return data
+
+# --- PAGE CACHE ---
+# Fully rendered GET responses of the data-driven pages are stored in a small SQLite
+# file shared by all workers. Entries are keyed by endpoint, full path and the site
+# settings that affect the layout; write handlers call invalidate_pages() for the
+# endpoints they change. Any cache failure falls back to a normal render.
+# The same store keeps a revision counter per endpoint, bumped by invalidate_pages(),
+# from which page ETags are derived so revalidation needs no DB query. There is no
+# Last-Modified: at one-second precision it would let a page invalidated within the
+# same second as an earlier response revalidate as unchanged.
+_page_cache_local = threading.local()
+PAGE_CACHE_TOUCH_INTERVAL = 60.0  # refresh LRU timestamps at most once a minute per entry
+
+def _page_cache_conn():
+    conn = getattr(_page_cache_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(app.config['PAGE_CACHE_FILE'], timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS page_cache (
+            key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, body BLOB NOT NULL,
+            size INTEGER NOT NULL, accessed_at REAL NOT NULL)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_page_cache_endpoint ON page_cache (endpoint)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_page_cache_accessed ON page_cache (accessed_at)")
+        conn.execute("""CREATE TABLE IF NOT EXISTS page_revision (
+            endpoint TEXT PRIMARY KEY, revision INTEGER NOT NULL, updated_at REAL NOT NULL)""")
+        _page_cache_local.conn = conn
+    return conn
+
+def _page_cache_key(endpoint):
+    settings = get_site_settings()
+    return '|'.join([TEMPLATE_BUILD_ID, endpoint, request.full_path,
+                     settings.get('bg_image') or '', settings.get('logo_file') or ''])
+
+def _page_revision(endpoint):
+    conn = _page_cache_conn()
+    row = conn.execute("SELECT revision, updated_at FROM page_revision WHERE endpoint = ?", (endpoint,)).fetchone()
+    if row is None:
+        # First sight of this endpoint (or a fresh store): start a new timeline
+        conn.execute("INSERT OR IGNORE INTO page_revision (endpoint, revision, updated_at) VALUES (?, 0, ?)",
+                     (endpoint, time.time()))
+        row = conn.execute("SELECT revision, updated_at FROM page_revision WHERE endpoint = ?", (endpoint,)).fetchone()
+    return row
+
+def _page_cache_get(key):
+    conn = _page_cache_conn()
+    row = conn.execute("SELECT body, accessed_at FROM page_cache WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    now = time.time()
+    if now - row[1] > PAGE_CACHE_TOUCH_INTERVAL:
+        conn.execute("UPDATE page_cache SET accessed_at = ? WHERE key = ?", (now, key))
+    return row[0]
+
+def _page_cache_put(key, endpoint, body):
+    conn = _page_cache_conn()
+    conn.execute("INSERT OR REPLACE INTO page_cache (key, endpoint, body, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                 (key, endpoint, body, len(body), time.time()))
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM page_cache").fetchone()[0]
+    limit = app.config['PAGE_CACHE_MAX_BYTES']
+    if total > limit:
+        # Drop least recently used entries until we are back under the limit
+        for old_key, size in conn.execute("SELECT key, size FROM page_cache ORDER BY accessed_at ASC").fetchall():
+            if total <= limit:
+                break
+            conn.execute("DELETE FROM page_cache WHERE key = ?", (old_key,))
+            total -= size
+
+def invalidate_pages(*endpoints):
+    try:
+        conn = _page_cache_conn()
+        now = time.time()
+        conn.executemany("""INSERT INTO page_revision (endpoint, revision, updated_at) VALUES (?, 1, ?)
+            ON CONFLICT(endpoint) DO UPDATE SET revision = revision + 1, updated_at = excluded.updated_at""",
+                         [(e, now) for e in endpoints])
+        conn.executemany("DELETE FROM page_cache WHERE endpoint = ?", [(e,) for e in endpoints])
+    except sqlite3.Error:
+        app.logger.exception("Page cache invalidation failed for %s", endpoints)
+
+def _page_response(body, etag, mimetype='text/html'):
+    response = Response(body, mimetype=mimetype)
+    if etag:
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+    return response
+
+def cached_page(view=None, *, mimetype='text/html'):
+    if view is None:
+        return functools.partial(cached_page, mimetype=mimetype)
+    endpoint = view.__name__
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET':
+            return view(*args, **kwargs)
+        key = _page_cache_key(endpoint)
+        try:
+            revision, updated_at = _page_revision(endpoint)
+        except sqlite3.Error:
+            app.logger.exception("Page revision lookup failed")
+            return view(*args, **kwargs)
+        # The revision is part of the key, so a render that raced with a write is
+        # stored under the old revision and never served after the bump
+        key = f"{key}|{revision}|{updated_at!r}"
+        etag = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+        # Conditional GET is answered before any DB query or template render
+        if not is_resource_modified(request.environ, etag=etag):
+            return _page_response(b'', etag, mimetype).make_conditional(request)
+        if not app.config['PAGE_CACHE_ENABLED']:
+            rv = view(*args, **kwargs)
+            return _page_response(rv, etag, mimetype) if isinstance(rv, str) else rv
+        try:
+            body = _page_cache_get(key)
+        except sqlite3.Error:
+            app.logger.exception("Page cache read failed")
+            body = None
+        if body is not None:
+            return _page_response(body, etag, mimetype)
+        rv = view(*args, **kwargs)
+        if not isinstance(rv, str):
+            return rv
+        body = rv.encode('utf-8')
+        try:
+            _page_cache_put(key, endpoint, body)
+        except sqlite3.Error:
+            app.logger.exception("Page cache write failed")
+        return _page_response(body, etag, mimetype)
+    return wrapper
+
+# --- KEYSET PAGINATION ---
+# Listings are paged by their sort key instead of OFFSET, so every page costs the
+# same index range scan no matter how many rows exist. The cursor is the sort key
+# of the last row shown, base64url-encoded JSON.
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime.datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, columns):
+    """Raises ValueError for anything that is not a cursor produced by encode_cursor."""
+    if len(cursor) > 512:
+        raise ValueError("cursor too long")
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError("malformed cursor") from e
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError("malformed cursor")
+    decoded = []
+    for column, value in zip(columns, values):
+        if isinstance(column.type, db.DateTime) and isinstance(value, str):
+            decoded.append(datetime.datetime.fromisoformat(value))
+        elif isinstance(column.type, db.Integer) and isinstance(value, int) and not isinstance(value, bool):
+            decoded.append(value)
+        elif isinstance(column.type, db.Text) and isinstance(value, str):
+            decoded.append(value)
+        else:
+            raise ValueError("malformed cursor")
+    return decoded
+
+def keyset_query(listing, values=None):
+    model, columns = LISTING_ORDER[listing]
+    query = model.query.order_by(*[c.desc() for c in columns])
+    if values is not None:
+        # (a, b, c) < (x, y, z) expanded for the descending order; the redundant
+        # leading bound lets SQLite seek into the index instead of walking it
+        query = query.filter(columns[0] <= values[0], db.or_(*[
+            db.and_(*[columns[j] == values[j] for j in range(i)], columns[i] < values[i])
+            for i in range(len(columns))
+        ]))
+    return query
+
+def keyset_page(listing, cursor=None, limit=None):
+    """Return (rows, next_cursor) for one page of LISTING_ORDER[listing]."""
+    model, columns = LISTING_ORDER[listing]
+    limit = limit or app.config['LISTING_PAGE_SIZE']
+    values = decode_cursor(cursor, columns) if cursor else None
+    rows = keyset_query(listing, values).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], c.key) for c in columns])
+    return rows, next_cursor
+
+def _listing_page_or_400(listing, limit=None):
+    try:
+        return keyset_page(listing, request.args.get('cursor'), limit)
+    except ValueError:
+        abort(400)
+
+# --- UPLOAD STORE ---
+# New uploads are stored by the SHA-256 of their content as <sha256>.<ext> inside
+# two levels of shard directories (uploads/ab/cd/abcd...png). Identical files are
+# stored once, names never collide, and the URL /uploads/<sha256>.<ext> can be
+# cached forever. Rows referencing a blob bump UploadBlob.refcount in the same
+# transaction; unreferenced blobs are removed by the `gc-uploads` command.
+# Older flat files in uploads/ keep working under their original names.
+# <sha256>.<ext> for originals, <sha256>.w<width>.<ext> for resized variants
+CONTENT_ADDRESSED_NAME = re.compile(r'^[0-9a-f]{64}(\.w[0-9]{2,4})?\.[a-z0-9]+$')
+UPLOAD_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+def is_content_addressed(name):
+    return bool(name) and CONTENT_ADDRESSED_NAME.match(name) is not None
+
+def upload_path(name):
+    """Filesystem path for an upload name, or None if the name is unsafe."""
+    if is_content_addressed(name):
+        return os.path.join(app.config['UPLOAD_FOLDER'], name[:2], name[2:4], name)
+    return safe_join(app.config['UPLOAD_FOLDER'], name)
+
+def store_upload(file):
+    """Stream an uploaded FileStorage into the store and return its name.
+
+    The hash is computed while writing, so the body is read exactly once.
+    Callers must have checked allowed_file(file.filename).
+    """
+    ext = file.filename.rsplit('.', 1)[1].lower()
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=upload_tmp_dir())
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(1024 * 1024), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        return _place_in_store(tmp_path, digest.hexdigest(), ext)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def store_local_file(src_path, ext):
+    """Move a file produced on this host (e.g. by ffmpeg) into the store."""
+    digest = hashlib.sha256()
+    with open(src_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return _place_in_store(src_path, digest.hexdigest(), ext)
+
+def upload_tmp_dir():
+    """Scratch space on the same filesystem as the store, so moves are atomic renames."""
+    tmp_dir = os.path.join(app.config['UPLOAD_FOLDER'], '.tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    return tmp_dir
+
+def _place_in_store(tmp_path, hexdigest, ext):
+    name = f"{hexdigest}.{ext}"
+    path = upload_path(name)
+    if os.path.exists(path):
+        os.unlink(tmp_path)  # already stored: deduplicated
+        os.utime(path)  # restart gc-uploads' grace period for the new reference
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    return name
+
+def retain_upload(name):
+    """Count one more reference to a stored upload (within the caller's transaction)."""
+    if not is_content_addressed(name):
+        return
+    db.session.execute(db.text(
+        "INSERT INTO upload_blobs (name, size, refcount, created_at) VALUES (:name, :size, 1, :now) "
+        "ON CONFLICT(name) DO UPDATE SET refcount = upload_blobs.refcount + 1"
+    ), {'name': name, 'size': os.path.getsize(upload_path(name)), 'now': datetime.datetime.utcnow()})
+
+def release_upload(name):
+    """Drop one reference; the file itself is only deleted by gc-uploads."""
+    if not is_content_addressed(name):
+        return
+    db.session.execute(db.text(
+        "UPDATE upload_blobs SET refcount = refcount - 1 WHERE name = :name AND refcount > 0"
+    ), {'name': name})
+
+# --- IMAGE VARIANTS ---
+# After an image upload is committed, a background thread pool writes resized
+# AVIF/WebP/JPEG copies next to the original (uploads/ab/cd/<sha256>.w640.webp) and
+# records them in UploadBlob.variants; templates then emit srcset/sizes. Requests
+# never wait for resizing, and pages fall back to the original until it is done.
+RASTER_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp', 'bmp', 'tiff'}
+VARIANT_EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+VARIANT_SAVE_OPTIONS = {
+    'avif': {'quality': 55},
+    'webp': {'quality': 80, 'method': 4},
+    'jpeg': {'quality': 82, 'optimize': True, 'progressive': True},
+}
+_image_executor = None
+_image_executor_lock = threading.Lock()
+
+if Image is None:
+    app.logger.warning("Pillow is not installed; responsive image variants are disabled")
+
+def variant_name(name, width, fmt):
+    return f"{name[:64]}.w{width}.{VARIANT_EXTENSIONS[fmt]}"
+
+def upload_srcset(name, fmt, widths):
+    return ', '.join(f"{url_for('uploaded_file', filename=variant_name(name, w, fmt))} {w}w" for w in widths)
+
+def _variant_formats():
+    formats = ['webp', 'jpeg']
+    if pil_features.check('avif'):
+        formats.insert(0, 'avif')
+    return formats
+
+def render_image_variants(name):
+    """Write the resized copies of one stored image and return {format: [widths]}."""
+    variants = {}
+    with Image.open(upload_path(name)) as original:
+        im = ImageOps.exif_transpose(original)
+        if im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA' if 'A' in im.getbands() or 'transparency' in im.info else 'RGB')
+        for width in sorted(app.config['IMAGE_VARIANT_WIDTHS']):
+            if width >= im.width:
+                break  # never upscale
+            resized = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+            flat = resized
+            if resized.mode == 'RGBA':
+                flat = Image.new('RGB', resized.size, (255, 255, 255))
+                flat.paste(resized, mask=resized.getchannel('A'))
+            for fmt in _variant_formats():
+                path = upload_path(variant_name(name, width, fmt))
+                tmp_path = path + '.tmp'
+                (flat if fmt == 'jpeg' else resized).save(tmp_path, format=fmt.upper(), **VARIANT_SAVE_OPTIONS[fmt])
+                os.replace(tmp_path, path)
+                variants.setdefault(fmt, []).append(width)
+    return variants
+
+def _image_variants_job(name, endpoints):
+    with app.app_context():
+        try:
+            blob = db.session.get(UploadBlob, name)
+            if blob is None or blob.variants is not None:
+                return  # unknown, or already resized for an earlier identical upload
+            blob.variants = json.dumps(render_image_variants(name))
+            db.session.commit()
+            invalidate_pages(*endpoints)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Building image variants failed for %s", name)
+        finally:
+            db.session.remove()
+
+def schedule_image_variants(name, *endpoints):
+    """Queue resizing of a committed upload; endpoints are invalidated when done."""
+    global _image_executor
+    if Image is None or not is_content_addressed(name) or name.rsplit('.', 1)[1] not in RASTER_IMAGE_EXTENSIONS:
+        return
+    with _image_executor_lock:
+        if _image_executor is None:
+            _image_executor = ThreadPoolExecutor(max_workers=app.config['IMAGE_WORKERS'], thread_name_prefix='image-variants')
+    _image_executor.submit(_image_variants_job, name, endpoints)
+
+app.jinja_env.globals['upload_srcset'] = upload_srcset
+
+# --- MEDIA JOBS ---
+# A small durable queue in the media_jobs table. Web workers only insert rows
+# (in the same transaction as the record they belong to); the `media-worker`
+# CLI process claims them one at a time with a conditional UPDATE, so any number
+# of worker processes can run side by side. Handlers are looked up by kind.
+MEDIA_JOB_HANDLERS = {}
+
+class MediaJobError(Exception):
+    """A job failure that retrying cannot fix (bad input, missing ffmpeg)."""
+
+def require_numpy():
+    """Import NumPy on first use; it adds ~0.1 s to startup that web requests never need."""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:  # optional: without NumPy pitch analysis, peaks and sample-bank jobs fail with a clear error
+            raise MediaJobError("NumPy is not installed (pip install -r requirements.txt)")
+        np = numpy
+    return np
+
+def media_job_handler(kind):
+    def register(fn):
+        MEDIA_JOB_HANDLERS[kind] = fn
+        return fn
+    return register
+
+def enqueue_media_job(kind, target):
+    """Add a job to the caller's transaction; it runs after the commit."""
+    db.session.add(MediaJob(kind=kind, target=str(target)))
+
+def claim_media_job(worker_id):
+    """Atomically take the oldest queued job, or return None."""
+    stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=app.config['MEDIA_JOB_STALE_SECONDS'])
+    MediaJob.query.filter(MediaJob.status == 'running', MediaJob.started_at < stale_before) \
+        .update({'status': 'queued', 'worker': None}, synchronize_session=False)
+    db.session.commit()
+    for job in MediaJob.query.filter_by(status='queued').order_by(MediaJob.id).limit(5).all():
+        claimed = MediaJob.query.filter_by(id=job.id, status='queued').update({
+            'status': 'running', 'worker': worker_id, 'started_at': datetime.datetime.utcnow(),
+            'attempts': MediaJob.attempts + 1,
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(MediaJob, job.id, populate_existing=True)
+    return None
+
+def run_media_job(job):
+    handler = MEDIA_JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise MediaJobError(f"no handler for job kind {job.kind!r}")
+        handler(job)
+        job.status, job.error = 'done', None
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(MediaJob, job.id, populate_existing=True)
+        retry = not isinstance(e, MediaJobError) and job.attempts < app.config['MEDIA_JOB_MAX_ATTEMPTS']
+        job.status, job.error = ('queued' if retry else 'failed'), f"{type(e).__name__}: {e}"[:2000]
+        app.logger.exception("Media job %s (%s %s) failed", job.id, job.kind, job.target)
+    job.finished_at = datetime.datetime.utcnow()
+    db.session.commit()
+    return job
+
+def run_ffmpeg(args, tool='ffmpeg', input=None):
+    """Run ffmpeg/ffprobe with a timeout and return stdout; raises MediaJobError if missing.
+
+    `input` bytes are fed to the process (read by ffmpeg as `-i pipe:0`).
+    """
+    binary = shutil.which(tool)
+    if binary is None:
+        raise MediaJobError(f"{tool} is not installed")
+    result = subprocess.run([binary, '-hide_banner', '-nostdin', *args] if tool == 'ffmpeg' else [binary, *args],
+                            input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            timeout=app.config['FFMPEG_TIMEOUT'])
+    if result.returncode != 0:
+        raise RuntimeError(f"{tool} exited with {result.returncode}: {result.stderr.decode('utf-8', 'replace')[-500:]}")
+    return result.stdout
+
+def probe_media(path):
+    info = json.loads(run_ffmpeg(['-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path], tool='ffprobe'))
+    streams = info.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    try:
+        duration = float(info.get('format', {}).get('duration') or 0)
+    except ValueError:
+        duration = 0.0
+    return {
+        'duration': duration,
+        'has_video': video is not None,
+        'has_audio': audio is not None,
+        'width': (video or {}).get('width'),
+        'height': (video or {}).get('height'),
+        'video_codec': (video or {}).get('codec_name'),
+        'audio_codec': (audio or {}).get('codec_name'),
+    }
+
+@media_job_handler('video')
+def _process_gallery_video(job):
+    """Poster frame, short preview clip and a capped H.264/Opus rendition for a Gallery video."""
+    item = db.session.get(Gallery, int(job.target))
+    if item is None:
+        return  # deleted meanwhile
+    item.media_status = 'processing'
+    db.session.commit()
+    invalidate_pages('gallery', 'api_gallery')
+    src = upload_path(item.image)
+    info = probe_media(src)
+    if not info['has_video']:
+        raise MediaJobError("upload has no video stream")
+    rendition, preview = app.config['VIDEO_RENDITION'], app.config['VIDEO_PREVIEW']
+    outputs = {}
+    with tempfile.TemporaryDirectory(dir=upload_tmp_dir()) as work:
+        poster_path = os.path.join(work, 'poster.jpg')
+        seek = f"{min(1.0, info['duration'] / 2):.2f}"
+        run_ffmpeg(['-y', '-ss', seek, '-i', src, '-frames:v', '1',
+                    '-vf', f"scale='min({rendition['max_width']},iw)':-2", '-q:v', '4', poster_path])
+        preview_path = os.path.join(work, 'preview.mp4')
+        run_ffmpeg(['-y', '-ss', seek, '-t', str(preview['seconds']), '-i', src, '-an',
+                    '-vf', f"scale='min({preview['width']},iw)':-2", '-c:v', 'libx264', '-preset', 'veryfast',
+                    '-crf', '30', '-pix_fmt', 'yuv420p', '-movflags', '+faststart', preview_path])
+        rendition_path = os.path.join(work, 'rendition.mp4')
+        audio_args = (['-c:a', 'libopus', '-b:a', rendition['audio_bitrate']] if info['has_audio'] else ['-an'])
+        run_ffmpeg(['-y', '-i', src, '-vf', f"scale='min({rendition['max_width']},iw)':-2",
+                    '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', rendition['video_bitrate'],
+                    '-maxrate', rendition['max_bitrate'], '-bufsize', '2400k', '-pix_fmt', 'yuv420p',
+                    *audio_args, '-movflags', '+faststart', rendition_path])
+        outputs['poster'] = store_local_file(poster_path, 'jpg')
+        outputs['preview'] = store_local_file(preview_path, 'mp4')
+        outputs['rendition'] = store_local_file(rendition_path, 'mp4')
+    item = db.session.get(Gallery, int(job.target), populate_existing=True)
+    if item is None:
+        return
+    for field, name in outputs.items():
+        if getattr(item, field) != name:
+            release_upload(getattr(item, field))
+            retain_upload(name)
+            setattr(item, field, name)
+    item.media_info = json.dumps(info)
+    item.media_status = 'ready'
+    db.session.commit()
+    invalidate_pages('gallery', 'api_gallery')
+
+def _mark_gallery_video_failed(job):
+    if job.kind == 'video' and job.status == 'failed':
+        item = db.session.get(Gallery, int(job.target))
+        if item is not None:
+            item.media_status = 'failed'
+            db.session.commit()
+            invalidate_pages('gallery', 'api_gallery')
+
+# --- PITCH ANALYSIS ---
+# Batch pitch tracking of gallery recordings for teachers. ffmpeg decodes the
+# upload to mono float PCM on a pipe and the samples are analysed block by block
+# with a vectorized YIN (difference function through the FFT), so memory stays
+# flat however long the recording is. Notes and cents follow the vocal detector's
+# noteFromPitch/centsOffFromPitch: A4 = 440 Hz, nearest MIDI note, cents floored.
+# analyse_pitch() only touches the file, so `analyze-pitch` can fan it out over a
+# process pool; the 'pitch' media job runs it inside the media worker.
+PITCH_NOTE_NAMES = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
+
+def _wav_stream_channels(stream):
+    """Channel count from the WAV header on a pipe, leaving `stream` at the samples (None at EOF)."""
+    if len(stream.read(12)) < 12:  # RIFF <size> WAVE
+        return None
+    channels = None
+    while True:
+        header = stream.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, size = struct.unpack('<4sI', header)
+        if chunk_id == b'data':
+            return channels
+        body = stream.read(size + size % 2)
+        if chunk_id == b'fmt ' and len(body) >= 4:
+            channels = struct.unpack_from('<H', body, 2)[0]
+
+def decode_pcm_blocks(path, sample_rate, block_samples, channels=1):
+    """Yield float32 blocks of `path` as ffmpeg decodes it: 1-D when mono, else (samples, channels).
+
+    channels=None keeps mono and stereo sources as they are (more channels are
+    downmixed to stereo); the blocks are then always 2-D.
+    """
+    binary = shutil.which('ffmpeg')
+    if binary is None:
+        raise MediaJobError("ffmpeg is not installed")
+    deadline = time.monotonic() + app.config['FFMPEG_TIMEOUT']
+    if channels is None:
+        # ffmpeg picks the layout, so ask for WAV and read the count from its header
+        output = ['-af', 'aformat=channel_layouts=mono|stereo', '-c:a', 'pcm_f32le', '-fflags', '+bitexact', '-f', 'wav']
+    else:
+        output = ['-ac', str(channels), '-f', 'f32le']
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen([binary, '-hide_banner', '-nostdin', '-v', 'error', '-i', path, '-vn',
+                                 '-ar', str(sample_rate), *output, 'pipe:1'],
+                                stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            flat = channels == 1
+            if channels is None:
+                channels = _wav_stream_channels(proc.stdout) or 1  # no header: ffmpeg failed, reported below
+            frame_bytes = 4 * channels
+            for raw in iter(lambda: proc.stdout.read(block_samples * frame_bytes), b''):
+                if time.monotonic() > deadline:
+                    raise RuntimeError("ffmpeg timed out")
+                samples = np.frombuffer(raw[:len(raw) // frame_bytes * frame_bytes], dtype='<f4')
+                yield samples if flat else samples.reshape(-1, channels)
+            if proc.wait() != 0:
+                stderr.seek(0)
+                raise RuntimeError(f"ffmpeg exited with {proc.returncode}: {stderr.read().decode('utf-8', 'replace')[-500:]}")
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+
+def yin_frames(frames, sample_rate, fmin, fmax, threshold):
+    """F0 in Hz for each row of `frames` (NaN where no period is found)."""
+    n, size = frames.shape
+    tau_min, tau_max = int(sample_rate / fmax), int(np.ceil(sample_rate / fmin)) + 1
+    window = size - tau_max
+    # r(tau) = sum_j x[j] * x[j + tau] for j < window, all frames and lags at once
+    fft_size = 1 << int(np.ceil(np.log2(size + window)))
+    spectrum = np.fft.rfft(frames, fft_size) * np.fft.rfft(frames[:, window - 1::-1], fft_size)
+    r = np.fft.irfft(spectrum, fft_size)[:, window - 1:window - 1 + tau_max]
+    energy = np.concatenate([np.zeros((n, 1)), np.cumsum(frames.astype(np.float64) ** 2, axis=1)], axis=1)
+    energy = energy[:, window:window + tau_max] - energy[:, :tau_max]
+    diff = np.maximum(energy[:, :1] + energy - 2 * r, 0)
+    # Cumulative mean normalized difference
+    cmnd = np.ones_like(diff)
+    cumulative = np.cumsum(diff[:, 1:], axis=1)
+    lags = np.arange(1, tau_max)
+    cmnd[:, 1:] = diff[:, 1:] * lags / np.where(cumulative > 0, cumulative, 1)
+    # First dip below the threshold, followed down to its local minimum
+    search = cmnd[:, tau_min:tau_max - 1]
+    dips = (search < threshold) & (search <= cmnd[:, tau_min + 1:tau_max])
+    found = dips.any(axis=1)
+    tau = np.where(found, dips.argmax(axis=1) + tau_min, 0)
+    # Parabolic interpolation around the chosen lag
+    rows = np.arange(n)
+    t = np.clip(tau, 1, tau_max - 2)
+    left, mid, right = cmnd[rows, t - 1], cmnd[rows, t], cmnd[rows, t + 1]
+    curvature = left + right - 2 * mid
+    shift = np.where(np.abs(curvature) > 1e-12, (left - right) / (2 * np.where(curvature == 0, 1, curvature)), 0)
+    period = t + np.clip(shift, -1, 1)
+    return np.where(found, sample_rate / period, np.nan)
+
+def pitch_contour(path, settings=None):
+    """(hop seconds, float32 array of Hz per hop with NaN when unvoiced) for a media file."""
+    require_numpy()
+    s = settings or app.config['PITCH_ANALYSIS']
+    size, hop, sr = s['frame'], s['hop'], s['sample_rate']
+    contour, carry = [], np.zeros(0, dtype=np.float32)
+    for block in decode_pcm_blocks(path, sr, hop * 512):
+        samples = np.concatenate([carry, block])
+        if len(samples) < size:
+            carry = samples
+            continue
+        frames = np.lib.stride_tricks.sliding_window_view(samples, size)[::hop]
+        rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+        f0 = yin_frames(frames, sr, s['fmin'], s['fmax'], s['threshold'])
+        contour.append(np.where(rms >= s['min_rms'], f0, np.nan).astype(np.float32))
+        carry = samples[len(frames) * hop:]
+    return hop / sr, (np.concatenate(contour) if contour else np.zeros(0, dtype=np.float32))
+
+def note_from_pitch(frequency):
+    """Nearest MIDI note number (noteFromPitch in the vocal detector)."""
+    return np.round(12 * np.log2(frequency / 440.0)).astype(int) + 69
+
+def cents_off_from_pitch(frequency, note):
+    """Cents from the equal-tempered note, floored (centsOffFromPitch)."""
+    return np.floor(1200 * np.log2(frequency / (440.0 * 2.0 ** ((note - 69) / 12.0)))).astype(int)
+
+def pitch_summary(hop_seconds, contour, in_tune_cents):
+    voiced = contour[~np.isnan(contour)]
+    summary = {'duration': round(len(contour) * hop_seconds, 2), 'voiced_ratio': 0.0, 'median_hz': None,
+               'mean_abs_cents': None, 'in_tune_ratio': None, 'lowest_note': None, 'highest_note': None, 'notes': {}}
+    if not len(voiced):
+        return summary
+    notes = note_from_pitch(voiced)
+    cents = cents_off_from_pitch(voiced, notes)
+    name = lambda note: f"{PITCH_NOTE_NAMES[note % 12]}{note // 12 - 1}"
+    counts = np.bincount(notes - notes.min())
+    summary.update(
+        voiced_ratio=round(len(voiced) / len(contour), 3),
+        median_hz=round(float(np.median(voiced)), 2),
+        mean_abs_cents=round(float(np.mean(np.abs(cents))), 1),
+        in_tune_ratio=round(float(np.mean(np.abs(cents) < in_tune_cents)), 3),
+        lowest_note=name(int(notes.min())),
+        highest_note=name(int(notes.max())),
+        # Seconds spent on each note, the most used first
+        notes={name(int(notes.min()) + i): round(int(c) * hop_seconds, 2)
+               for i, c in sorted(enumerate(counts), key=lambda ic: -ic[1]) if c},
+    )
+    return summary
+
+def analyse_pitch(path, settings):
+    """Picklable entry point for worker processes: contour and summary of one file."""
+    hop_seconds, contour = pitch_contour(path, settings)
+    return {
+        'hop_seconds': hop_seconds,
+        'contour': [None if np.isnan(f) else round(float(f), 1) for f in contour],
+        'summary': pitch_summary(hop_seconds, contour, settings['in_tune_cents']),
+    }
+
+def store_pitch_analysis(item, result):
+    analysis = db.session.get(PitchAnalysis, item.id) or PitchAnalysis(gallery_id=item.id)
+    analysis.upload = item.image
+    analysis.hop_seconds = result['hop_seconds']
+    analysis.contour = json.dumps(result['contour'], separators=(',', ':'))
+    analysis.summary = json.dumps(result['summary'])
+    analysis.analysed_at = datetime.datetime.utcnow()
+    db.session.add(analysis)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_pages('api_gallery_pitch')
+
+@media_job_handler('pitch')
+def _process_gallery_pitch(job):
+    item = db.session.get(Gallery, int(job.target))
+    if item is None or item.media_kind == 'image':
+        return
+    store_pitch_analysis(item, analyse_pitch(upload_path(item.image), app.config['PITCH_ANALYSIS']))
+
+# --- WAVEFORM PEAKS ---
+# Every audio/video upload is streamed once through ffmpeg by the 'peaks' media
+# job. On the way through it keeps min/max peaks at several zoom levels and the
+# EBU R128 loudness (BS.1770 K-weighting, gated 400 ms blocks, LRA over 3 s
+# windows). Peaks are stored next to the blob as <sha256>.peaks, a run of
+# audiowaveform .dat blocks (version 2, 8-bit, one per level), so gc-uploads
+# deletes them together with the media; the summary goes to UploadBlob.media_meta.
+# /uploads/<name>/peaks serves one level: a few KB instead of the whole file.
+MEDIA_PEAKS_REVISION = 1  # bump whenever the stored peaks or loudness change
+PEAKS_SAMPLE_RATE = 48000  # the K-weighting coefficients below are for 48 kHz
+PEAKS_BLOCK_SAMPLES = 32768
+PEAKS_DAT_HEADER = struct.Struct('<iIiiIi')  # version, flags (1 = 8-bit), rate, samples/pixel, length, channels
+# BS.1770-4 pre-filter (high shelf) and RLB high-pass as (b, a) biquads at 48 kHz
+K_WEIGHTING_48K = (((1.53512485958697, -2.69169618940638, 1.19839281085285), (1.0, -1.69065929318241, 0.73248077421585)),
+                   ((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621)))
+
+@functools.lru_cache(maxsize=1)
+def k_weighting_response(taps=4096):
+    """Impulse response of the two K-weighting biquads, truncated where it has decayed (< 1e-8)."""
+    x = np.zeros(taps)
+    x[0] = 1.0
+    for b, a in K_WEIGHTING_48K:
+        y, x1, x2, y1, y2 = np.zeros(taps), 0.0, 0.0, 0.0, 0.0
+        for i in range(taps):
+            y[i] = b[0] * x[i] + b[1] * x1 + b[2] * x2 - a[1] * y1 - a[2] * y2
+            x2, x1, y2, y1 = x1, x[i], y1, y[i]
+        x = y
+    return x[:np.flatnonzero(np.abs(x) > 1e-8)[-1] + 1]
+
+def _gated_windows(power, size):
+    """Mean power of every `size`-long run of 100 ms sub-blocks (100 ms hop), absolute gate applied."""
+    if len(power) < size:
+        return np.zeros(0)
+    total = np.concatenate([[0.0], np.cumsum(power)])
+    windows = (total[size:] - total[:-size]) / size
+    return windows[-0.691 + 10 * np.log10(np.maximum(windows, 1e-20)) > -70]
+
+def r128_loudness(power):
+    """(integrated LUFS, loudness range LU) from channel-summed K-weighted power per 100 ms."""
+    lufs = lambda p: -0.691 + 10 * np.log10(p)
+    blocks = _gated_windows(power, 4)  # 400 ms, 75% overlap
+    integrated = None
+    if len(blocks):
+        blocks = blocks[lufs(blocks) > lufs(blocks.mean()) - 10]
+        integrated = round(float(lufs(blocks.mean())), 1)
+    windows = _gated_windows(power, 30)  # 3 s short-term loudness
+    loudness_range = None
+    if len(windows):
+        short_term = lufs(windows)
+        short_term = short_term[short_term > lufs(windows.mean()) - 20]
+        loudness_range = round(float(np.percentile(short_term, 95) - np.percentile(short_term, 10)), 1)
+    return integrated, loudness_range
+
+def peaks_dat(mins, maxs, samples_per_pixel):
+    """One audiowaveform .dat (v2, 8-bit, mono) block."""
+    pairs = np.empty(2 * len(mins), dtype=np.int8)
+    pairs[0::2] = np.clip(np.round(mins * 127), -128, 127)
+    pairs[1::2] = np.clip(np.round(maxs * 127), -128, 127)
+    return PEAKS_DAT_HEADER.pack(2, 1, PEAKS_SAMPLE_RATE, samples_per_pixel, len(mins), 1) + pairs.tobytes()
+
+def analyse_media_peaks(path, levels):
+    """Decode `path` once; return (.peaks bytes, meta dict) with one .dat block per level."""
+    require_numpy()
+    base, sub_block = levels[0], PEAKS_SAMPLE_RATE // 10
+    response = k_weighting_response()
+    overlap = len(response) - 1
+    fft_size = 1 << int(np.ceil(np.log2(PEAKS_BLOCK_SAMPLES + overlap)))
+    spectrum = np.fft.rfft(response, fft_size)[:, None]
+    mins, maxs, powers = [], [], []
+    mono_rest = np.zeros(0, dtype=np.float32)
+    total, peak, channels = 0, 0.0, None
+    for block in decode_pcm_blocks(path, PEAKS_SAMPLE_RATE, PEAKS_BLOCK_SAMPLES, channels=None):
+        if not len(block):
+            continue
+        if channels is None:
+            channels = block.shape[1]
+            history, power_rest = np.zeros((overlap, channels)), np.zeros((0, channels))
+        total += len(block)
+        peak = max(peak, float(np.abs(block).max()))
+        # Min/max of the channel mix per `base` samples; the rest waits for the next block
+        mono = np.concatenate([mono_rest, block.mean(axis=1)])
+        whole = len(mono) // base * base
+        pixels = mono[:whole].reshape(-1, base)
+        mins.append(pixels.min(axis=1))
+        maxs.append(pixels.max(axis=1))
+        mono_rest = mono[whole:]
+        # K-weighting by overlap-save FFT convolution, then mean square per channel and 100 ms
+        signal = np.concatenate([history, block])
+        weighted = np.fft.irfft(np.fft.rfft(signal, fft_size, axis=0) * spectrum, fft_size, axis=0)[overlap:len(signal)]
+        history = signal[-overlap:]
+        power = np.concatenate([power_rest, weighted ** 2])
+        whole = len(power) // sub_block * sub_block
+        # BS.1770 weights left, right (and mono) by 1: the channel powers just add up
+        powers.append(power[:whole].reshape(-1, sub_block, channels).sum(axis=2).mean(axis=1))
+        power_rest = power[whole:]
+    if not total:
+        raise MediaJobError("no audio decoded")
+    if len(mono_rest):
+        mins.append(np.array([mono_rest.min()], dtype=np.float32))  # the last, partial pixel
+        maxs.append(np.array([mono_rest.max()], dtype=np.float32))
+    mins, maxs = np.concatenate(mins), np.concatenate(maxs)
+    integrated, loudness_range = r128_loudness(np.concatenate(powers))
+    chunks, meta_levels, offset = [], [], 0
+    for samples_per_pixel in levels:
+        factor = samples_per_pixel // base
+        padded = -(-len(mins) // factor) * factor
+        level_min = np.pad(mins, (0, padded - len(mins)), constant_values=np.inf).reshape(-1, factor).min(axis=1)
+        level_max = np.pad(maxs, (0, padded - len(maxs)), constant_values=-np.inf).reshape(-1, factor).max(axis=1)
+        chunk = peaks_dat(level_min, level_max, samples_per_pixel)
+        chunks.append(chunk)
+        meta_levels.append({'samples_per_pixel': samples_per_pixel, 'length': len(level_min),
+                            'offset': offset, 'size': len(chunk)})
+        offset += len(chunk)
+    meta = {
+        'revision': MEDIA_PEAKS_REVISION,
+        'duration': round(total / PEAKS_SAMPLE_RATE, 3),
+        'sample_rate': PEAKS_SAMPLE_RATE,
+        'channels': channels,
+        'loudness': {'integrated': integrated, 'range': loudness_range,
+                     'sample_peak': round(20 * math.log10(peak), 1) if peak > 0 else None},
+        'levels': meta_levels,
+    }
+    return b''.join(chunks), meta
+
+def media_peaks_path(name):
+    return upload_path(name[:64] + '.peaks')
+
+def enqueue_upload_analysis(name):
+    """Queue waveform peaks/loudness for a media upload (within the caller's transaction)."""
+    if is_content_addressed(name) and name.rsplit('.', 1)[1] in VIDEO_EXTENSIONS | AUDIO_EXTENSIONS:
+        enqueue_media_job('peaks', name)
+
+@media_job_handler('peaks')
+def _process_media_peaks(job):
+    name = job.target
+    blob = db.session.get(UploadBlob, name)
+    path = upload_path(name)
+    if blob is None or not os.path.exists(path):
+        return  # deleted before the worker got to it
+    if blob.media_meta_dict().get('revision') == MEDIA_PEAKS_REVISION and os.path.exists(media_peaks_path(name)):
+        return  # the same bytes were uploaded again
+    try:
+        data, meta = analyse_media_peaks(path, app.config['MEDIA_PEAKS']['levels'])
+    except RuntimeError as e:
+        if 'does not contain any stream' in str(e):
+            raise MediaJobError("no audio stream")  # silent video: nothing to draw
+        raise
+    fd, tmp_path = tempfile.mkstemp(dir=upload_tmp_dir(), suffix='.peaks')
+    with os.fdopen(fd, 'wb') as out:
+        out.write(data)
+    os.replace(tmp_path, media_peaks_path(name))
+    blob.media_meta = json.dumps(meta)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+# --- SAMPLE BANK ---
+# The ear-training sounds, rendered once with NumPy additive synthesis, encoded by
+# ffmpeg and kept in the content-addressed upload store, so every sample has an
+# immutable /uploads URL. /api/sample-bank lists them; the page decodes each once
+# and renders locally with OfflineAudioContext while the bank is unavailable.
+SAMPLE_BANK_NOTES = (('C', 261.63), ('C#', 277.18), ('D', 293.66), ('D#', 311.13), ('E', 329.63), ('F', 349.23),
+                     ('F#', 369.99), ('G', 392.00), ('G#', 415.30), ('A', 440.00), ('A#', 466.16), ('B', 493.88))
+# name -> (timbre, Hz, seconds); the page plays '<sine|piano>-<note>', 'ding' and 'buzz'
+SAMPLE_BANK_VOICES = {
+    **{f"sine-{note}": ('sine', freq, 1.0) for note, freq in SAMPLE_BANK_NOTES},
+    **{f"piano-{note}": ('piano', freq, 1.5) for note, freq in SAMPLE_BANK_NOTES},
+    'ding': ('sine', 880.0, 0.2),
+    'buzz': ('sawtooth', 150.0, 0.3),
+}
+# name -> (extension, type for the browser's canPlayType, ffmpeg encoder arguments)
+SAMPLE_BANK_FORMATS = {
+    'opus': ('ogg', 'audio/ogg; codecs=opus', ['-c:a', 'libopus', '-b:a', '48k']),
+    'aac': ('m4a', 'audio/mp4; codecs="mp4a.40.2"', ['-c:a', 'aac', '-b:a', '64k']),
+}
+SAMPLE_BANK_REVISION = 1  # bump whenever synthesize_voice() changes how anything sounds
+
+def sample_bank_id():
+    """Short hash of everything that shapes the samples; a new id means a new bank."""
+    settings = app.config['SAMPLE_BANK']
+    spec = json.dumps([SAMPLE_BANK_REVISION, settings['sample_rate'], SAMPLE_BANK_VOICES,
+                       {fmt: SAMPLE_BANK_FORMATS[fmt] for fmt in settings['formats']}], sort_keys=True)
+    return hashlib.sha256(spec.encode('utf-8')).hexdigest()[:12]
+
+def _partials(t, freq, shape, max_freq, lowpass=None):
+    """Band-limited triangle/sawtooth as a sum of sines, optionally through a 2-pole low-pass."""
+    k = np.arange(1, int(max_freq / freq) + 1)
+    if shape == 'triangle':
+        k = k[k % 2 == 1]
+        amps = 8 / np.pi ** 2 * np.where((k // 2) % 2 == 0, 1.0, -1.0) / k ** 2
+    else:
+        amps = 2 / np.pi * np.where(k % 2 == 1, 1.0, -1.0) / k
+    if lowpass:
+        amps = amps / np.sqrt(1 + (k * freq / lowpass) ** 4)
+    return amps @ np.sin(2 * np.pi * freq * np.outer(k, t))
+
+def synthesize_voice(timbre, freq, duration, sample_rate):
+    """Float32 mono samples of one voice: the graphs the page used to build per note."""
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    nyquist = sample_rate / 2
+    if timbre == 'piano':
+        # Two triangles (the second 10 cents sharp) and a sawtooth 10 cents flat into a 2 kHz low-pass
+        cents = lambda c: freq * 2 ** (c / 1200)
+        wave = (_partials(t, freq, 'triangle', 10000, lowpass=2000)
+                + _partials(t, cents(10), 'triangle', 10000, lowpass=2000)
+                + _partials(t, cents(-10), 'sawtooth', 10000, lowpass=2000))
+        attack, peak = 0.02, 0.6
+    elif timbre == 'sawtooth':
+        wave, attack, peak = _partials(t, freq, 'sawtooth', nyquist), 0.05, 0.5
+    else:
+        wave, attack, peak = np.sin(2 * np.pi * freq * t), 0.05, 0.5
+    # Linear attack, then an exponential fall to 0.001 at the end
+    envelope = np.where(t < attack, peak * t / attack,
+                        peak * (0.001 / peak) ** ((t - attack) / (duration - attack)))
+    out = wave * envelope
+    loudest = np.abs(out).max()
+    if loudest > 0.95:
+        out *= 0.95 / loudest  # the live graph clipped at the destination instead
+    return out.astype(np.float32)
+
+def encode_voice(samples, sample_rate, fmt):
+    """Encode float32 samples with ffmpeg and return the stored upload name."""
+    ext, _, codec = SAMPLE_BANK_FORMATS[fmt]
+    with tempfile.TemporaryDirectory(dir=upload_tmp_dir()) as work:
+        out_path = os.path.join(work, f"sample.{ext}")
+        run_ffmpeg(['-y', '-f', 'f32le', '-ar', str(sample_rate), '-ac', '1', '-i', 'pipe:0',
+                    *codec, out_path], input=samples.tobytes())
+        return store_local_file(out_path, ext)
+
+def build_sample_bank():
+    """Render and store every sample the current bank is missing; returns how many were added."""
+    require_numpy()
+    settings = app.config['SAMPLE_BANK']
+    bank, sample_rate = sample_bank_id(), settings['sample_rate']
+    have = {(e.name, e.fmt) for e in SampleBankEntry.query.filter_by(bank=bank)}
+    added = 0
+    for name, voice in SAMPLE_BANK_VOICES.items():
+        missing = [fmt for fmt in settings['formats'] if (name, fmt) not in have]
+        if not missing:
+            continue
+        samples = synthesize_voice(*voice, sample_rate)
+        for fmt in missing:
+            filename = encode_voice(samples, sample_rate, fmt)
+            db.session.add(SampleBankEntry(bank=bank, name=name, fmt=fmt, filename=filename))
+            retain_upload(filename)
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        added += len(missing)
+    # Samples of superseded banks become garbage for gc-uploads
+    stale = SampleBankEntry.query.filter(SampleBankEntry.bank != bank).all()
+    for entry in stale:
+        release_upload(entry.filename)
+        db.session.delete(entry)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if added or stale:
+        invalidate_pages('api_sample_bank')
+    return added
+
+@media_job_handler('sample-bank')
+def _build_sample_bank_job(job):
+    if job.target == sample_bank_id():
+        build_sample_bank()
+
 # --- FRONTEND (HTML/CSS/JS) ---
 
 # Navbar fragment to reuse
@@ -720,6 +2202,9 @@ HEAD_HTML = """
 </head>
 """
 
+# Head with the stylesheet inlined, built once instead of on every request
+LAYOUT_HEAD = HEAD_HTML.replace('{{ styles|safe }}', STYLES_HTML)
+
 BASE_LAYOUT = """
 <!DOCTYPE html>
 <html lang="en" data-bs-theme="light">
@@ -871,47 +2356,145 @@ BASE_LAYOUT = """
 </html>
 """
 
+# Shared "load more" sentinel for keyset-paginated listings. The including page
+# provides #listingGrid, a <template id="listingCardTemplate"> card whose
+# data-* attributes name the JSON fields to fill, and listing_api.
+INFINITE_SCROLL_HTML = """
+{% if next_cursor %}
+<div id="listingSentinel" class="text-center text-white py-4" data-api="{{ listing_api }}" data-next-cursor="{{ next_cursor }}">
+    <a href="?cursor={{ next_cursor }}" class="btn btn-outline-light rounded-pill">Muat lebih banyak</a>
+</div>
+<script>
+(function() {
+    const sentinel = document.getElementById('listingSentinel');
+    const grid = document.getElementById('listingGrid');
+    const cardTemplate = document.getElementById('listingCardTemplate');
+    if (!sentinel || !grid || !cardTemplate) return;
+    let nextCursor = sentinel.dataset.nextCursor;
+    let loading = false;
+    let observer = null;
+
+    function fillCard(root, item) {
+        root.querySelectorAll('[data-if-field]').forEach(el => { if (!item[el.dataset.ifField]) el.remove(); });
+        root.querySelectorAll('[data-field]').forEach(el => { el.textContent = item[el.dataset.field] ?? ''; });
+        root.querySelectorAll('[data-src-field]').forEach(el => { el.src = item[el.dataset.srcField] || ''; });
+        root.querySelectorAll('[data-srcset-field]').forEach(el => {
+            const srcset = item[el.dataset.srcsetField];
+            if (srcset) el.srcset = srcset; else el.removeAttribute('srcset');
+        });
+        root.querySelectorAll('[data-alt-field]').forEach(el => { el.alt = item[el.dataset.altField] || ''; });
+        root.querySelectorAll('[data-dataset-fields]').forEach(el => {
+            el.dataset.datasetFields.split(',').forEach(f => { el.dataset[f] = item[f] ?? ''; });
+        });
+    }
+
+    async function loadMore() {
+        if (loading || !nextCursor) return;
+        loading = true;
+        try {
+            const res = await fetch(sentinel.dataset.api + '?cursor=' + encodeURIComponent(nextCursor), { headers: { 'Accept': 'application/json' } });
+            if (!res.ok) throw new Error('HTTP ' + res.status);
+            const data = await res.json();
+            data.items.forEach(item => {
+                const card = cardTemplate.content.cloneNode(true);
+                fillCard(card, item);
+                grid.appendChild(card);
+            });
+            nextCursor = data.next_cursor;
+            if (!nextCursor) {
+                if (observer) observer.disconnect();
+                sentinel.remove();
+            }
+        } catch (err) {
+            console.error('Gagal memuat data berikutnya:', err);
+        } finally {
+            loading = false;
+        }
+    }
+
+    if ('IntersectionObserver' in window) {
+        observer = new IntersectionObserver(entries => {
+            if (entries.some(e => e.isIntersecting)) loadMore();
+        }, { rootMargin: '600px 0px' });
+        observer.observe(sentinel);
+    }
+    sentinel.querySelector('a').addEventListener('click', e => { e.preventDefault(); loadMore(); });
+})();
+</script>
+{% endif %}
+"""
+
+# Lazy, responsive <img> for an upload. When resized variants exist (see IMAGE
+# VARIANTS) it becomes a <picture> with AVIF/WebP sources and a JPEG srcset.
+# `attrs` is trusted markup written by template authors, never user data.
+MEDIA_MACROS_HTML = """
+{% macro responsive_img(name, blob, sizes, cls='', alt='', attrs='') -%}
+{%- set variants = blob.variant_map() if blob else {} -%}
+{%- if variants %}<picture>{% for fmt in ('avif', 'webp') if variants.get(fmt) %}<source type="image/{{ fmt }}" srcset="{{ upload_srcset(name, fmt, variants[fmt]) }}" sizes="{{ sizes }}">{% endfor %}{% endif -%}
+<img src="/uploads/{{ name }}"{% if variants.get('jpeg') %} srcset="{{ upload_srcset(name, 'jpeg', variants['jpeg']) }}"{% endif %} sizes="{{ sizes }}" class="{{ cls }}" alt="{{ alt }}" loading="lazy" decoding="async" {{ attrs|safe }}>
+{%- if variants %}</picture>{% endif -%}
+{%- endmacro %}
+"""
+
 # --- ROUTES ---
 
-def render_layout(content, scripts="", **kwargs):
-    # Prepare global variables like bg_image
-    bg_image = "default.jpg"
-    if os.path.exists('bg_config.txt'):
-        with open('bg_config.txt', 'r') as f:
-            c = f.read().strip()
-            if c: bg_image = c
-            
-    logo_file = None
-    if os.path.exists('logo_config.txt'):
-         with open('logo_config.txt', 'r') as f:
-            c = f.read().strip()
-            if c: logo_file = c
-
-    # Pre-render the content fragment so Jinja tags inside it are processed
-    rendered_content = render_template_string(content, **kwargs)
-            
-    # Render fragments
-    head = HEAD_HTML.replace('{{ styles|safe }}', STYLES_HTML)
-    navbar = NAVBAR_HTML # Jinja context will handle logo_file/bg_image if passed
+def render_layout(template_name, scripts="", **kwargs):
+    # Prepare global variables like bg_image (served from the in-memory settings cache)
+    settings = get_site_settings()
+    bg_image = settings.get('bg_image') or "default.jpg"
+    logo_file = settings.get('logo_file') or None
+
+    # Render the precompiled page fragment so Jinja tags inside it are processed
+    rendered_content = render_template(template_name, **kwargs)
     
-    # Render Base Layout
-    # Use render_template_string for the base layout
+    # Render Base Layout (head is assembled once at import, see LAYOUT_HEAD)
     # Pass all kwargs plus calculated ones
-    return render_template_string(BASE_LAYOUT, 
-                                  head=head, 
-                                  navbar=render_template_string(navbar, logo_file=logo_file), 
-                                  content=rendered_content,
-                                  scripts=scripts,
-                                  bg_image=bg_image,
-                                  **kwargs)
+    return render_template('layout.html', 
+                           head=LAYOUT_HEAD, 
+                           navbar=render_template('navbar.html', logo_file=logo_file), 
+                           content=rendered_content,
+                           scripts=scripts,
+                           bg_image=bg_image,
+                           **kwargs)
 
 @app.route('/')
+@cached_page
 def index():
-    return render_layout(HTML_DOREMI_CONTENT)
+    return render_layout('doremi.html')
+
+def create_gallery_item(filename, *, student_name, title, idempotency_key=None):
+    """Add a Gallery row for a stored upload; a reused idempotency key adds nothing."""
+    new_item = Gallery(image=filename, student_name=student_name, title=title, idempotency_key=idempotency_key)
+    try:
+        db.session.add(new_item)
+        retain_upload(filename)
+        if new_item.media_kind == 'video':
+            new_item.media_status = 'queued'
+        if new_item.media_kind in ('video', 'audio'):
+            db.session.flush()
+            if new_item.media_kind == 'video':
+                enqueue_media_job('video', new_item.id)
+            enqueue_media_job('pitch', new_item.id)
+            enqueue_upload_analysis(filename)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if idempotent_retry_won(Gallery, idempotency_key):
+            return
+        raise
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_pages('gallery', 'api_gallery')
+    schedule_image_variants(filename, 'gallery', 'api_gallery')
 
 @app.route('/gallery', methods=['GET', 'POST'])
+@cached_page
 def gallery():
     if request.method == 'POST':
+        idempotency_key = request_idempotency_key()
+        if idempotency_key and Gallery.query.filter_by(idempotency_key=idempotency_key).first() is not None:
+            return redirect(url_for('gallery'))  # retry of an upload that already went through
         if 'image' not in request.files:
             return redirect(request.url)
         file = request.files['image']
@@ -919,19 +2502,49 @@ def gallery():
         title = request.form['title']
         
         if file and file.filename != '' and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            
-            new_item = Gallery(image=filename, student_name=student_name, title=title)
-            db.session.add(new_item)
-            db.session.commit()
+            filename = store_upload(file)
+            create_gallery_item(filename, student_name=student_name, title=title, idempotency_key=idempotency_key)
             
             return redirect(url_for('gallery'))
             
-    items = Gallery.query.order_by(Gallery.created_at.desc()).all()
-    return render_layout(GALLERY_HTML_CONTENT, items=items)
+    items, next_cursor = _listing_page_or_400('gallery')
+    return render_layout('gallery.html', items=items, next_cursor=next_cursor)
 
 GALLERY_HTML_CONTENT = """
+{% from 'media.html' import responsive_img %}
+{% macro gallery_card(item) %}
+        <div class="col-6 col-md-4 col-lg-3">
+            <div class="card h-100 bg-transparent border-0">
+                <div class="position-relative overflow-hidden rounded-3 shadow-sm bg-dark js-media-frame" style="padding-top: 100%;">
+                    {% if item['media_kind'] in ('video', 'audio') %}
+                    {% if item['poster'] %}
+                    <img src="/uploads/{{ item['poster'] }}" class="position-absolute top-0 start-0 w-100 h-100 object-fit-cover" alt="{{ item['title'] }}" loading="lazy" decoding="async">
+                    {% else %}
+                    <i class="fas {{ 'fa-film' if item['media_kind'] == 'video' else 'fa-music' }} fa-3x text-white opacity-50 position-absolute top-50 start-50 translate-middle"></i>
+                    {% endif %}
+                    {% else %}
+                    {{ responsive_img(item['image'], item['blob'], '(min-width: 992px) 25vw, (min-width: 768px) 33vw, 50vw',
+                                      cls='position-absolute top-0 start-0 w-100 h-100 object-fit-cover', alt=item['title'],
+                                      attrs='data-if-field="image_url" data-src-field="image_url" data-srcset-field="image_srcset" data-alt-field="title"') }}
+                    {% endif %}
+                    {% if not item or item['media_kind'] in ('video', 'audio') %}
+                    <button type="button" class="btn btn-light rounded-circle shadow position-absolute top-50 start-50 translate-middle js-play-media" style="width: 56px; height: 56px;"
+                            data-if-field="video_url" data-dataset-fields="video_url,preview_url,media_kind" aria-label="Putar"
+                            data-video_url="{{ item['video_url'] or '' }}" data-preview_url="{{ item['preview_url'] or '' }}" data-media_kind="{{ item['media_kind'] or '' }}">
+                        <i class="fas fa-play"></i>
+                    </button>
+                    {% endif %}
+                    {% if not item or item['media_status'] in ('queued', 'processing') %}
+                    <span class="badge bg-dark bg-opacity-75 position-absolute bottom-0 start-0 m-2" data-if-field="media_pending"><i class="fas fa-cog fa-spin me-1"></i>Memproses video…</span>
+                    {% endif %}
+                </div>
+                <div class="card-body px-0 py-2 text-white">
+                    <h5 class="card-title fw-bold mb-1 fs-6" data-field="title">{{ item['title'] }}</h5>
+                    <p class="card-text small opacity-75"><i class="fas fa-user me-1"></i> <span data-field="student_name">{{ item['student_name'] }}</span></p>
+                </div>
+            </div>
+        </div>
+{% endmacro %}
 <div class="container glass-panel p-4 mb-5 position-relative" style="border-radius: 20px;">
     <a href="/" class="position-absolute top-0 end-0 m-3 text-white text-decoration-none" style="font-size: 1.5rem; opacity: 0.7; transition: 0.2s;" onmouseover="this.style.opacity=1" onmouseout="this.style.opacity=0.7"><i class="fas fa-times"></i></a>
 
@@ -942,19 +2555,9 @@ GALLERY_HTML_CONTENT = """
         </button>
     </div>
     
-    <div class="row g-4">
+    <div class="row g-4" id="listingGrid">
         {% for item in items %}
-        <div class="col-6 col-md-4 col-lg-3">
-            <div class="card h-100 bg-transparent border-0">
-                <div class="position-relative overflow-hidden rounded-3 shadow-sm" style="padding-top: 100%;">
-                    <img src="/uploads/{{ item['image'] }}" class="position-absolute top-0 start-0 w-100 h-100 object-fit-cover" alt="{{ item['title'] }}">
-                </div>
-                <div class="card-body px-0 py-2 text-white">
-                    <h5 class="card-title fw-bold mb-1 fs-6">{{ item['title'] }}</h5>
-                    <p class="card-text small opacity-75"><i class="fas fa-user me-1"></i> {{ item['student_name'] }}</p>
-                </div>
-            </div>
-        </div>
+        {{ gallery_card(item) }}
         {% else %}
         <div class="col-12 text-center text-white py-5">
             <i class="fas fa-image fa-3x mb-3 opacity-50"></i>
@@ -962,7 +2565,9 @@ GALLERY_HTML_CONTENT = """
         </div>
         {% endfor %}
     </div>
+    {% with listing_api='/api/gallery' %}{% include 'infinite_scroll.html' %}{% endwith %}
 </div>
+<template id="listingCardTemplate">{{ gallery_card({}) }}</template>
 
 <!-- Upload Modal -->
 <div class="modal fade" id="uploadModal" tabindex="-1" style="z-index: 99999;">
@@ -983,8 +2588,8 @@ GALLERY_HTML_CONTENT = """
                         <input type="text" name="title" class="form-control bg-transparent text-white" required>
                     </div>
                     <div class="mb-3">
-                        <label class="form-label">File Gambar</label>
-                        <input type="file" name="image" class="form-control bg-transparent text-white" accept="image/*" required>
+                        <label class="form-label">File Gambar / Video</label>
+                        <input type="file" name="image" class="form-control bg-transparent text-white" accept="image/*,video/mp4,video/webm" required>
                     </div>
                 </div>
                 <div class="modal-footer border-0">
@@ -995,11 +2600,69 @@ GALLERY_HTML_CONTENT = """
         </div>
     </div>
 </div>
+
+<script>
+    // Cards are also appended by infinite scroll, so all media handlers are delegated.
+    // Click swaps the poster for a player on the rendition; hovering plays the short muted preview.
+    document.addEventListener('click', function (e) {
+        const btn = e.target.closest('.js-play-media');
+        if (!btn || !btn.dataset.video_url) return;
+        const frame = btn.closest('.js-media-frame');
+        const player = document.createElement(btn.dataset.media_kind === 'audio' ? 'audio' : 'video');
+        player.src = btn.dataset.video_url;
+        player.controls = true;
+        player.autoplay = true;
+        player.playsInline = true;
+        player.preload = 'metadata';
+        player.className = 'position-absolute top-0 start-0 w-100 h-100 bg-black';
+        frame.querySelectorAll('img, video, i, .badge').forEach(el => el.remove());
+        btn.replaceWith(player);
+    });
+    document.addEventListener('pointerover', function (e) {
+        if (e.pointerType !== 'mouse') return;
+        const btn = e.target.closest('.js-media-frame')?.querySelector('.js-play-media');
+        if (!btn || !btn.dataset.preview_url || btn.parentElement.querySelector('video.js-preview')) return;
+        const preview = document.createElement('video');
+        preview.src = btn.dataset.preview_url;
+        preview.muted = true;
+        preview.loop = true;
+        preview.autoplay = true;
+        preview.playsInline = true;
+        preview.className = 'position-absolute top-0 start-0 w-100 h-100 object-fit-cover js-preview';
+        preview.style.pointerEvents = 'none';
+        btn.before(preview);
+        const frame = btn.parentElement;
+        frame.addEventListener('pointerleave', () => preview.remove(), { once: true });
+    });
+</script>
 """
 
+def create_tutor(filename, *, name, bio, idempotency_key=None):
+    """Add a Tutors row for a stored upload; a reused idempotency key adds nothing."""
+    new_tutor = Tutors(image=filename, name=name, bio=bio, idempotency_key=idempotency_key)
+    try:
+        db.session.add(new_tutor)
+        retain_upload(filename)
+        enqueue_upload_analysis(filename)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if idempotent_retry_won(Tutors, idempotency_key):
+            return
+        raise
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_pages('tutors', 'api_tutors')
+    schedule_image_variants(filename, 'tutors', 'api_tutors')
+
 @app.route('/tutors', methods=['GET', 'POST'])
+@cached_page
 def tutors():
     if request.method == 'POST':
+        idempotency_key = request_idempotency_key()
+        if idempotency_key and Tutors.query.filter_by(idempotency_key=idempotency_key).first() is not None:
+            return redirect(url_for('tutors'))  # retry of an upload that already went through
         if 'image' not in request.files:
             return redirect(request.url)
         file = request.files['image']
@@ -1007,19 +2670,30 @@ def tutors():
         bio = request.form['bio']
         
         if file and file.filename != '' and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            
-            new_tutor = Tutors(image=filename, name=name, bio=bio)
-            db.session.add(new_tutor)
-            db.session.commit()
+            filename = store_upload(file)
+            create_tutor(filename, name=name, bio=bio, idempotency_key=idempotency_key)
             
             return redirect(url_for('tutors'))
             
-    items = Tutors.query.order_by(Tutors.created_at.desc()).all()
-    return render_layout(TUTORS_HTML_CONTENT, items=items)
+    items, next_cursor = _listing_page_or_400('tutors')
+    return render_layout('tutors.html', items=items, next_cursor=next_cursor)
 
 TUTORS_HTML_CONTENT = """
+{% from 'media.html' import responsive_img %}
+{% macro tutor_card(item) %}
+        <div class="col-md-6 col-lg-4">
+            <div class="d-flex align-items-center p-3 glass-panel" style="background: rgba(255,255,255,0.05); border-radius: 15px;">
+                <div class="flex-shrink-0">
+                    {{ responsive_img(item['image'], item['blob'], '80px', cls='rounded-circle object-fit-cover', alt=item['name'],
+                                      attrs='data-src-field="image_url" data-srcset-field="image_srcset" data-alt-field="name" width="80" height="80" style="border: 2px solid rgba(255,255,255,0.5);"') }}
+                </div>
+                <div class="flex-grow-1 ms-3 text-white">
+                    <h5 class="mb-1 fw-bold" data-field="name">{{ item['name'] }}</h5>
+                    <p class="mb-0 small opacity-75" data-field="bio">{{ item['bio'] }}</p>
+                </div>
+            </div>
+        </div>
+{% endmacro %}
 <div class="container glass-panel p-4 mb-5 position-relative" style="border-radius: 20px;">
     <a href="/" class="position-absolute top-0 end-0 m-3 text-white text-decoration-none" style="font-size: 1.5rem; opacity: 0.7; transition: 0.2s;" onmouseover="this.style.opacity=1" onmouseout="this.style.opacity=0.7"><i class="fas fa-times"></i></a>
 
@@ -1030,19 +2704,9 @@ TUTORS_HTML_CONTENT = """
         </button>
     </div>
     
-    <div class="row g-4">
+    <div class="row g-4" id="listingGrid">
         {% for item in items %}
-        <div class="col-md-6 col-lg-4">
-            <div class="d-flex align-items-center p-3 glass-panel" style="background: rgba(255,255,255,0.05); border-radius: 15px;">
-                <div class="flex-shrink-0">
-                    <img src="/uploads/{{ item['image'] }}" class="rounded-circle object-fit-cover" width="80" height="80" alt="{{ item['name'] }}" style="border: 2px solid rgba(255,255,255,0.5);">
-                </div>
-                <div class="flex-grow-1 ms-3 text-white">
-                    <h5 class="mb-1 fw-bold">{{ item['name'] }}</h5>
-                    <p class="mb-0 small opacity-75">{{ item['bio'] }}</p>
-                </div>
-            </div>
-        </div>
+        {{ tutor_card(item) }}
         {% else %}
         <div class="col-12 text-center text-white py-5">
             <i class="fas fa-user-tie fa-3x mb-3 opacity-50"></i>
@@ -1050,7 +2714,9 @@ TUTORS_HTML_CONTENT = """
         </div>
         {% endfor %}
     </div>
+    {% with listing_api='/api/tutors' %}{% include 'infinite_scroll.html' %}{% endwith %}
 </div>
+<template id="listingCardTemplate">{{ tutor_card({}) }}</template>
 
 <!-- Tutor Modal -->
 <div class="modal fade" id="tutorModal" tabindex="-1" style="z-index: 99999;">
@@ -1086,6 +2752,7 @@ TUTORS_HTML_CONTENT = """
 """
 
 @app.route('/pricing', methods=['GET', 'POST'])
+@cached_page
 def pricing():
     if request.method == 'POST':
         title = request.form['title']
@@ -1095,16 +2762,18 @@ def pricing():
         new_pricing = Pricing(title=title, price=price, details=details)
         db.session.add(new_pricing)
         db.session.commit()
+        invalidate_pages('pricing')
         
         return redirect(url_for('pricing'))
             
-    items = Pricing.query.order_by(Pricing.created_at.asc()).all()
-    return render_layout(PRICING_HTML_CONTENT, items=items)
+    items = pricing_listing().all()
+    return render_layout('pricing.html', items=items)
 
 @app.route('/delete_pricing/<int:id>', methods=['POST'])
 def delete_pricing(id):
     Pricing.query.filter_by(id=id).delete()
     db.session.commit()
+    invalidate_pages('pricing')
     return redirect(url_for('pricing'))
 
 PRICING_HTML_CONTENT = """
@@ -1187,6 +2856,7 @@ PRICING_HTML_CONTENT = """
 """
 
 @app.route('/slots', methods=['GET', 'POST'])
+@cached_page
 def slots():
     if request.method == 'POST':
         if 'day' in request.form:
@@ -1199,6 +2869,7 @@ def slots():
             new_slot = Slots(day=day, time=time, status=status, type=type_val)
             db.session.add(new_slot)
             db.session.commit()
+            invalidate_pages('slots')
             
         elif 'toggle_id' in request.form:
             # Toggle Status
@@ -1207,11 +2878,12 @@ def slots():
             if slot:
                 slot.status = 'Booked' if slot.status == 'Available' else 'Available'
                 db.session.commit()
+                invalidate_pages('slots')
             
         return redirect(url_for('slots'))
             
     # Fetch and Group Slots
-    slots_raw = Slots.query.order_by(Slots.day, Slots.time).all()
+    slots_raw = slots_listing().all()
     
     # Simple grouping
     days_order = ['Senin', 'Selasa', 'Rabu', 'Kamis', 'Jumat', 'Sabtu', 'Minggu']
@@ -1221,7 +2893,7 @@ def slots():
         if slot['day'] in grouped_slots:
             grouped_slots[slot['day']].append(slot)
             
-    return render_layout(SLOTS_HTML_CONTENT, grouped_slots=grouped_slots)
+    return render_layout('slots.html', grouped_slots=grouped_slots)
 
 SLOTS_HTML_CONTENT = """
 <div class="container glass-panel p-4 mb-5 position-relative" style="border-radius: 20px;">
@@ -1311,6 +2983,7 @@ SLOTS_HTML_CONTENT = """
 """
 
 @app.route('/join', methods=['GET', 'POST'])
+@cached_page
 def join_us():
     if request.method == 'POST':
         from urllib.parse import quote
@@ -1328,7 +3001,7 @@ def join_us():
         
         return redirect(wa_url)
     
-    return render_layout(JOIN_HTML_CONTENT)
+    return render_layout('join.html')
 
 JOIN_HTML_CONTENT = """
 <div class="container glass-panel p-4 mb-5 position-relative" style="border-radius: 20px; max-width: 600px;">
@@ -1367,9 +3040,33 @@ JOIN_HTML_CONTENT = """
 </div>
 """
 
+def create_news_item(filename, *, title, content, date, idempotency_key=None):
+    """Add a News row (with an optional stored upload); a reused idempotency key adds nothing."""
+    new_news = News(title=title, content=content, date=date, image=filename, idempotency_key=idempotency_key)
+    try:
+        db.session.add(new_news)
+        retain_upload(filename)
+        enqueue_upload_analysis(filename)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if idempotent_retry_won(News, idempotency_key):
+            return
+        raise
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_pages('news', 'api_news')
+    if filename:
+        schedule_image_variants(filename, 'news', 'api_news')
+
 @app.route('/news', methods=['GET', 'POST'])
+@cached_page
 def news():
     if request.method == 'POST':
+        idempotency_key = request_idempotency_key()
+        if idempotency_key and News.query.filter_by(idempotency_key=idempotency_key).first() is not None:
+            return redirect(url_for('news'))  # retry of a post that already went through
         title = request.form['title']
         content = request.form['content']
         date = request.form['date']
@@ -1378,19 +3075,16 @@ def news():
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename != '' and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+                filename = store_upload(file)
         else:
              filename = ""
         
-        new_news = News(title=title, content=content, date=date, image=filename)
-        db.session.add(new_news)
-        db.session.commit()
+        create_news_item(filename, title=title, content=content, date=date, idempotency_key=idempotency_key)
         
         return redirect(url_for('news'))
             
-    items = News.query.order_by(News.date.desc(), News.created_at.desc()).all()
-    return render_layout(NEWS_HTML_CONTENT, items=items)
+    items, next_cursor = _listing_page_or_400('news')
+    return render_layout('news.html', items=items, next_cursor=next_cursor)
 
 @app.route('/edit_news/<int:id>', methods=['POST'])
 def edit_news(id):
@@ -1409,14 +3103,43 @@ def edit_news(id):
     if 'image' in request.files:
         file = request.files['image']
         if file and file.filename != '' and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            news_item.image = filename
+            filename = store_upload(file)
+            if filename != news_item.image:
+                release_upload(news_item.image)
+                retain_upload(filename)
+                enqueue_upload_analysis(filename)
+                news_item.image = filename
                      
     db.session.commit()
+    invalidate_pages('news', 'api_news')
+    if news_item.image:
+        schedule_image_variants(news_item.image, 'news', 'api_news')
     return redirect(url_for('news'))
 
 NEWS_HTML_CONTENT = """
+{% from 'media.html' import responsive_img %}
+{% macro news_card(item, placeholder=false) %}
+        <div class="col-md-6 col-lg-4">
+            <div class="card h-100 bg-transparent glass-panel border-0 overflow-hidden position-relative" style="border-radius: 20px;">
+                <button class="btn btn-warning btn-sm rounded-circle position-absolute top-0 end-0 m-3 shadow js-edit-news" style="z-index: 10;" 
+                        data-dataset-fields="id,title,date,content" data-id="{{ item['id'] }}" data-title="{{ item['title'] }}" data-date="{{ item['date'] }}" data-content="{{ item['content'] }}">
+                    <i class="fas fa-pencil-alt"></i>
+                </button>
+                {% if item['image'] or placeholder %}
+                <div class="position-relative" style="height: 200px;" data-if-field="image_url">
+                    {{ responsive_img(item['image'], item['blob'], '(min-width: 992px) 33vw, (min-width: 768px) 50vw, 100vw',
+                                      cls='w-100 h-100 object-fit-cover', alt=item['title'],
+                                      attrs='data-src-field="image_url" data-srcset-field="image_srcset" data-alt-field="title"') }}
+                </div>
+                {% endif %}
+                <div class="card-body text-white">
+                    <small class="text-white opacity-50 mb-2 d-block"><i class="far fa-calendar-alt me-1"></i> <span data-field="date">{{ item['date'] }}</span></small>
+                    <h5 class="card-title fw-bold mb-3" data-field="title">{{ item['title'] }}</h5>
+                    <p class="card-text opacity-75 small" data-field="content">{{ item['content'] }}</p>
+                </div>
+            </div>
+        </div>
+{% endmacro %}
 <div class="container glass-panel p-4 mb-5 position-relative" style="border-radius: 20px;">
     <a href="/" class="position-absolute top-0 end-0 m-3 text-white text-decoration-none" style="font-size: 1.5rem; opacity: 0.7; transition: 0.2s;" onmouseover="this.style.opacity=1" onmouseout="this.style.opacity=0.7"><i class="fas fa-times"></i></a>
 
@@ -1427,26 +3150,9 @@ NEWS_HTML_CONTENT = """
         </button>
     </div>
     
-    <div class="row g-4">
+    <div class="row g-4" id="listingGrid">
         {% for item in items %}
-        <div class="col-md-6 col-lg-4">
-            <div class="card h-100 bg-transparent glass-panel border-0 overflow-hidden position-relative" style="border-radius: 20px;">
-                <button class="btn btn-warning btn-sm rounded-circle position-absolute top-0 end-0 m-3 shadow" style="z-index: 10;" 
-                        onclick='editNews({{ item["id"] }}, {{ item["title"]|tojson }}, {{ item["date"]|tojson }}, {{ item["content"]|tojson }})'>
-                    <i class="fas fa-pencil-alt"></i>
-                </button>
-                {% if item['image'] %}
-                <div class="position-relative" style="height: 200px;">
-                    <img src="/uploads/{{ item['image'] }}" class="w-100 h-100 object-fit-cover" alt="{{ item['title'] }}">
-                </div>
-                {% endif %}
-                <div class="card-body text-white">
-                    <small class="text-white opacity-50 mb-2 d-block"><i class="far fa-calendar-alt me-1"></i> {{ item['date'] }}</small>
-                    <h5 class="card-title fw-bold mb-3">{{ item['title'] }}</h5>
-                    <p class="card-text opacity-75 small">{{ item['content'] }}</p>
-                </div>
-            </div>
-        </div>
+        {{ news_card(item) }}
         {% else %}
         <div class="col-12 text-center text-white py-5">
             <i class="fas fa-newspaper fa-3x mb-3 opacity-50"></i>
@@ -1454,7 +3160,9 @@ NEWS_HTML_CONTENT = """
         </div>
         {% endfor %}
     </div>
+    {% with listing_api='/api/news' %}{% include 'infinite_scroll.html' %}{% endwith %}
 </div>
+<template id="listingCardTemplate">{{ news_card({}, placeholder=true) }}</template>
 
 <!-- News Modal -->
 <div class="modal fade" id="newsModal" tabindex="-1" style="z-index: 99999;">
@@ -1507,6 +3215,12 @@ NEWS_HTML_CONTENT = """
         modal.show();
     }
     
+    // Edit buttons also exist on cards appended by infinite scroll, so delegate
+    document.addEventListener('click', function (e) {
+        const btn = e.target.closest('.js-edit-news');
+        if (btn) editNews(btn.dataset.id, btn.dataset.title, btn.dataset.date, btn.dataset.content);
+    });
+    
     // Reset form when modal is hidden
     const newsModalEl = document.getElementById('newsModal');
     if (newsModalEl) {
@@ -1521,10 +3235,34 @@ NEWS_HTML_CONTENT = """
 """
 
 @app.route('/metronome')
+@cached_page
 def metronome():
-    return render_layout(METRONOME_HTML_CONTENT)
+    return render_layout('metronome.html')
+
+@app.route('/metronome/clock-worklet.js')
+@cached_page(mimetype='application/javascript')
+def metronome_clock():
+    return render_template('metronome_clock.js')
 
 METRONOME_HTML_CONTENT = """
+<style>
+    #visual-beat {
+        width: 200px; height: 200px;
+        border: 2px solid rgba(255,255,255,0.1);
+        opacity: 0;
+        transform: translate(-50%, -50%) scale(1);
+        transition: transform 0.1s, opacity 0.1s;
+        pointer-events: none;
+    }
+    #visual-beat.beat-on { opacity: 1; transform: translate(-50%, -50%) scale(1.2); border-color: rgba(255,255,255,0.5); }
+    #visual-beat.beat-accent { border-color: #ffc107; }
+    .beat-dots { display: flex; justify-content: center; gap: 10px; min-height: 14px; }
+    .beat-dot { width: 14px; height: 14px; border-radius: 50%; background: rgba(255,255,255,0.15); transition: background 0.05s; }
+    .beat-dot.active { background: rgba(255,255,255,0.85); }
+    .beat-dot.accent.active { background: #ffc107; }
+    .timing-stats { font-family: monospace; font-size: 0.8rem; text-align: left; }
+</style>
+
 <div class="container d-flex justify-content-center align-items-center" style="min-height: 60vh;">
     <div class="glass-panel p-5 text-center position-relative overflow-hidden" style="border-radius: 30px; width: 100%; max-width: 400px; backdrop-filter: blur(20px);">
         
@@ -1536,98 +3274,264 @@ METRONOME_HTML_CONTENT = """
             <div class="display-1 fw-bold text-white" id="bpm-val">120</div>
             <span class="text-white-50 text-uppercase small letter-spacing-2">BPM</span>
             
-            <div id="visual-beat" class="position-absolute top-50 start-50 translate-middle rounded-circle" 
-                 style="width: 200px; height: 200px; border: 2px solid rgba(255,255,255,0.1); opacity: 0; transition: transform 0.1s, opacity 0.1s; pointer-events: none;"></div>
+            <div id="visual-beat" class="position-absolute top-50 start-50 rounded-circle"></div>
         </div>
         
+        <div class="beat-dots mb-4" id="beat-dots"></div>
+        
         <input type="range" class="form-range mb-4" min="40" max="240" value="120" id="bpm-slider">
         
-        <div class="d-flex justify-content-center gap-3 mb-5">
+        <div class="d-flex justify-content-center gap-3 mb-4">
             <button class="btn btn-outline-light rounded-circle p-3" onclick="adjustBPM(-1)"><i class="fas fa-minus"></i></button>
             <button class="btn btn-outline-light rounded-circle p-3" onclick="adjustBPM(1)"><i class="fas fa-plus"></i></button>
         </div>
         
+        <div class="row g-2 mb-4">
+            <div class="col-6">
+                <select id="time-signature" class="form-select bg-dark text-white border-secondary">
+                    <option value="2">2/4</option>
+                    <option value="3">3/4</option>
+                    <option value="4" selected>4/4</option>
+                    <option value="5">5/4</option>
+                    <option value="6">6/8</option>
+                    <option value="7">7/8</option>
+                </select>
+            </div>
+            <div class="col-6">
+                <select id="subdivision" class="form-select bg-dark text-white border-secondary">
+                    <option value="1" selected>Ketukan</option>
+                    <option value="2">1/8 (2x)</option>
+                    <option value="3">Triol (3x)</option>
+                    <option value="4">1/16 (4x)</option>
+                </select>
+            </div>
+        </div>
+        
         <button class="btn btn-primary btn-lg rounded-pill w-100 py-3 fw-bold shadow-lg" id="play-btn">
             <i class="fas fa-play me-2"></i> START
         </button>
+        
+        <div class="form-check form-switch d-inline-block mt-4">
+            <input class="form-check-input" type="checkbox" id="measure-toggle">
+            <label class="form-check-label text-white-50 small" for="measure-toggle">Ukur drift &amp; jitter</label>
+        </div>
+        <div id="timing-stats" class="timing-stats text-white-50 mt-2 d-none"></div>
     </div>
 </div>
 
 <script>
+    // Prerendered click sounds: [frequency Hz, peak gain]
+    const CLICK_SOUNDS = { accent: [1500, 0.9], beat: [1000, 0.7], sub: [800, 0.35] };
+    const CLICK_SECONDS = 0.04;
+    // Scheduled clicks waiting to be drawn; the oldest is overwritten when full
+    const BEAT_QUEUE_SIZE = 64;
+    // An onset further than this from every scheduled click is not one of ours
+    const ONSET_MATCH_WINDOW = 0.02;
+
+    // Running mean / standard deviation / worst case (Welford)
+    class TimingStats {
+        constructor() { this.reset(); }
+        reset() { this.count = 0; this.mean = 0; this.m2 = 0; this.worst = 0; }
+        add(x) {
+            this.count++;
+            const delta = x - this.mean;
+            this.mean += delta / this.count;
+            this.m2 += delta * (x - this.mean);
+            if (Math.abs(x) > Math.abs(this.worst)) this.worst = x;
+        }
+        format() {
+            if (!this.count) return '-';
+            const ms = (v) => (v * 1000).toFixed(2);
+            const sd = this.count > 1 ? Math.sqrt(this.m2 / (this.count - 1)) : 0;
+            return `${ms(this.mean)} \\u00b1 ${ms(sd)} ms (maks ${ms(this.worst)}, n=${this.count})`;
+        }
+    }
+
     class Metronome {
         constructor(tempo = 120) {
             this.audioContext = null;
-            this.notesInQueue = [];
-            this.currentQuarterNote = 0;
+            this.master = null;
+            this.buffers = null;
+            this.clockNode = null;
             this.tempo = tempo;
+            this.beatsPerBar = 4;
+            this.subdivision = 1;
             this.lookahead = 25.0;
             this.scheduleAheadTime = 0.1;
-            this.nextNoteTime = 0.0;
             this.isRunning = false;
-            this.intervalID = null;
+            this.timerID = null;
+            this.step = 0;
+            // Click n after the anchor plays at anchorTime + n * interval, so rounding
+            // never accumulates; tempo or subdivision changes move the anchor
+            this.anchorTime = 0;
+            this.anchorCount = 0;
+            this.count = 0;
+            this.queueTime = new Float64Array(BEAT_QUEUE_SIZE);
+            this.queueStep = new Uint16Array(BEAT_QUEUE_SIZE);
+            this.queueHead = 0;
+            this.queueTail = 0;
+            this.measuring = false;
+            this.stats = { audio: new TimingStats(), visual: new TimingStats(), margin: new TimingStats(), late: 0 };
+            this.onDraw = null;
+        }
+
+        get interval() {
+            return 60.0 / this.tempo / this.subdivision;
+        }
+
+        get nextNoteTime() {
+            return this.anchorTime + (this.count - this.anchorCount) * this.interval;
         }
 
-        nextNote() {
-            const secondsPerBeat = 60.0 / this.tempo;
-            this.nextNoteTime += secondsPerBeat;
-            this.currentQuarterNote++;
-            if (this.currentQuarterNote == 4) {
-                this.currentQuarterNote = 0;
+        renderClick(frequency, gain) {
+            const ctx = this.audioContext;
+            const buffer = ctx.createBuffer(1, Math.round(ctx.sampleRate * CLICK_SECONDS), ctx.sampleRate);
+            const data = buffer.getChannelData(0);
+            for (let i = 0; i < data.length; i++) {
+                const t = i / ctx.sampleRate;
+                data[i] = gain * Math.sin(2 * Math.PI * frequency * t) * Math.exp(-t / 0.006);
             }
+            return buffer;
         }
 
-        scheduleNote(beatNumber, time) {
-            this.notesInQueue.push({ note: beatNumber, time: time });
+        async init() {
+            const ctx = this.audioContext = new (window.AudioContext || window.webkitAudioContext)();
+            this.master = ctx.createGain();
+            this.master.connect(ctx.destination);
+            this.buffers = {};
+            for (const [kind, [frequency, gain]] of Object.entries(CLICK_SOUNDS)) {
+                this.buffers[kind] = this.renderClick(frequency, gain);
+            }
+            if (!ctx.audioWorklet) return;
+            try {
+                // Ticks from the audio thread keep scheduling on time in background tabs,
+                // where setTimeout is clamped to once a second
+                await ctx.audioWorklet.addModule('/metronome/clock-worklet.js');
+                this.clockNode = new AudioWorkletNode(ctx, 'metronome-clock', {
+                    numberOfOutputs: 0, processorOptions: { interval: this.lookahead / 1000 },
+                });
+                this.clockNode.port.onmessage = (e) => {
+                    if (e.data.onset !== undefined) this.recordOnset(e.data.onset);
+                    else if (this.isRunning) this.scheduler();
+                };
+                this.master.connect(this.clockNode);
+            } catch (err) {
+                this.clockNode = null;
+            }
+        }
 
-            const osc = this.audioContext.createOscillator();
-            const envelope = this.audioContext.createGain();
+        setTempo(tempo) {
+            this.reanchor();
+            this.tempo = tempo;
+        }
 
-            osc.type = 'square';
-            osc.frequency.value = (beatNumber % 4 === 0) ? 1200 : 1000;
-            envelope.gain.value = 3.0;
-            envelope.gain.exponentialRampToValueAtTime(0.001, time + 0.1);
+        setMeter(beatsPerBar, subdivision) {
+            this.reanchor();
+            this.beatsPerBar = beatsPerBar;
+            this.subdivision = subdivision;
+            this.step = 0;
+            buildBeatDots(beatsPerBar);
+        }
 
-            osc.connect(envelope);
-            envelope.connect(this.audioContext.destination);
+        reanchor() {
+            if (!this.isRunning) return;
+            this.anchorTime = this.nextNoteTime;
+            this.anchorCount = this.count;
+        }
 
-            osc.start(time);
-            osc.stop(time + 0.1);
-            
-            const drawTime = (time - this.audioContext.currentTime) * 1000;
-            setTimeout(() => {
-                const visual = document.getElementById('visual-beat');
-                visual.style.opacity = '1';
-                visual.style.transform = 'translate(-50%, -50%) scale(1.2)';
-                visual.style.borderColor = (beatNumber % 4 === 0) ? '#ffc107' : 'rgba(255,255,255,0.5)';
-                
-                setTimeout(() => {
-                    visual.style.opacity = '0';
-                    visual.style.transform = 'translate(-50%, -50%) scale(1)';
-                }, 100);
-            }, Math.max(0, drawTime));
+        enqueue(step, time) {
+            this.queueTime[this.queueTail] = time;
+            this.queueStep[this.queueTail] = step;
+            this.queueTail = (this.queueTail + 1) % BEAT_QUEUE_SIZE;
+            if (this.queueTail === this.queueHead) this.queueHead = (this.queueHead + 1) % BEAT_QUEUE_SIZE;
+        }
+
+        scheduleNote(step, time) {
+            const kind = step === 0 ? 'accent' : step % this.subdivision === 0 ? 'beat' : 'sub';
+            const source = this.audioContext.createBufferSource();
+            source.buffer = this.buffers[kind];
+            source.connect(this.master);
+            source.start(time);
+            this.enqueue(step, time);
+            if (this.measuring) {
+                const margin = time - this.audioContext.currentTime;
+                this.stats.margin.add(margin);
+                if (margin < 0) this.stats.late++;
+            }
         }
 
         scheduler() {
-            while (this.nextNoteTime < this.audioContext.currentTime + this.scheduleAheadTime ) {
-                this.scheduleNote(this.currentQuarterNote, this.nextNoteTime);
-                this.nextNote();
+            const horizon = this.audioContext.currentTime + this.scheduleAheadTime;
+            while (this.nextNoteTime < horizon) {
+                this.scheduleNote(this.step, this.nextNoteTime);
+                this.count++;
+                this.step = (this.step + 1) % (this.beatsPerBar * this.subdivision);
+            }
+        }
+
+        timerLoop() {
+            this.scheduler();
+            this.timerID = window.setTimeout(() => this.timerLoop(), this.lookahead);
+        }
+
+        // Context time the speakers are playing right now
+        audibleTime(now) {
+            const ctx = this.audioContext;
+            const ts = ctx.getOutputTimestamp ? ctx.getOutputTimestamp() : null;
+            if (ts && ts.performanceTime) return ts.contextTime + (now - ts.performanceTime) / 1000;
+            return ctx.currentTime - (ctx.outputLatency || 0) - (ctx.baseLatency || 0);
+        }
+
+        // Called once per animation frame: consumes every click that has become audible
+        draw(now) {
+            if (!this.isRunning) return;
+            const audible = this.audibleTime(now);
+            let step = -1, time = 0;
+            while (this.queueHead !== this.queueTail && this.queueTime[this.queueHead] <= audible) {
+                step = this.queueStep[this.queueHead];
+                time = this.queueTime[this.queueHead];
+                this.queueHead = (this.queueHead + 1) % BEAT_QUEUE_SIZE;
+                if (this.measuring) this.stats.visual.add(audible - time);
+            }
+            if (this.onDraw) this.onDraw(step, audible);
+        }
+
+        recordOnset(onset) {
+            if (!this.measuring) return;
+            let nearest = Infinity;
+            for (let i = 0; i < BEAT_QUEUE_SIZE; i++) {
+                const error = onset - this.queueTime[i];
+                if (Math.abs(error) < Math.abs(nearest)) nearest = error;
+            }
+            if (Math.abs(nearest) <= ONSET_MATCH_WINDOW) this.stats.audio.add(nearest);
+        }
+
+        setMeasuring(enabled) {
+            this.measuring = enabled;
+            if (enabled) {
+                Object.values(this.stats).forEach((s) => s.reset && s.reset());
+                this.stats.late = 0;
             }
-            this.intervalID = window.setTimeout(this.scheduler.bind(this), this.lookahead);
+            if (this.clockNode) this.clockNode.port.postMessage({ probe: enabled });
         }
 
-        start() {
+        async start() {
             if (this.isRunning) return;
 
             if (this.audioContext == null) {
-                this.audioContext = new (window.AudioContext || window.webkitAudioContext)();
+                await this.init();
             }
             
-            this.audioContext.resume();
+            await this.audioContext.resume();
 
             this.isRunning = true;
-            this.currentQuarterNote = 0;
-            this.nextNoteTime = this.audioContext.currentTime + 0.05;
-            this.scheduler();
+            this.step = 0;
+            this.count = this.anchorCount = 0;
+            this.anchorTime = this.audioContext.currentTime + 0.05;
+            this.queueHead = this.queueTail = 0;
+            this.queueTime.fill(0);
+            if (this.clockNode) this.scheduler();
+            else this.timerLoop();
             
             const btn = document.getElementById('play-btn');
             btn.innerHTML = '<i class="fas fa-stop me-2"></i> STOP';
@@ -1637,7 +3541,8 @@ METRONOME_HTML_CONTENT = """
 
         stop() {
             this.isRunning = false;
-            window.clearTimeout(this.intervalID);
+            window.clearTimeout(this.timerID);
+            this.queueHead = this.queueTail;
             
             const btn = document.getElementById('play-btn');
             btn.innerHTML = '<i class="fas fa-play me-2"></i> START';
@@ -1650,27 +3555,87 @@ METRONOME_HTML_CONTENT = """
     const bpmSlider = document.getElementById('bpm-slider');
     const bpmVal = document.getElementById('bpm-val');
     const playBtn = document.getElementById('play-btn');
+    const visualBeat = document.getElementById('visual-beat');
+    const beatDots = document.getElementById('beat-dots');
+    const timeSignature = document.getElementById('time-signature');
+    const subdivisionSelect = document.getElementById('subdivision');
+    const measureToggle = document.getElementById('measure-toggle');
+    const timingStats = document.getElementById('timing-stats');
+
+    function buildBeatDots(beats) {
+        beatDots.innerHTML = '';
+        for (let i = 0; i < beats; i++) {
+            const dot = document.createElement('div');
+            dot.className = i === 0 ? 'beat-dot accent' : 'beat-dot';
+            beatDots.appendChild(dot);
+        }
+    }
+    buildBeatDots(metronome.beatsPerBar);
+
+    // The only place the page is redrawn; nothing else touches the DOM per beat
+    let litBeat = -1, flashUntil = 0, lastStatsUpdate = 0;
+    metronome.onDraw = (step, audible) => {
+        if (step >= 0 && step % metronome.subdivision === 0) {
+            const beat = step / metronome.subdivision;
+            if (litBeat >= 0 && beatDots.children[litBeat]) beatDots.children[litBeat].classList.remove('active');
+            if (beatDots.children[beat]) beatDots.children[beat].classList.add('active');
+            litBeat = beat;
+            visualBeat.classList.toggle('beat-accent', beat === 0);
+            visualBeat.classList.add('beat-on');
+            flashUntil = audible + 0.1;
+        } else if (flashUntil && audible >= flashUntil) {
+            visualBeat.classList.remove('beat-on');
+            flashUntil = 0;
+        }
+    };
 
-    bpmSlider.addEventListener('input', (e) => {
-        metronome.tempo = e.target.value;
-        bpmVal.innerText = metronome.tempo;
-    });
+    function frame(now) {
+        metronome.draw(now);
+        if (metronome.measuring && now - lastStatsUpdate > 500) {
+            lastStatsUpdate = now;
+            const s = metronome.stats;
+            timingStats.innerHTML =
+                `Jam: ${metronome.clockNode ? 'AudioWorklet' : 'setTimeout'}<br>` +
+                `Audio (onset - jadwal): ${metronome.clockNode ? s.audio.format() : 'butuh AudioWorklet'}<br>` +
+                `Visual (tampil - jadwal): ${s.visual.format()}<br>` +
+                `Sisa waktu jadwal: ${s.margin.format()}, terlambat ${s.late}`;
+        }
+        requestAnimationFrame(frame);
+    }
+    requestAnimationFrame(frame);
+
+    function setBPM(bpm) {
+        bpmSlider.value = bpm;
+        bpmVal.innerText = bpm;
+        metronome.setTempo(bpm);
+    }
+
+    bpmSlider.addEventListener('input', (e) => setBPM(parseInt(e.target.value)));
 
     function adjustBPM(delta) {
         let newBPM = parseInt(bpmSlider.value) + delta;
         if(newBPM >= 40 && newBPM <= 240) {
-            bpmSlider.value = newBPM;
-            metronome.tempo = newBPM;
-            bpmVal.innerText = newBPM;
-            
-            // Trigger input event to update metronome if running
-            bpmSlider.dispatchEvent(new Event('input'));
+            setBPM(newBPM);
         }
     }
 
+    function updateMeter() {
+        litBeat = -1;
+        metronome.setMeter(parseInt(timeSignature.value), parseInt(subdivisionSelect.value));
+    }
+    timeSignature.addEventListener('change', updateMeter);
+    subdivisionSelect.addEventListener('change', updateMeter);
+
+    measureToggle.addEventListener('change', () => {
+        timingStats.classList.toggle('d-none', !measureToggle.checked);
+        timingStats.innerText = 'Mengukur...';
+        metronome.setMeasuring(measureToggle.checked);
+    });
+
     playBtn.addEventListener('click', () => {
         if (metronome.isRunning) {
             metronome.stop();
+            visualBeat.classList.remove('beat-on');
         } else {
             metronome.start();
         }
@@ -1678,9 +3643,74 @@ METRONOME_HTML_CONTENT = """
 </script>
 """
 
+# Audio-thread clock for the metronome: posts a tick every `interval` seconds so the
+# scheduler keeps running in background tabs. While probing, it also reports the
+# context time of every click onset it hears on its input.
+METRONOME_CLOCK_JS = """
+class MetronomeClock extends AudioWorkletProcessor {
+    constructor(options) {
+        super();
+        const opts = (options && options.processorOptions) || {};
+        this.interval = Math.round(sampleRate * (opts.interval || 0.025));
+        this.pending = this.interval;
+        this.threshold = opts.threshold || 0.05;
+        this.minGap = Math.round(sampleRate * 0.03);  // silence that separates two clicks
+        this.quiet = this.minGap;
+        this.probing = false;
+        this.port.onmessage = (e) => { this.probing = !!e.data.probe; };
+    }
+
+    process(inputs) {
+        const channel = inputs[0] && inputs[0][0];
+        if (this.probing && channel) {
+            for (let i = 0; i < channel.length; i++) {
+                if (Math.abs(channel[i]) >= this.threshold) {
+                    if (this.quiet >= this.minGap) this.port.postMessage({ onset: currentTime + i / sampleRate });
+                    this.quiet = 0;
+                } else {
+                    this.quiet++;
+                }
+            }
+        }
+        this.pending -= 128;
+        if (this.pending <= 0) {
+            this.pending += this.interval;
+            this.port.postMessage({ tick: currentTime });
+        }
+        return true;
+    }
+}
+
+registerProcessor('metronome-clock', MetronomeClock);
+"""
+
 @app.route('/ear-training')
+@cached_page
 def ear_training():
-    return render_layout(EAR_TRAINING_HTML_CONTENT)
+    return render_layout('ear_training.html', sample_bank_notes=SAMPLE_BANK_NOTES, sample_bank_voices=SAMPLE_BANK_VOICES)
+
+@app.route('/api/sample-bank')
+@cached_page(mimetype='application/json')
+def api_sample_bank():
+    bank = sample_bank_id()
+    formats = {}
+    for entry in SampleBankEntry.query.filter_by(bank=bank):
+        formats.setdefault(entry.fmt, {})[entry.name] = url_for('uploaded_file', filename=entry.filename)
+    complete = {fmt: samples for fmt, samples in formats.items() if len(samples) == len(SAMPLE_BANK_VOICES)}
+    if not complete:
+        # Built once per bank by the media worker; a failed build is retried with `sample-bank`
+        if MediaJob.query.filter_by(kind='sample-bank', target=bank).first() is None:
+            enqueue_media_job('sample-bank', bank)
+            try:
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+        return jsonify(error='sample bank is not built yet'), 503, {'Retry-After': '60'}
+    return json.dumps({
+        'bank': bank,
+        'formats': [{'type': SAMPLE_BANK_FORMATS[fmt][1], 'samples': complete[fmt]}
+                    for fmt in app.config['SAMPLE_BANK']['formats'] if fmt in complete],
+    })
 
 EAR_TRAINING_HTML_CONTENT = """
 <div class="container d-flex flex-column justify-content-center align-items-center" style="min-height: 80vh;">
@@ -1726,22 +3756,14 @@ EAR_TRAINING_HTML_CONTENT = """
 </div>
 
 <script>
-    const notes = [
-        { name: 'C', freq: 261.63 },
-        { name: 'C#', freq: 277.18 },
-        { name: 'D', freq: 293.66 },
-        { name: 'D#', freq: 311.13 },
-        { name: 'E', freq: 329.63 },
-        { name: 'F', freq: 349.23 },
-        { name: 'F#', freq: 369.99 },
-        { name: 'G', freq: 392.00 },
-        { name: 'G#', freq: 415.30 },
-        { name: 'A', freq: 440.00 },
-        { name: 'A#', freq: 466.16 },
-        { name: 'B', freq: 493.88 }
-    ];
+    const notes = {{ sample_bank_notes|tojson }}.map(([name, freq]) => ({ name, freq }));
+    // name -> [timbre, Hz, seconds], the same list the server renders (SAMPLE_BANK_VOICES)
+    const SAMPLE_VOICES = {{ sample_bank_voices|tojson }};
+    const VOICE_POOL_SIZE = 6;
     
     let audioCtx;
+    let sampleBank;
+    let voicePool;
     let currentNote = null;
     let correct = 0;
     let wrong = 0;
@@ -1758,96 +3780,143 @@ EAR_TRAINING_HTML_CONTENT = """
         }
     }
 
-    function initAudio() {
-        if (!audioCtx) {
-            audioCtx = new (window.AudioContext || window.webkitAudioContext)();
+    // Every sound is an AudioBuffer decoded (or rendered) once per page and replayed
+    class SampleBank {
+        constructor(ctx) {
+            this.ctx = ctx;
+            this.buffers = new Map();  // name -> Promise<AudioBuffer>
+            this.samples = this.loadManifest();
         }
-        if(audioCtx.state === 'suspended') {
-            audioCtx.resume();
+
+        // URLs of the server-rendered samples in a format this browser decodes, or null
+        async loadManifest() {
+            try {
+                const response = await fetch('/api/sample-bank');
+                if (!response.ok) return null;
+                const bank = await response.json();
+                const probe = document.createElement('audio');
+                const format = bank.formats.find((f) => probe.canPlayType(f.type));
+                return format ? format.samples : null;
+            } catch (err) {
+                return null;
+            }
+        }
+
+        get(name) {
+            if (!this.buffers.has(name)) this.buffers.set(name, this.load(name));
+            return this.buffers.get(name);
+        }
+
+        async load(name) {
+            const samples = await this.samples;
+            if (samples && samples[name]) {
+                try {
+                    const response = await fetch(samples[name]);
+                    return await this.ctx.decodeAudioData(await response.arrayBuffer());
+                } catch (err) {
+                    // fall back to rendering it here
+                }
+            }
+            return renderVoiceOffline(this.ctx.sampleRate, ...SAMPLE_VOICES[name]);
+        }
+
+        preload() {
+            Object.keys(SAMPLE_VOICES).forEach((name) => this.get(name));
         }
     }
 
-    function playTone(freq, type='sine', duration=1.0) {
-        initAudio();
-        const osc = audioCtx.createOscillator();
-        const gain = audioCtx.createGain();
-        
-        osc.type = type;
-        osc.frequency.value = freq;
-        
-        // Envelope to sound more like a piano/bell
-        const now = audioCtx.currentTime;
-        gain.gain.setValueAtTime(0, now);
-        gain.gain.linearRampToValueAtTime(0.5, now + 0.05);
-        gain.gain.exponentialRampToValueAtTime(0.001, now + duration);
-        
-        osc.connect(gain);
-        gain.connect(audioCtx.destination);
-        
-        osc.start(now);
-        osc.stop(now + duration);
+    // The oscillator graphs the bank was modelled on, rendered once into a buffer
+    function renderVoiceOffline(sampleRate, timbre, freq, duration) {
+        const OfflineCtx = window.OfflineAudioContext || window.webkitOfflineAudioContext;
+        const ctx = new OfflineCtx(1, Math.ceil(sampleRate * duration), sampleRate);
+        const gain = ctx.createGain();
+        const attack = timbre === 'piano' ? 0.02 : 0.05;
+        gain.gain.setValueAtTime(0, 0);
+        gain.gain.linearRampToValueAtTime(timbre === 'piano' ? 0.6 : 0.5, attack);
+        gain.gain.exponentialRampToValueAtTime(0.001, duration);
+        const oscillators = timbre === 'piano'
+            ? [['triangle', 0], ['triangle', 10], ['sawtooth', -10]]
+            : [[timbre, 0]];
+        let output = gain;
+        if (timbre === 'piano') {
+            const filter = ctx.createBiquadFilter();
+            filter.type = 'lowpass';
+            filter.frequency.value = 2000;
+            gain.connect(filter);
+            output = filter;
+        }
+        output.connect(ctx.destination);
+        oscillators.forEach(([type, detune]) => {
+            const osc = ctx.createOscillator();
+            osc.type = type;
+            osc.frequency.value = freq;
+            osc.detune.value = detune;
+            osc.connect(gain);
+            osc.start(0);
+        });
+        return ctx.startRendering();
+    }
+
+    // A fixed set of gain nodes; a replay while all are busy steals the voice closest
+    // to finishing with a 10 ms fade, so rapid clicks never pile up graphs
+    class VoicePool {
+        constructor(ctx, size) {
+            this.ctx = ctx;
+            this.voices = Array.from({ length: size }, () => {
+                const gain = ctx.createGain();
+                gain.connect(ctx.destination);
+                return { gain, source: null, endsAt: 0 };
+            });
+        }
+
+        play(buffer) {
+            const now = this.ctx.currentTime;
+            const voice = this.voices.reduce((best, v) => (v.endsAt < best.endsAt ? v : best));
+            const level = voice.gain.gain;
+            let start = now;
+            if (voice.source && voice.endsAt > now) {
+                start = now + 0.01;
+                level.cancelScheduledValues(now);
+                level.setValueAtTime(level.value, now);
+                level.linearRampToValueAtTime(0, start);
+                voice.source.stop(start);
+            }
+            level.setValueAtTime(1, start);
+            const source = this.ctx.createBufferSource();
+            source.buffer = buffer;
+            source.connect(voice.gain);
+            source.start(start);
+            voice.source = source;
+            voice.endsAt = start + buffer.duration;
+        }
+    }
+
+    function initAudio() {
+        if (!audioCtx) {
+            audioCtx = new (window.AudioContext || window.webkitAudioContext)();
+            sampleBank = new SampleBank(audioCtx);
+            voicePool = new VoicePool(audioCtx, VOICE_POOL_SIZE);
+            sampleBank.preload();
+        }
+        if(audioCtx.state === 'suspended') {
+            audioCtx.resume();
+        }
+    }
+
+    async function playSample(name) {
+        initAudio();
+        voicePool.play(await sampleBank.get(name));
     }
 
     function playCurrentNote() {
         if(!currentNote) {
             nextQuestion();
         } else {
-            if (soundType === 'piano') {
-                playPianoTone(currentNote.freq);
-            } else {
-                playTone(currentNote.freq);
-            }
+            playSample(`${soundType}-${currentNote.name}`);
         }
         document.getElementById('instruction').innerText = "Tebak nada apa ini?";
     }
 
-    function playPianoTone(freq) {
-        initAudio();
-        const now = audioCtx.currentTime;
-        const duration = 1.5;
-        
-        // 3 Oscillators for richness
-        const osc1 = audioCtx.createOscillator();
-        const osc2 = audioCtx.createOscillator();
-        const osc3 = audioCtx.createOscillator();
-        
-        osc1.type = 'triangle';
-        osc2.type = 'triangle';
-        osc3.type = 'sawtooth';
-        
-        osc1.frequency.value = freq;
-        osc2.frequency.value = freq;
-        osc3.frequency.value = freq;
-        
-        osc2.detune.value = 10;
-        osc3.detune.value = -10;
-        
-        const masterGain = audioCtx.createGain();
-        const filter = audioCtx.createBiquadFilter();
-        
-        filter.type = 'lowpass';
-        filter.frequency.value = 2000;
-        
-        osc1.connect(masterGain);
-        osc2.connect(masterGain);
-        osc3.connect(masterGain);
-        
-        masterGain.connect(filter);
-        filter.connect(audioCtx.destination);
-        
-        masterGain.gain.setValueAtTime(0, now);
-        masterGain.gain.linearRampToValueAtTime(0.6, now + 0.02);
-        masterGain.gain.exponentialRampToValueAtTime(0.001, now + duration);
-        
-        osc1.start(now);
-        osc2.start(now);
-        osc3.start(now);
-        
-        osc1.stop(now + duration);
-        osc2.stop(now + duration);
-        osc3.stop(now + duration);
-    }
-
     function generateOptions() {
         const grid = document.getElementById('options-grid');
         grid.innerHTML = '';
@@ -1871,14 +3940,14 @@ EAR_TRAINING_HTML_CONTENT = """
             correct++;
             document.getElementById('correct-score').innerText = correct;
             feedback.innerHTML = `<h4 class="text-success fw-bold mb-0">Benar! 🎉 (${currentNote.name})</h4>`;
-            playTone(880, 'sine', 0.2); // Ding
+            playSample('ding');
         } else {
             btn.classList.remove('btn-outline-light');
             btn.classList.add('btn-danger');
             wrong++;
             document.getElementById('wrong-score').innerText = wrong;
             feedback.innerHTML = `<h4 class="text-danger fw-bold mb-0">Salah! Jawabannya: ${currentNote.name}</h4>`;
-            playTone(150, 'sawtooth', 0.3); // Buzz
+            playSample('buzz');
         }
         
         document.getElementById('next-btn').style.display = 'inline-block';
@@ -1901,9 +3970,481 @@ EAR_TRAINING_HTML_CONTENT = """
 </script>
 """
 
+# Content hashes of uploads, keyed by (path, inode, mtime, size) so a file is hashed
+# once per worker until it changes on disk
+UPLOAD_ETAG_CACHE_SIZE = 4096
+_upload_etags = {}
+_upload_etags_lock = threading.Lock()
+
+def _upload_content_etag(path, st):
+    stamp = (path, st.st_ino, st.st_mtime_ns, st.st_size)
+    etag = _upload_etags.get(stamp)
+    if etag is None:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        etag = digest.hexdigest()
+        with _upload_etags_lock:
+            if len(_upload_etags) >= UPLOAD_ETAG_CACHE_SIZE:
+                _upload_etags.pop(next(iter(_upload_etags)))
+            _upload_etags[stamp] = etag
+    return etag
+
+# --- JSON LISTING API ---
+def _api_listing(listing):
+    limit = request.args.get('limit', type=int) or app.config['LISTING_PAGE_SIZE']
+    limit = max(1, min(limit, app.config['LISTING_MAX_PAGE_SIZE']))
+    try:
+        items, next_cursor = keyset_page(listing, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify(error='invalid cursor'), 400
+    return json.dumps({'items': [item.to_dict() for item in items], 'next_cursor': next_cursor})
+
+@app.route('/api/gallery')
+@cached_page(mimetype='application/json')
+def api_gallery():
+    return _api_listing('gallery')
+
+@app.route('/api/tutors')
+@cached_page(mimetype='application/json')
+def api_tutors():
+    return _api_listing('tutors')
+
+@app.route('/api/gallery/<int:item_id>/pitch')
+@cached_page(mimetype='application/json')
+def api_gallery_pitch(item_id):
+    analysis = db.session.get(PitchAnalysis, item_id)
+    if analysis is None:
+        return jsonify(error='not analysed yet'), 404
+    return json.dumps(analysis.to_dict())
+
+@app.route('/api/news')
+@cached_page(mimetype='application/json')
+def api_news():
+    return _api_listing('news')
+
+# --- MEDIA SERVING ---
+# Byte serving for uploads and audio: Accept-Ranges, If-Range, single ranges as
+# 206 with Content-Range, several ranges as multipart/byteranges, 416 when none is
+# satisfiable. The body is streamed from disk in chunks, never read into memory.
+#
+# With MEDIA_OFFLOAD set, Python only resolves and authorizes the request and the
+# proxy streams the file (and handles Range itself). nginx example:
+#     location /_protected/uploads/ { internal; alias /srv/bimbel/uploads/; }
+#     location /_protected/audio/   { internal; alias /srv/bimbel/static/audio/; }
+MEDIA_OFFLOAD_MODES = ('x-accel-redirect', 'x-sendfile')
+MEDIA_CHUNK_SIZE = 256 * 1024
+
+if app.config['MEDIA_OFFLOAD'] not in (None, *MEDIA_OFFLOAD_MODES):
+    app.logger.warning("Unknown MEDIA_OFFLOAD %r, serving media from Python", app.config['MEDIA_OFFLOAD'])
+    app.config['MEDIA_OFFLOAD'] = None
+
+def _file_chunks(path, start, stop):
+    # Opened lazily, so HEAD requests and aborted responses never touch the file
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(MEDIA_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def _requested_spans(length, etag, last_modified):
+    """Satisfiable (start, stop) spans of the Range header, merged and sorted.
+
+    Returns None when the whole entity should be sent (no/invalid Range, or a
+    stale If-Range) and [] when nothing in the header is satisfiable.
+    """
+    rng = request.range
+    if rng is None or rng.units != 'bytes':
+        return None
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and (last_modified is None or if_range.date != last_modified):
+        return None
+    spans = []
+    for start, stop in rng.ranges:
+        if start < 0:  # suffix range: the last N bytes
+            start, stop = max(length + start, 0), length
+        else:
+            stop = length if stop is None else min(stop, length)
+        if start < stop:
+            spans.append((start, stop))
+    merged = []
+    for start, stop in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+def _multipart_byteranges(path, spans, length, mimetype, boundary):
+    parts = [(f"--{boundary}\r\nContent-Type: {mimetype}\r\n"
+              f"Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n").encode() for start, stop in spans]
+    closing = f"--{boundary}--\r\n".encode()
+    total = sum(len(h) + (stop - start) + 2 for h, (start, stop) in zip(parts, spans)) + len(closing)
+
+    def generate():
+        for head, (start, stop) in zip(parts, spans):
+            yield head
+            yield from _file_chunks(path, start, stop)
+            yield b"\r\n"
+        yield closing
+    return generate(), total
+
+def send_media(path, st, *, etag, last_modified=None, offload=None, mimetype=None):
+    """Serve a file that exists at `path` (stat result `st`) with range support.
+
+    `offload` is the key into MEDIA_OFFLOAD_PREFIXES for the directory the file
+    lives in. Callers handle 304s and set caching headers on the response.
+    """
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    mode = app.config['MEDIA_OFFLOAD']
+    if mode and offload:
+        response = Response(mimetype=mimetype)
+        if mode == 'x-accel-redirect':
+            root = app.config['UPLOAD_FOLDER'] if offload == 'uploads' else app.config['AUDIO_FOLDER']
+            rel = os.path.relpath(path, root).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = app.config['MEDIA_OFFLOAD_PREFIXES'][offload] + rel
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(path)
+    else:
+        length = st.st_size
+        spans = _requested_spans(length, etag, last_modified)
+        if spans is not None and len(spans) > app.config['MEDIA_MAX_RANGES']:
+            spans = None
+        if spans is None:
+            response = Response(wrap_file(request.environ, open(path, 'rb'), MEDIA_CHUNK_SIZE),
+                                mimetype=mimetype, direct_passthrough=True)
+            response.content_length = length
+        elif not spans:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f"bytes */{length}"
+        elif len(spans) == 1:
+            start, stop = spans[0]
+            response = Response(_file_chunks(path, start, stop), status=206, mimetype=mimetype, direct_passthrough=True)
+            response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{length}"
+            response.content_length = stop - start
+        else:
+            boundary = os.urandom(12).hex()
+            body, total = _multipart_byteranges(path, spans, length, mimetype, boundary)
+            response = Response(body, status=206, direct_passthrough=True,
+                                content_type=f"multipart/byteranges; boundary={boundary}")
+            response.content_length = total
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+def _send_mutable_media(path, st, offload):
+    """Files whose name does not pin their content: revalidate on every use."""
+    etag = _upload_content_etag(path, st)
+    last_modified = datetime.datetime.fromtimestamp(int(st.st_mtime), datetime.timezone.utc)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+    else:
+        response = send_media(path, st, etag=etag, last_modified=last_modified, offload=offload)
+    response.cache_control.no_cache = True
+    return response
+
+# --- RESUMABLE UPLOADS ---
+# A tus-like protocol for big media on bad connections:
+#   POST   /api/uploads                 {"target", "filename", "length"} -> 201, Location
+#   HEAD   /api/uploads/<id>            -> Upload-Offset / Upload-Length
+#   GET    /api/uploads/<id>            the bytes received so far (preview before finalize)
+#   PATCH  /api/uploads/<id>            body appended at Upload-Offset (409 on mismatch)
+#   POST   /api/uploads/<id>/finalize   form fields of the target (+ sha256) -> record created
+#                                       (410 once storing it failed: retrying cannot help)
+#   DELETE /api/uploads/<id>            abandon
+# Chunks are written straight to uploads/.tmp/resumable and fsynced before the
+# offset is committed, so a dropped connection costs at most one chunk. The
+# finished file goes into the content-addressed store and through the same
+# create_* function as the regular form upload.
+#
+# A recording streamed while it is made does not know its size up front: it is
+# created with {"defer_length": true} and the length is declared by sending an
+# Upload-Length header with a later PATCH (an empty one is fine), as in tus.
+UPLOAD_TARGETS = {
+    'gallery': (create_gallery_item, ('student_name', 'title')),
+    'tutors': (create_tutor, ('name', 'bio')),
+    'news': (create_news_item, ('title', 'content', 'date')),
+}
+RESUMABLE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+_resumable_locks = {}
+_resumable_locks_guard = threading.Lock()
+
+def resumable_part_path(upload_id):
+    part_dir = os.path.join(upload_tmp_dir(), 'resumable')
+    os.makedirs(part_dir, exist_ok=True)
+    return os.path.join(part_dir, f"{upload_id}.part")
+
+def _resumable_or_404(upload_id):
+    upload = db.session.get(ResumableUpload, upload_id) if RESUMABLE_ID_PATTERN.match(upload_id) else None
+    if upload is None:
+        abort(404)
+    return upload
+
+def _resumable_response(upload, status=204, **body):
+    response = jsonify(id=upload.id, offset=upload.offset, length=upload.length, status=upload.status, **body) \
+        if body or status != 204 else Response(status=204)
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(upload.offset)
+    if upload.length is None:
+        response.headers['Upload-Defer-Length'] = '1'
+    else:
+        response.headers['Upload-Length'] = str(upload.length)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+class _PartLock:
+    """Exclusive, non-blocking lock on a part file across processes (flock) or threads."""
+    def __init__(self, f, upload_id):
+        self.f, self.upload_id, self.lock = f, upload_id, None
+
+    def __enter__(self):
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            return True
+        with _resumable_locks_guard:
+            self.lock = _resumable_locks.setdefault(self.upload_id, threading.Lock())
+        return self.lock.acquire(blocking=False)
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        elif self.lock is not None and self.lock.locked():
+            self.lock.release()
+
+@app.route('/api/uploads', methods=['POST'])
+def create_resumable_upload():
+    data = request.get_json(silent=True) or {}
+    target, filename, length = data.get('target'), data.get('filename'), data.get('length')
+    if target not in UPLOAD_TARGETS or not isinstance(filename, str) or not allowed_file(filename):
+        return jsonify(error='invalid target or file type'), 400
+    deferred = data.get('defer_length') is True and length is None
+    if not deferred and (not isinstance(length, int) or isinstance(length, bool) or length <= 0):
+        return jsonify(error='invalid length'), 400
+    if not deferred and length > app.config['RESUMABLE_UPLOAD_MAX_BYTES']:
+        return jsonify(error='upload too large'), 413
+    upload = ResumableUpload(id=secrets.token_hex(16), target=target, filename=filename[-200:], length=length)
+    open(resumable_part_path(upload.id), 'wb').close()
+    try:
+        db.session.add(upload)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        os.unlink(resumable_part_path(upload.id))
+        raise
+    response = _resumable_response(upload, 201, chunk_size=app.config['RESUMABLE_CHUNK_SIZE'])
+    response.headers['Location'] = url_for('resumable_upload', upload_id=upload.id)
+    return response
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'HEAD', 'PATCH', 'DELETE'])
+def resumable_upload(upload_id):
+    upload = _resumable_or_404(upload_id)
+    if request.method == 'HEAD':
+        return _resumable_response(upload, 200)
+    path = resumable_part_path(upload.id)
+    if request.method == 'GET':
+        if upload.status != 'uploading' or not os.path.exists(path):
+            abort(404)
+        st = os.stat(path)
+        response = send_media(path, st, etag=f"{upload.id}-{upload.offset}",
+                              mimetype=mimetypes.guess_type(upload.filename)[0])
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    if request.method == 'DELETE':
+        if upload.status in ('finalizing', 'done'):
+            return _resumable_response(upload, 409)
+        try:
+            db.session.delete(upload)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if os.path.exists(path):
+            os.unlink(path)
+        return Response(status=204)
+    if request.mimetype != 'application/offset+octet-stream':
+        return jsonify(error='expected application/offset+octet-stream'), 415
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None or offset < 0:
+        return jsonify(error='missing Upload-Offset'), 400
+    declared = request.headers.get('Upload-Length', type=int)
+    if declared is not None and not 0 < declared <= app.config['RESUMABLE_UPLOAD_MAX_BYTES']:
+        return jsonify(error='invalid Upload-Length'), 400
+    if not os.path.exists(path):
+        abort(404)
+    with open(path, 'r+b') as f, _PartLock(f, upload.id) as locked:
+        if not locked:
+            return _resumable_response(upload, 409, error='upload busy')
+        db.session.refresh(upload)
+        if upload.status != 'uploading' or offset != upload.offset:
+            return _resumable_response(upload, 409, error='offset mismatch')
+        if declared is not None:
+            if upload.length is None and declared >= offset:
+                upload.length = declared
+            elif declared != upload.length:
+                return _resumable_response(upload, 409, error='length mismatch')
+        # Bytes past the committed offset are from a request that died mid-write
+        f.truncate(offset)
+        f.seek(offset)
+        remaining = (upload.length if upload.length is not None else app.config['RESUMABLE_UPLOAD_MAX_BYTES']) - offset
+        written, too_long = 0, False
+        try:
+            for chunk in iter(lambda: request.stream.read(1024 * 1024), b''):
+                if written + len(chunk) > remaining:
+                    too_long = True
+                    break
+                f.write(chunk)
+                written += len(chunk)
+        except ClientDisconnected:
+            pass  # keep what arrived; the client resumes from the new offset
+        if too_long:
+            f.truncate(offset)
+            db.session.rollback()
+            return _resumable_response(upload, 413, error='chunk exceeds upload length')
+        f.flush()
+        os.fsync(f.fileno())
+        upload.offset = offset + written
+        upload.updated_at = datetime.datetime.utcnow()
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return _resumable_response(upload)
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_resumable_upload(upload_id):
+    upload = _resumable_or_404(upload_id)
+    create, fields = UPLOAD_TARGETS[upload.target]
+    if any(field not in request.form for field in fields):
+        return jsonify(error='missing fields', fields=list(fields)), 400
+    values = {field: request.form[field] for field in fields}
+    expected = request.form.get('sha256', '').lower()
+    if expected and not re.match(r'^[0-9a-f]{64}$', expected):
+        return jsonify(error='malformed sha256'), 400
+    idempotency_key = request_idempotency_key()  # validated before the claim: a 400 must not cost the take
+    claimed = ResumableUpload.query.filter_by(id=upload.id, status='uploading', offset=upload.length) \
+        .update({'status': 'finalizing', 'updated_at': datetime.datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    db.session.refresh(upload)
+    if not claimed:
+        if upload.status == 'done':  # retried finalize: answer like the first time
+            return _resumable_response(upload, 200, redirect=url_for(upload.target), stored=upload.result)
+        if upload.status == 'failed':  # for good: clients must stop retrying
+            return _resumable_response(upload, 410, error='upload failed')
+        return _resumable_response(upload, 409, error='upload incomplete or already finalizing')
+    path = resumable_part_path(upload.id)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    if expected and digest.hexdigest() != expected:
+        # Corrupt on the way in: start over rather than store bad bytes
+        open(path, 'wb').close()
+        upload.status, upload.offset = 'uploading', 0
+        db.session.commit()
+        return _resumable_response(upload, 422, error='checksum mismatch')
+    name = None
+    try:
+        name = _place_in_store(path, digest.hexdigest(), upload.filename.rsplit('.', 1)[1].lower())
+        create(name, idempotency_key=idempotency_key, **values)
+    except HTTPException:
+        # Not the upload's fault: finalizable again unless its bytes already moved into the store
+        db.session.rollback()
+        upload.status = 'uploading' if name is None else 'failed'
+        db.session.commit()
+        raise
+    except Exception:
+        db.session.rollback()
+        upload.status = 'failed'
+        db.session.commit()
+        raise
+    upload.status, upload.result = 'done', name
+    upload.updated_at = datetime.datetime.utcnow()
+    db.session.commit()
+    return _resumable_response(upload, 200, redirect=url_for(upload.target), stored=name)
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    path = upload_path(filename)
+    try:
+        st = os.stat(path) if path else None
+    except OSError:
+        st = None
+    if st is None or not os.path.isfile(path):
+        abort(404)
+    if is_content_addressed(filename):
+        # The name is the content hash: the URL can never point at other bytes. The
+        # whole name is the ETag, since derived files (<hash>.w640.webp, <hash>.peaks)
+        # share the original's hash but not its bytes
+        etag = filename
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+        else:
+            response = send_media(path, st, etag=etag, offload='uploads')
+        response.cache_control.public = True
+        response.cache_control.max_age = UPLOAD_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+    return _send_mutable_media(path, st, 'uploads')
+
+@app.route('/uploads/<filename>/peaks')
+def upload_peaks(filename):
+    """One zoom level of a media upload's waveform: .dat bytes, or audiowaveform JSON with ?format=json."""
+    if not is_content_addressed(filename) or filename.rsplit('.', 1)[1] not in VIDEO_EXTENSIONS | AUDIO_EXTENSIONS:
+        abort(404)
+    width = request.args.get('width', app.config['MEDIA_PEAKS']['default_width'], type=int)
+    as_json = request.args.get('format') == 'json'
+    if not width or width < 1 or request.args.get('format', 'dat') not in ('dat', 'json'):
+        abort(400)
+    blob = db.session.get(UploadBlob, filename)
+    meta = blob.media_meta_dict() if blob is not None else {}
+    if meta.get('revision') != MEDIA_PEAKS_REVISION:
+        pending = MediaJob.query.filter(MediaJob.kind == 'peaks', MediaJob.target == filename,
+                                        MediaJob.status.in_(('queued', 'running'))).first()
+        if pending is not None:
+            return jsonify(error='waveform is not ready yet'), 202, {'Retry-After': '5'}
+        abort(404)
+    # The coarsest level that still has `width` pixels, else the finest there is
+    levels = sorted(meta['levels'], key=lambda l: l['samples_per_pixel'])
+    level = next((l for l in reversed(levels) if l['length'] >= width), levels[0])
+    etag = f"{filename[:64]}.peaks{MEDIA_PEAKS_REVISION}.{level['samples_per_pixel']}{'.json' if as_json else ''}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        try:
+            with open(media_peaks_path(filename), 'rb') as f:
+                f.seek(level['offset'])
+                data = f.read(level['size'])
+        except OSError:
+            abort(404)
+        if as_json:
+            version, flags, sample_rate, samples_per_pixel, length, channels = PEAKS_DAT_HEADER.unpack_from(data)
+            response = jsonify(version=version, channels=channels, sample_rate=sample_rate,
+                               samples_per_pixel=samples_per_pixel, bits=8, length=length,
+                               data=list(struct.unpack_from(f'{2 * length}b', data, PEAKS_DAT_HEADER.size)),
+                               duration=meta['duration'], loudness=meta['loudness'])
+        else:
+            response = Response(data, mimetype='application/octet-stream')
+    response.set_etag(etag)
+    # Derived from immutable bytes; a new MEDIA_PEAKS_REVISION changes the ETag, not the URL
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
 
 @app.route('/upload-logo', methods=['POST'])
 def upload_logo():
@@ -1912,11 +4453,9 @@ def upload_logo():
     
     file = request.files['logo']
     if file and file.filename != '' and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        filename = store_upload(file)
         
-        with open('logo_config.txt', 'w') as f:
-            f.write(filename)
+        update_site_settings(logo_file=filename)
             
     return redirect(url_for('index'))
 
@@ -1924,32 +4463,205 @@ def upload_logo():
 def manifest():
     return Response(MANIFEST_CONTENT, mimetype='application/json')
 
+# Pages that only need the shell to work offline; precached on service-worker install
+SW_PRECACHE_ENDPOINTS = ('index', 'metronome', 'metronome_clock', 'ear_training', 'rhythm_trainer', 'visual_chord', 'scrolling_sheet')
+# Database-backed pages served from cache instantly and refreshed in the background
+SW_SWR_ENDPOINTS = ('gallery', 'news', 'api_gallery', 'api_news')
+SW_CDN_ASSETS = (
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+    'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css',
+    'https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap',
+)
+SW_CDN_ORIGINS = ('https://cdn.jsdelivr.net', 'https://cdnjs.cloudflare.com',
+                  'https://fonts.googleapis.com', 'https://fonts.gstatic.com')
+SW_CACHE_BUDGETS = {'bimbel-assets': 60 * 1024 * 1024, 'bimbel-pages-': 10 * 1024 * 1024}
+SW_MAX_ENTRY_BYTES = 8 * 1024 * 1024  # larger responses (videos) are never cached
+
 @app.route('/service-worker.js')
+@cached_page(mimetype='application/javascript')
 def service_worker():
-    return Response(SW_CONTENT, mimetype='application/javascript')
+    settings = get_site_settings()
+    precache = [url_for(endpoint) for endpoint in SW_PRECACHE_ENDPOINTS]
+    precache += [url_for('manifest'), url_for('icon_192'), url_for('icon_512'),
+                 url_for('uploaded_file', filename=settings.get('bg_image') or 'default.jpg')]
+    if settings.get('logo_file'):
+        precache.append(url_for('uploaded_file', filename=settings['logo_file']))
+    precache += SW_CDN_ASSETS
+    version = hashlib.sha256(json.dumps([TEMPLATE_BUILD_ID, precache]).encode('utf-8')).hexdigest()[:16]
+    return render_template('service-worker.js', version=version, precache_urls=precache,
+                           swr_paths=[url_for(endpoint) for endpoint in SW_SWR_ENDPOINTS],
+                           cdn_origins=SW_CDN_ORIGINS, budgets=SW_CACHE_BUDGETS,
+                           max_entry_bytes=SW_MAX_ENTRY_BYTES)
+
+# --- JAM VARIANTS ---
+# /static/audio/<track>?key=D&bpm=100 is the backing track transposed and
+# time-stretched by ffmpeg (rubberband when compiled in, else resampling plus
+# atempo). Renders run as ffmpeg processes from a small per-process pool, are
+# shared by concurrent requests for the same variant and land in
+# AUDIO_FOLDER/.variants, which is trimmed least-recently-used first to
+# JAM_VARIANT_MAX_BYTES. Only the request that starts a render waits for it, and
+# no longer than JAM_RENDER_WAIT_SECONDS, so renders never hold request workers;
+# everyone else gets 202 with Retry-After and polls.
+JAM_VARIANT_REVISION = 1  # bump when render_jam_variant() output changes
+_jam_executor = None
+_jam_renders = {}  # variant path -> Future
+_jam_renders_lock = threading.Lock()
+
+def jam_variant_dir():
+    return os.path.join(app.config['AUDIO_FOLDER'], '.variants')
+
+def jam_variant_request(filename, args):
+    """(semitones, tempo factor, bpm) asked for by the query string; ValueError if invalid."""
+    track = app.config['JAM_TRACKS'].get(filename)
+    if track is None:
+        raise ValueError("this track has no key/tempo information")
+    key = args.get('key', track['key'])
+    if key not in PITCH_NOTE_NAMES:
+        raise ValueError(f"key must be one of {', '.join(PITCH_NOTE_NAMES)}")
+    try:
+        bpm = int(args.get('bpm', track['bpm']))
+    except ValueError:
+        raise ValueError("bpm must be an integer") from None
+    if not track['bpm'] / 2 <= bpm <= track['bpm'] * 2:
+        raise ValueError(f"bpm must be between {math.ceil(track['bpm'] / 2)} and {track['bpm'] * 2}")
+    # Transpose the shorter way round: A from C is 3 down, not 9 up
+    semitones = (PITCH_NOTE_NAMES.index(key) - PITCH_NOTE_NAMES.index(track['key'])) % 12
+    if semitones > 6:
+        semitones -= 12
+    return semitones, bpm / track['bpm'], bpm
+
+def jam_variant_path(src, st, semitones, bpm):
+    """Cache path of a variant; the source's size and mtime are part of the name."""
+    stem, ext = os.path.splitext(os.path.basename(src))
+    sig = hashlib.sha256(f"{st.st_size}:{st.st_mtime_ns}:{JAM_VARIANT_REVISION}".encode('utf-8')).hexdigest()[:12]
+    return os.path.join(jam_variant_dir(), f"{stem}.p{semitones:+d}.t{bpm}.{sig}{ext}")
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_has_filter(name):
+    listing = run_ffmpeg(['-filters']).decode('utf-8', 'replace')
+    return re.search(rf'^\s*\S+\s+{re.escape(name)}\s', listing, re.M) is not None
+
+def _atempo_chain(factor):
+    """atempo filters multiplying to `factor` (older ffmpeg only takes 0.5-2.0 per filter)."""
+    parts = []
+    while factor > 2.0:
+        parts.append(2.0)
+        factor /= 2.0
+    while factor < 0.5:
+        parts.append(0.5)
+        factor /= 0.5
+    parts.append(factor)
+    return ','.join(f"atempo={f:.6f}" for f in parts)
+
+def render_jam_variant(src, dest, semitones, tempo):
+    pitch = 2 ** (semitones / 12)
+    if ffmpeg_has_filter('rubberband'):
+        chain = f"rubberband=pitch={pitch:.6f}:tempo={tempo:.6f}"
+    else:
+        # Playing the samples faster raises pitch and tempo together; atempo then sets the tempo
+        rate = 44100
+        chain = f"aresample={rate},asetrate={rate * pitch:.3f},aresample={rate},{_atempo_chain(tempo / pitch)}"
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    stem, ext = os.path.splitext(dest)
+    tmp_path = f"{stem}.{secrets.token_hex(4)}.tmp{ext}"
+    try:
+        run_ffmpeg(['-y', '-i', src, '-vn', '-map_metadata', '-1', '-af', chain, tmp_path])
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    trim_jam_variants(keep=dest)
+
+def trim_jam_variants(keep=None):
+    """Delete least recently served variants until the cache fits JAM_VARIANT_MAX_BYTES."""
+    entries = []
+    with os.scandir(jam_variant_dir()) as it:
+        for entry in it:
+            if entry.is_file() and '.tmp' not in entry.name:
+                st = entry.stat()
+                entries.append((st.st_atime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= app.config['JAM_VARIANT_MAX_BYTES']:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)  # open readers keep their file on POSIX
+        except OSError:
+            continue
+        total -= size
+
+def submit_jam_render(src, dest, semitones, tempo):
+    """(future, started) for rendering `dest`; requests for a variant already in progress share one."""
+    global _jam_executor
+    with _jam_renders_lock:
+        future = _jam_renders.get(dest)
+        started = future is None
+        if started:
+            if _jam_executor is None:
+                _jam_executor = ThreadPoolExecutor(max_workers=app.config['JAM_RENDER_WORKERS'],
+                                                   thread_name_prefix='jam-variants')
+            future = _jam_executor.submit(render_jam_variant, src, dest, semitones, tempo)
+            _jam_renders[dest] = future
+            future.add_done_callback(lambda f: _jam_renders.pop(dest, None))
+    return future, started
 
 @app.route('/static/audio/<filename>')
 def serve_audio(filename):
-    return send_from_directory('static/audio', filename)
+    path = safe_join(app.config['AUDIO_FOLDER'], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    st = os.stat(path)
+    if 'key' in request.args or 'bpm' in request.args:
+        try:
+            semitones, tempo, bpm = jam_variant_request(filename, request.args)
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        if semitones or tempo != 1:
+            src, path = path, jam_variant_path(path, st, semitones, bpm)
+            try:
+                st = os.stat(path)
+                os.utime(path, (time.time(), st.st_mtime))  # atime marks it recently used
+            except FileNotFoundError:
+                future, started = submit_jam_render(src, path, semitones, tempo)
+                try:
+                    future.result(timeout=app.config['JAM_RENDER_WAIT_SECONDS'] if started else 0)
+                    st = os.stat(path)
+                except FutureTimeoutError:
+                    return jsonify(status='rendering'), 202, {'Retry-After': '2'}
+                except FileNotFoundError:
+                    # Evicted by trim_jam_variants() right after rendering: render it again
+                    submit_jam_render(src, path, semitones, tempo)
+                    return jsonify(status='rendering'), 202, {'Retry-After': '2'}
+                except MediaJobError as e:
+                    return jsonify(error=str(e)), 503
+                except Exception:
+                    app.logger.exception("Rendering %s failed", path)
+                    return jsonify(error='rendering failed'), 500
+            try:
+                return _send_mutable_media(path, st, 'audio')
+            except FileNotFoundError:  # evicted between the stat and the open
+                submit_jam_render(src, path, semitones, tempo)
+                return jsonify(status='rendering'), 202, {'Retry-After': '2'}
+    return _send_mutable_media(path, st, 'audio')
+
+def _serve_app_icon():
+    filename = get_site_setting('logo_file')
+    path = upload_path(filename) if filename else None
+    if path and os.path.isfile(path):
+        return send_file(path)
+    # Fallback to static/logobimbel.png
+    return send_from_directory('static', 'logobimbel.png')
 
 @app.route('/uploads/icon-192.png')
 def icon_192():
-    if os.path.exists('logo_config.txt'):
-        with open('logo_config.txt', 'r') as f:
-            filename = f.read().strip()
-            if filename and os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
-                return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
-    # Fallback to static/logobimbel.png
-    return send_from_directory('static', 'logobimbel.png')
+    return _serve_app_icon()
 
 @app.route('/uploads/icon-512.png')
 def icon_512():
-    if os.path.exists('logo_config.txt'):
-        with open('logo_config.txt', 'r') as f:
-            filename = f.read().strip()
-            if filename and os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
-                return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
-    return send_from_directory('static', 'logobimbel.png')
+    return _serve_app_icon()
 
 @app.route('/wallpaper-blur/upload', methods=['POST'])
 def wallpaper_upload():
@@ -1958,11 +4670,9 @@ def wallpaper_upload():
     
     file = request.files['background']
     if file and file.filename != '' and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        filename = store_upload(file)
         
-        with open('bg_config.txt', 'w') as f:
-            f.write(filename)
+        update_site_settings(bg_image=filename)
             
     return redirect(url_for('index'))
 
@@ -2304,9 +5014,111 @@ HTML_DOREMI_CONTENT = """
     </script>
 """
 
+# Canvas helpers shared by the scrolling sheet and the rhythm trainer. Glows are
+# drawn once into sprites instead of with shadowBlur on every frame, moving
+# objects live in fixed pools (no splice) and motion is scaled by frame time.
+CANVAS_SPRITES_JS = """
+// Draw once into an offscreen surface; the result goes straight to drawImage
+function prerenderSprite(width, height, draw) {
+    let surface;
+    width = Math.max(1, Math.ceil(width));
+    height = Math.max(1, Math.ceil(height));
+    if (typeof OffscreenCanvas !== 'undefined') {
+        surface = new OffscreenCanvas(width, height);
+    } else {
+        surface = document.createElement('canvas');
+        surface.width = width;
+        surface.height = height;
+    }
+    draw(surface.getContext('2d'));
+    return surface.transferToImageBitmap ? surface.transferToImageBitmap() : surface;
+}
+
+// Preallocated objects; items[0..count) are live. release() swaps the item with the
+// last live one, so loops that release must run backwards.
+class ObjectPool {
+    constructor(capacity, create) {
+        this.items = Array.from({ length: capacity }, create);
+        this.count = 0;
+    }
+
+    acquire() {
+        return this.count < this.items.length ? this.items[this.count++] : null;
+    }
+
+    release(index) {
+        const last = --this.count;
+        const item = this.items[index];
+        this.items[index] = this.items[last];
+        this.items[last] = item;
+    }
+
+    clear() {
+        this.count = 0;
+    }
+}
+
+// Frame timing: begin() returns the seconds since the previous frame (capped, so a
+// backgrounded tab does not teleport everything), end() records the work done.
+// The overlay shows fps and per-frame work over the last 120 frames.
+class FrameClock {
+    constructor(container) {
+        this.intervals = new Float32Array(120);
+        this.work = new Float32Array(120);
+        this.index = 0;
+        this.filled = 0;
+        this.last = 0;
+        this.started = 0;
+        this.nextReport = 0;
+        this.overlay = document.createElement('div');
+        this.overlay.style.cssText = 'position:absolute;top:8px;right:10px;z-index:30;font:12px monospace;' +
+            'color:#0f0;background:rgba(0,0,0,0.6);padding:2px 6px;border-radius:4px;pointer-events:none;';
+        this.overlay.hidden = true;
+        container.appendChild(this.overlay);
+    }
+
+    toggleOverlay() {
+        this.overlay.hidden = !this.overlay.hidden;
+        this.overlay.textContent = '-- fps';
+        this.nextReport = 0;
+    }
+
+    reset() {
+        this.last = 0;
+        this.filled = 0;
+    }
+
+    begin(now) {
+        const dt = this.last ? Math.min(now - this.last, 100) : 0;
+        this.last = now;
+        this.started = performance.now();
+        this.intervals[this.index] = dt;
+        return dt / 1000;
+    }
+
+    end() {
+        if (!this.intervals[this.index]) return;  // first frame: no interval yet
+        this.work[this.index] = performance.now() - this.started;
+        this.index = (this.index + 1) % this.intervals.length;
+        this.filled = Math.min(this.filled + 1, this.intervals.length);
+        if (this.overlay.hidden || this.last < this.nextReport) return;
+        this.nextReport = this.last + 500;
+        let interval = 0, work = 0, worst = 0;
+        for (let i = 0; i < this.filled; i++) {
+            interval += this.intervals[i];
+            work += this.work[i];
+            worst = Math.max(worst, this.work[i]);
+        }
+        this.overlay.textContent = `${Math.round(1000 * this.filled / interval)} fps \\u00b7 ` +
+            `${(work / this.filled).toFixed(2)} ms/frame (maks ${worst.toFixed(2)})`;
+    }
+}
+"""
+
 @app.route('/rhythm-trainer')
+@cached_page
 def rhythm_trainer():
-    return render_layout(RHYTHM_TRAINER_HTML)
+    return render_layout('rhythm_trainer.html')
 
 RHYTHM_TRAINER_HTML = """
 <style>
@@ -2364,20 +5176,6 @@ RHYTHM_TRAINER_HTML = """
         opacity: 1;
         transform: translate(-50%, -60%) scale(1.2);
     }
-    .particle {
-        position: absolute;
-        width: 8px;
-        height: 8px;
-        background: #00ffcc;
-        border-radius: 50%;
-        pointer-events: none;
-        animation: pop 0.5s ease-out forwards;
-        z-index: 15;
-    }
-    @keyframes pop {
-        0% { transform: scale(1) translate(0, 0); opacity: 1; }
-        100% { transform: scale(0) translate(var(--tx), var(--ty)); opacity: 0; }
-    }
     .controls {
         background: rgba(255, 255, 255, 0.05);
         padding: 20px;
@@ -2406,11 +5204,14 @@ RHYTHM_TRAINER_HTML = """
         <button id="startGameBtn" class="btn btn-primary btn-lg rounded-pill px-5 py-3 fw-bold shadow-lg mb-3">
             <i class="fas fa-play me-2"></i> MULAI MAIN
         </button>
+        <button id="fpsToggle" class="btn btn-sm btn-outline-light rounded-pill ms-2 mb-3" title="Tampilkan FPS">FPS</button>
         <p class="text-white opacity-75 small mb-0">Tekan <kbd>Spasi</kbd> atau <kbd>Tap Layar</kbd> tepat saat balok menyentuh garis putih!</p>
     </div>
 </div>
 
 <script>
+    {% include 'canvas_sprites.js' %}
+
     const canvas = document.getElementById('gameCanvas');
     const ctx = canvas.getContext('2d');
     const container = document.getElementById('arcadeContainer');
@@ -2423,9 +5224,7 @@ RHYTHM_TRAINER_HTML = """
     let isPlaying = false;
     let score = 0;
     let combo = 0;
-    let blocks = [];
-    let speed = 4; // pixels per frame
-    let lastTime = 0;
+    let speed = 240; // pixels per second
     let nextSpawnTime = 0;
     let bpm = 90;
     let msPerBeat = 60000 / bpm;
@@ -2442,6 +5241,28 @@ RHYTHM_TRAINER_HTML = """
     const targetY = canvas.height - 50; // Matches CSS target-line bottom: 50px (approx)
     const hitWindow = 30; // +/- pixels for a hit
 
+    const BLOCK_WIDTH = 80, BLOCK_HEIGHT = 20, GLOW = 20;
+    const PARTICLE_SECONDS = 0.5;
+    // At most a screenful of blocks and a few bursts of particles exist at once
+    const blocks = new ObjectPool(32, () => ({ x: 0, y: 0, active: false }));
+    const particles = new ObjectPool(64, () => ({ x: 0, y: 0, vx: 0, vy: 0, age: 0 }));
+    const frameClock = new FrameClock(container);
+
+    const blockSprite = prerenderSprite(BLOCK_WIDTH + 2 * GLOW, BLOCK_HEIGHT + 2 * GLOW, (g) => {
+        g.fillStyle = '#00ffcc';
+        g.shadowBlur = 15;
+        g.shadowColor = '#00ffcc';
+        g.fillRect(GLOW, GLOW, BLOCK_WIDTH, BLOCK_HEIGHT);
+    });
+    const particleSprite = prerenderSprite(16, 16, (g) => {
+        g.fillStyle = '#00ffcc';
+        g.shadowBlur = 6;
+        g.shadowColor = '#00ffcc';
+        g.beginPath();
+        g.arc(8, 8, 4, 0, 2 * Math.PI);
+        g.fill();
+    });
+
     function createClickSound() {
         if (!audioCtx) audioCtx = new (window.AudioContext || window.webkitAudioContext)();
         if (audioCtx.state === 'suspended') audioCtx.resume();
@@ -2459,16 +5280,15 @@ RHYTHM_TRAINER_HTML = """
         osc.stop(audioCtx.currentTime + 0.1);
     }
 
-    function spawnBlock() {
-        blocks.push({
-            x: canvas.width / 2 - 40,
-            y: -20,
-            width: 80,
-            height: 20,
-            active: true
-        });
+    function spawnBlock(now) {
+        const b = blocks.acquire();
+        if (b) {
+            b.x = canvas.width / 2 - BLOCK_WIDTH / 2;
+            b.y = -BLOCK_HEIGHT;
+            b.active = true;
+        }
         createClickSound();
-        nextSpawnTime = performance.now() + msPerBeat;
+        nextSpawnTime = now + msPerBeat;
     }
 
     function showFeedback(text, color) {
@@ -2481,50 +5301,47 @@ RHYTHM_TRAINER_HTML = """
 
     function createParticles(x, y) {
         for(let i=0; i<10; i++) {
-            const p = document.createElement('div');
-            p.className = 'particle';
-            p.style.left = `${x}px`;
-            p.style.top = `${y}px`;
+            const p = particles.acquire();
+            if (!p) break;
             const angle = Math.random() * Math.PI * 2;
             const dist = 50 + Math.random() * 50;
-            p.style.setProperty('--tx', `${Math.cos(angle) * dist}px`);
-            p.style.setProperty('--ty', `${Math.sin(angle) * dist}px`);
-            container.appendChild(p);
-            setTimeout(() => p.remove(), 500);
+            p.x = x;
+            p.y = y;
+            p.vx = Math.cos(angle) * dist / PARTICLE_SECONDS;
+            p.vy = Math.sin(angle) * dist / PARTICLE_SECONDS;
+            p.age = 0;
         }
     }
 
     function registerHit() {
         if (!isPlaying) return;
         
-        let hitRegistered = false;
-        // Find lowest active block
-        for (let i = 0; i < blocks.length; i++) {
-            let b = blocks[i];
-            if (b.active) {
-                const dist = Math.abs(b.y - targetY);
-                if (dist < hitWindow) {
-                    b.active = false; // Mark hit
-                    hitRegistered = true;
-                    
-                    if (dist < hitWindow / 3) {
-                        score += 100;
-                        combo++;
-                        showFeedback("SEMPURNA!", "#00ffcc");
-                        createParticles(container.clientWidth/2, targetY);
-                    } else {
-                        score += 50;
-                        combo++;
-                        showFeedback("BAIK!", "#ffcc00");
-                    }
-                    scoreVal.innerText = score;
-                    comboVal.innerText = combo;
-                    break; // Only hit one block
-                }
+        // The active block closest to the line
+        let hit = null, dist = Infinity;
+        for (let i = 0; i < blocks.count; i++) {
+            const b = blocks.items[i];
+            const d = Math.abs(b.y - targetY);
+            if (b.active && d < dist) {
+                hit = b;
+                dist = d;
             }
         }
         
-        if (!hitRegistered) {
+        if (hit && dist < hitWindow) {
+            hit.active = false; // Mark hit
+            if (dist < hitWindow / 3) {
+                score += 100;
+                combo++;
+                showFeedback("SEMPURNA!", "#00ffcc");
+                createParticles(container.clientWidth/2, targetY);
+            } else {
+                score += 50;
+                combo++;
+                showFeedback("BAIK!", "#ffcc00");
+            }
+            scoreVal.innerText = score;
+            comboVal.innerText = combo;
+        } else {
             combo = 0;
             comboVal.innerText = combo;
             showFeedback("MELESET!", "#ff3366");
@@ -2533,24 +5350,21 @@ RHYTHM_TRAINER_HTML = """
 
     function gameLoop(timestamp) {
         if (!isPlaying) return;
+        const dt = frameClock.begin(timestamp);
         
         ctx.clearRect(0, 0, canvas.width, canvas.height);
         
         if (timestamp >= nextSpawnTime) {
-            spawnBlock();
+            spawnBlock(timestamp);
         }
         
         // Draw blocks
-        for (let i = blocks.length - 1; i >= 0; i--) {
-            let b = blocks[i];
-            b.y += speed;
+        for (let i = blocks.count - 1; i >= 0; i--) {
+            const b = blocks.items[i];
+            b.y += speed * dt;
             
             if (b.active) {
-                ctx.fillStyle = '#00ffcc';
-                ctx.shadowBlur = 15;
-                ctx.shadowColor = '#00ffcc';
-                ctx.fillRect(b.x, b.y, b.width, b.height);
-                ctx.shadowBlur = 0; // reset
+                ctx.drawImage(blockSprite, b.x - GLOW, b.y - GLOW);
             }
             
             // Missed block
@@ -2563,10 +5377,26 @@ RHYTHM_TRAINER_HTML = """
             
             // Remove offscreen
             if (b.y > canvas.height + 50) {
-                blocks.splice(i, 1);
+                blocks.release(i);
+            }
+        }
+        
+        // Particles burst outwards and fade
+        for (let i = particles.count - 1; i >= 0; i--) {
+            const p = particles.items[i];
+            p.age += dt;
+            if (p.age >= PARTICLE_SECONDS) {
+                particles.release(i);
+                continue;
             }
+            p.x += p.vx * dt;
+            p.y += p.vy * dt;
+            ctx.globalAlpha = 1 - p.age / PARTICLE_SECONDS;
+            ctx.drawImage(particleSprite, p.x - 8, p.y - 8);
         }
+        ctx.globalAlpha = 1;
         
+        frameClock.end();
         animationId = requestAnimationFrame(gameLoop);
     }
 
@@ -2583,7 +5413,9 @@ RHYTHM_TRAINER_HTML = """
             isPlaying = true;
             score = 0;
             combo = 0;
-            blocks = [];
+            blocks.clear();
+            particles.clear();
+            frameClock.reset();
             scoreVal.innerText = score;
             comboVal.innerText = combo;
             nextSpawnTime = performance.now() + 1000; // start in 1s
@@ -2594,6 +5426,7 @@ RHYTHM_TRAINER_HTML = """
     }
 
     startBtn.addEventListener('click', startGame);
+    document.getElementById('fpsToggle').addEventListener('click', () => frameClock.toggleOverlay());
 
     window.addEventListener('keydown', (e) => {
         if (e.code === 'Space') {
@@ -2613,8 +5446,9 @@ RHYTHM_TRAINER_HTML = """
 """
 
 @app.route('/visual-chord')
+@cached_page
 def visual_chord():
-    return render_layout(VISUAL_CHORD_HTML)
+    return render_layout('visual_chord.html')
 
 VISUAL_CHORD_HTML = """
 <style>
@@ -2815,8 +5649,169 @@ VISUAL_CHORD_HTML = """
 """
 
 @app.route('/vocal-detector')
+@cached_page
 def vocal_detector():
-    return render_layout(VOCAL_DETECTOR_HTML)
+    return render_layout('vocal_detector.html')
+
+@app.route('/vocal-detector/pitch-worklet.js')
+@cached_page(mimetype='application/javascript')
+def pitch_worklet():
+    return render_template('pitch_worklet.js')
+
+@app.route('/vocal-detector/benchmark')
+@cached_page
+def pitch_benchmark():
+    return render_layout('pitch_benchmark.html')
+
+# YIN pitch tracker shared by the vocal detector's AudioWorklet, its main-thread
+# fallback and the benchmark page. Every buffer is allocated in the constructor.
+# The difference function d(tau) = e(0) + e(tau) - 2 r(tau) takes its correlation
+# term from one complex FFT of the frame and the reversed window packed as real
+# and imaginary parts, plus one inverse FFT, instead of the O(N^2) loop.
+PITCH_TRACKER_JS = """
+class PitchTracker {
+    constructor(sampleRate, frameSize = 2048, { fmin = 60, fmax = 1500, threshold = 0.15, minRms = 0.01 } = {}) {
+        this.sampleRate = sampleRate;
+        this.size = frameSize;
+        this.threshold = threshold;
+        this.minRms = minRms;
+        this.tauMax = Math.min(Math.ceil(sampleRate / fmin) + 1, frameSize >> 1);
+        this.tauMin = Math.max(2, Math.floor(sampleRate / fmax));
+        this.window = frameSize - this.tauMax;
+        let n = 1;
+        while (n < frameSize + this.window) n <<= 1;
+        this.n = n;
+        this.re = new Float64Array(n);
+        this.im = new Float64Array(n);
+        this.pr = new Float64Array(n);
+        this.pi = new Float64Array(n);
+        this.energy = new Float64Array(frameSize + 1);
+        this.cmnd = new Float64Array(this.tauMax);
+        this.cos = new Float64Array(n >> 1);
+        this.sin = new Float64Array(n >> 1);
+        for (let i = 0; i < n >> 1; i++) {
+            this.cos[i] = Math.cos(2 * Math.PI * i / n);
+            this.sin[i] = Math.sin(2 * Math.PI * i / n);
+        }
+        this.rev = new Uint32Array(n);
+        for (let i = 0, bits = Math.log2(n); i < n; i++) {
+            let r = 0;
+            for (let b = 0; b < bits; b++) r = (r << 1) | ((i >> b) & 1);
+            this.rev[i] = r;
+        }
+    }
+
+    // In-place iterative radix-2 FFT (unscaled in both directions)
+    fft(re, im, inverse) {
+        const n = this.n, rev = this.rev, cos = this.cos, sin = this.sin;
+        for (let i = 0; i < n; i++) {
+            const j = rev[i];
+            if (j > i) {
+                let t = re[i]; re[i] = re[j]; re[j] = t;
+                t = im[i]; im[i] = im[j]; im[j] = t;
+            }
+        }
+        for (let len = 2; len <= n; len <<= 1) {
+            const half = len >> 1, step = n / len;
+            for (let start = 0; start < n; start += len) {
+                for (let k = 0; k < half; k++) {
+                    const c = cos[k * step], s = inverse ? sin[k * step] : -sin[k * step];
+                    const a = start + k, b = a + half;
+                    const xr = re[b] * c - im[b] * s, xi = re[b] * s + im[b] * c;
+                    re[b] = re[a] - xr; im[b] = im[a] - xi;
+                    re[a] += xr; im[a] += xi;
+                }
+            }
+        }
+    }
+
+    // Fundamental frequency of `frame` (frameSize samples) in Hz, or -1 when silent/unpitched
+    detect(frame) {
+        const { size, window: w, tauMax, n, re, im, pr, pi, energy, cmnd } = this;
+        energy[0] = 0;
+        for (let i = 0; i < size; i++) energy[i + 1] = energy[i] + frame[i] * frame[i];
+        if (Math.sqrt(energy[size] / size) < this.minRms) return -1;  // not enough signal
+
+        for (let i = 0; i < n; i++) {
+            re[i] = i < size ? frame[i] : 0;
+            im[i] = i < w ? frame[w - 1 - i] : 0;
+        }
+        this.fft(re, im, false);
+        // Unpack the two real spectra (A: frame, B: reversed window) and multiply them
+        for (let k = 0; k < n; k++) {
+            const j = (n - k) & (n - 1);
+            const ar = (re[k] + re[j]) / 2, ai = (im[k] - im[j]) / 2;
+            const br = (im[k] + im[j]) / 2, bi = (re[j] - re[k]) / 2;
+            pr[k] = ar * br - ai * bi;
+            pi[k] = ar * bi + ai * br;
+        }
+        this.fft(pr, pi, true);  // pr[w - 1 + tau] / n = sum_j frame[j] * frame[j + tau], j < w
+
+        const e0 = energy[w];
+        let running = 0;
+        cmnd[0] = 1;
+        for (let tau = 1; tau < tauMax; tau++) {
+            const d = Math.max(0, e0 + energy[tau + w] - energy[tau] - 2 * pr[w - 1 + tau] / n);
+            running += d;
+            cmnd[tau] = running > 0 ? d * tau / running : 1;
+        }
+        // First dip under the threshold, followed down to its minimum
+        let tau = -1;
+        for (let t = this.tauMin; t < tauMax - 1; t++) {
+            if (cmnd[t] < this.threshold) {
+                while (t + 2 < tauMax && cmnd[t + 1] < cmnd[t]) t++;
+                tau = t;
+                break;
+            }
+        }
+        if (tau < 0) return -1;
+        const l = cmnd[tau - 1], m = cmnd[tau], r = cmnd[tau + 1];
+        const curve = l + r - 2 * m;
+        const shift = curve ? Math.max(-1, Math.min(1, (l - r) / (2 * curve))) : 0;
+        return this.sampleRate / (tau + shift);
+    }
+}
+"""
+
+# Runs inside the AudioWorklet: keeps the last frameSize samples in a ring buffer
+# and posts one pitch (Hz, or -1) to the page `rate` times per second
+PITCH_WORKLET_JS = """
+{% include 'pitch_tracker.js' %}
+
+class PitchProcessor extends AudioWorkletProcessor {
+    constructor(options) {
+        super();
+        const opts = (options && options.processorOptions) || {};
+        this.tracker = new PitchTracker(sampleRate, opts.frameSize || 2048);
+        this.ring = new Float32Array(this.tracker.size);
+        this.frame = new Float32Array(this.tracker.size);
+        this.write = 0;
+        this.interval = Math.round(sampleRate / (opts.rate || 30));
+        this.pending = this.interval;
+    }
+
+    process(inputs) {
+        const channel = inputs[0] && inputs[0][0];
+        if (!channel) return true;
+        const ring = this.ring;
+        for (let i = 0; i < channel.length; i++) {
+            ring[this.write] = channel[i];
+            this.write = this.write + 1 === ring.length ? 0 : this.write + 1;
+        }
+        this.pending -= channel.length;
+        if (this.pending <= 0) {
+            this.pending += this.interval;
+            // Unroll the ring, oldest sample first
+            this.frame.set(ring.subarray(this.write));
+            this.frame.set(ring.subarray(0, this.write), ring.length - this.write);
+            this.port.postMessage(this.tracker.detect(this.frame));
+        }
+        return true;
+    }
+}
+
+registerProcessor('pitch-processor', PitchProcessor);
+"""
 
 VOCAL_DETECTOR_HTML = """
 <style>
@@ -2928,10 +5923,15 @@ VOCAL_DETECTOR_HTML = """
     let audioCtx;
     let analyser;
     let microphone;
+    let pitchNode;
     let isDetecting = false;
-    let animationId;
-    let bufferLength;
+    let fallbackTimer;
     let dataArray;
+
+    // Pitch results per second, from the worklet or the main-thread fallback
+    const PITCH_REPORT_RATE = 30;
+
+    {% include 'pitch_tracker.js' %}
     
     const noteStrings = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"];
 
@@ -2948,51 +5948,6 @@ VOCAL_DETECTOR_HTML = """
         return Math.floor(1200 * Math.log(frequency / frequencyFromNoteNumber(note)) / Math.log(2));
     }
 
-    // Autocorrelation algorithm for pitch detection
-    function autoCorrelate(buf, sampleRate) {
-        let SIZE = buf.length;
-        let rms = 0;
-        
-        for (let i = 0; i < SIZE; i++) {
-            let val = buf[i];
-            rms += val * val;
-        }
-        rms = Math.sqrt(rms / SIZE);
-        if (rms < 0.01) return -1; // Not enough signal
-
-        let r1 = 0, r2 = SIZE - 1, thres = 0.2;
-        for (let i = 0; i < SIZE / 2; i++)
-            if (Math.abs(buf[i]) < thres) { r1 = i; break; }
-        for (let i = 1; i < SIZE / 2; i++)
-            if (Math.abs(buf[SIZE - i]) < thres) { r2 = SIZE - i; break; }
-
-        buf = buf.slice(r1, r2);
-        SIZE = buf.length;
-
-        let c = new Array(SIZE).fill(0);
-        for (let i = 0; i < SIZE; i++)
-            for (let j = 0; j < SIZE - i; j++)
-                c[i] = c[i] + buf[j] * buf[j + i];
-
-        let d = 0; while (c[d] > c[d + 1]) d++;
-        let maxval = -1, maxpos = -1;
-        for (let i = d; i < SIZE; i++) {
-            if (c[i] > maxval) {
-                maxval = c[i];
-                maxpos = i;
-            }
-        }
-        let T0 = maxpos;
-        
-        // Parabolic interpolation
-        let x1 = c[T0 - 1], x2 = c[T0], x3 = c[T0 + 1];
-        let a = (x1 + x3 - 2 * x2) / 2;
-        let b = (x3 - x1) / 2;
-        if (a) T0 = T0 - b / (2 * a);
-
-        return sampleRate / T0;
-    }
-
     function drawMeter(cents) {
         ctx.clearRect(0, 0, canvas.width, canvas.height);
         
@@ -3042,12 +5997,9 @@ VOCAL_DETECTOR_HTML = """
         ctx.fill();
     }
 
-    function updatePitch() {
+    function showPitch(pitch) {
         if (!isDetecting) return;
         
-        analyser.getFloatTimeDomainData(dataArray);
-        let pitch = autoCorrelate(dataArray, audioCtx.sampleRate);
-        
         if (pitch == -1) {
             // No sound
             drawMeter(0);
@@ -3080,29 +6032,39 @@ VOCAL_DETECTOR_HTML = """
             
             drawMeter(cents);
         }
-        
-        animationId = requestAnimationFrame(updatePitch);
     }
 
     async function startMic() {
         try {
             const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
             audioCtx = new (window.AudioContext || window.webkitAudioContext)();
-            analyser = audioCtx.createAnalyser();
-            analyser.fftSize = 2048;
-            
             microphone = audioCtx.createMediaStreamSource(stream);
-            microphone.connect(analyser);
             
-            bufferLength = analyser.fftSize;
-            dataArray = new Float32Array(bufferLength);
+            if (audioCtx.audioWorklet) {
+                // Detection runs on the audio thread; the page only draws the results
+                await audioCtx.audioWorklet.addModule('/vocal-detector/pitch-worklet.js');
+                pitchNode = new AudioWorkletNode(audioCtx, 'pitch-processor', {
+                    numberOfOutputs: 0, processorOptions: { rate: PITCH_REPORT_RATE },
+                });
+                pitchNode.port.onmessage = (e) => showPitch(e.data);
+                microphone.connect(pitchNode);
+            } else {
+                // No AudioWorklet (old browsers, plain http): same tracker on a fixed timer
+                analyser = audioCtx.createAnalyser();
+                analyser.fftSize = 2048;
+                microphone.connect(analyser);
+                dataArray = new Float32Array(analyser.fftSize);
+                const tracker = new PitchTracker(audioCtx.sampleRate, analyser.fftSize);
+                fallbackTimer = setInterval(() => {
+                    analyser.getFloatTimeDomainData(dataArray);
+                    showPitch(tracker.detect(dataArray));
+                }, 1000 / PITCH_REPORT_RATE);
+            }
             
             isDetecting = true;
             micBtn.innerHTML = '<i class="fas fa-stop me-2"></i> Berhenti Deteksi';
             micBtn.classList.replace('btn-primary', 'btn-danger');
             
-            updatePitch();
-            
         } catch (err) {
             alert("Error mengakses mikrofon: " + err);
         }
@@ -3110,7 +6072,8 @@ VOCAL_DETECTOR_HTML = """
 
     function stopMic() {
         isDetecting = false;
-        cancelAnimationFrame(animationId);
+        clearInterval(fallbackTimer);
+        if (pitchNode) pitchNode.port.onmessage = null;
         if (microphone) microphone.disconnect();
         if (audioCtx) audioCtx.close();
         
@@ -3137,9 +6100,300 @@ VOCAL_DETECTOR_HTML = """
 </script>
 """
 
+# Side-by-side timing of the YIN tracker and the old autocorrelation (/vocal-detector/benchmark)
+PITCH_BENCHMARK_HTML = """
+<div class="container py-5" style="max-width: 820px;">
+    <div class="card bg-dark text-white border-secondary shadow">
+        <div class="card-body p-4">
+            <h3 class="mb-2"><i class="fas fa-stopwatch me-2"></i>Benchmark Deteksi Nada</h3>
+            <p class="text-white-50 mb-4">
+                Membandingkan autokorelasi O(N&sup2;) lama dengan pelacak YIN berbasis FFT yang dipakai
+                <a href="/vocal-detector" class="text-info">Latihan Vokal</a>, pada frame sintetis 2048 sampel @ 48 kHz.
+            </p>
+            <button id="benchBtn" class="btn btn-primary rounded-pill px-4 mb-4">
+                <i class="fas fa-play me-2"></i>Jalankan Benchmark
+            </button>
+            <div class="table-responsive">
+                <table class="table table-dark table-sm align-middle mb-0">
+                    <thead>
+                        <tr><th>Implementasi</th><th class="text-end">ms / frame</th><th class="text-end">frame / detik</th><th class="text-end">Error median (cents)</th><th class="text-end">Gagal</th></tr>
+                    </thead>
+                    <tbody id="benchRows">
+                        <tr><td colspan="5" class="text-white-50">Belum dijalankan</td></tr>
+                    </tbody>
+                </table>
+            </div>
+            <p id="benchStatus" class="small text-white-50 mt-3 mb-0"></p>
+        </div>
+    </div>
+</div>
+
+<script>
+    {% include 'pitch_tracker.js' %}
+
+    // The vocal detector's original autocorrelation, kept here only for comparison
+    function legacyAutoCorrelate(buf, sampleRate) {
+        let SIZE = buf.length;
+        let rms = 0;
+        for (let i = 0; i < SIZE; i++) rms += buf[i] * buf[i];
+        rms = Math.sqrt(rms / SIZE);
+        if (rms < 0.01) return -1;
+
+        let r1 = 0, r2 = SIZE - 1, thres = 0.2;
+        for (let i = 0; i < SIZE / 2; i++)
+            if (Math.abs(buf[i]) < thres) { r1 = i; break; }
+        for (let i = 1; i < SIZE / 2; i++)
+            if (Math.abs(buf[SIZE - i]) < thres) { r2 = SIZE - i; break; }
+
+        buf = buf.slice(r1, r2);
+        SIZE = buf.length;
+
+        let c = new Array(SIZE).fill(0);
+        for (let i = 0; i < SIZE; i++)
+            for (let j = 0; j < SIZE - i; j++)
+                c[i] = c[i] + buf[j] * buf[j + i];
+
+        let d = 0; while (c[d] > c[d + 1]) d++;
+        let maxval = -1, maxpos = -1;
+        for (let i = d; i < SIZE; i++) {
+            if (c[i] > maxval) { maxval = c[i]; maxpos = i; }
+        }
+        let T0 = maxpos;
+        let x1 = c[T0 - 1], x2 = c[T0], x3 = c[T0 + 1];
+        let a = (x1 + x3 - 2 * x2) / 2;
+        let b = (x3 - x1) / 2;
+        if (a) T0 = T0 - b / (2 * a);
+        return sampleRate / T0;
+    }
+
+    const SAMPLE_RATE = 48000;
+    const FRAME_SIZE = 2048;
+    const TEST_FREQUENCIES = [82.41, 110, 146.83, 196, 261.63, 329.63, 440, 587.33, 880];
+    const MIN_BENCH_MS = 1500;
+
+    // Voice-like test frames: a few harmonics plus a little noise
+    function makeFrames() {
+        return TEST_FREQUENCIES.map((freq) => {
+            const frame = new Float32Array(FRAME_SIZE);
+            const phase = Math.random() * 2 * Math.PI;
+            for (let i = 0; i < FRAME_SIZE; i++) {
+                const t = 2 * Math.PI * freq * i / SAMPLE_RATE + phase;
+                frame[i] = 0.5 * Math.sin(t) + 0.2 * Math.sin(2 * t) + 0.1 * Math.sin(3 * t) + 0.02 * (Math.random() - 0.5);
+            }
+            return { freq, frame };
+        });
+    }
+
+    function runImplementation(detect, frames) {
+        const errors = [];
+        let failures = 0;
+        for (const { freq, frame } of frames) {
+            const pitch = detect(frame);
+            if (pitch > 0) errors.push(Math.abs(1200 * Math.log2(pitch / freq)));
+            else failures++;
+        }
+        errors.sort((a, b) => a - b);
+        // Time whole passes over the frame set until the budget is spent
+        let calls = 0;
+        const start = performance.now();
+        let elapsed = 0;
+        do {
+            for (const { frame } of frames) detect(frame);
+            calls += frames.length;
+            elapsed = performance.now() - start;
+        } while (elapsed < MIN_BENCH_MS);
+        return {
+            msPerFrame: elapsed / calls,
+            medianCents: errors.length ? errors[Math.floor(errors.length / 2)] : NaN,
+            failures,
+        };
+    }
+
+    const benchBtn = document.getElementById('benchBtn');
+    const benchRows = document.getElementById('benchRows');
+    const benchStatus = document.getElementById('benchStatus');
+    const nextFrame = () => new Promise((resolve) => setTimeout(resolve, 0));
+
+    benchBtn.addEventListener('click', async () => {
+        benchBtn.disabled = true;
+        benchRows.innerHTML = '';
+        const frames = makeFrames();
+        const tracker = new PitchTracker(SAMPLE_RATE, FRAME_SIZE);
+        const implementations = [
+            ['Autokorelasi O(N\u00b2) (lama)', (frame) => legacyAutoCorrelate(frame, SAMPLE_RATE)],
+            ['YIN + FFT (AudioWorklet)', (frame) => tracker.detect(frame)],
+        ];
+        const results = [];
+        for (const [name, detect] of implementations) {
+            benchStatus.innerText = `Mengukur ${name}...`;
+            await nextFrame();
+            const result = runImplementation(detect, frames);
+            results.push(result);
+            const row = benchRows.insertRow();
+            row.insertCell().innerText = name;
+            [result.msPerFrame.toFixed(3), Math.round(1000 / result.msPerFrame).toLocaleString(),
+             result.medianCents.toFixed(1), `${result.failures}/${frames.length}`].forEach((text) => {
+                const cell = row.insertCell();
+                cell.className = 'text-end';
+                cell.innerText = text;
+            });
+        }
+        const speedup = results[0].msPerFrame / results[1].msPerFrame;
+        // The worklet analyses inside a single render quantum, so that is the budget to stay under
+        benchStatus.innerText = `YIN ${speedup.toFixed(1)}x lebih cepat. Satu render quantum AudioWorklet = ${(128 / SAMPLE_RATE * 1000).toFixed(2)} ms.`;
+        benchBtn.disabled = false;
+    });
+</script>
+"""
+
+# Recording outbox shared by the recording studio page and the service worker
+# (both {% include %} it): takes are kept in IndexedDB until the server confirms
+# them. They are sent through the resumable /api/uploads protocol, so a retry
+# continues from the last stored chunk, and the finalize step always carries the
+# same Idempotency-Key, so a retry after a lost response never adds a second row.
+OUTBOX_JS = """
+const OUTBOX_DB = 'bimbel-outbox';
+const OUTBOX_STORE = 'uploads';
+const OUTBOX_SYNC_TAG = 'bimbel-outbox';
+
+function outboxTx(mode, fn) {
+    return new Promise((resolve, reject) => {
+        const open = indexedDB.open(OUTBOX_DB, 1);
+        open.onupgradeneeded = () => open.result.createObjectStore(OUTBOX_STORE, { keyPath: 'key' });
+        open.onerror = () => reject(open.error);
+        open.onsuccess = () => {
+            const db = open.result;
+            const tx = db.transaction(OUTBOX_STORE, mode);
+            const req = fn(tx.objectStore(OUTBOX_STORE));
+            tx.oncomplete = () => { db.close(); resolve(req.result); };
+            tx.onerror = tx.onabort = () => { db.close(); reject(tx.error); };
+        };
+    });
+}
+const outboxPut = entry => outboxTx('readwrite', store => store.put(entry));
+const outboxDelete = key => outboxTx('readwrite', store => store.delete(key));
+const outboxAll = () => outboxTx('readonly', store => store.getAll());
+
+function newIdempotencyKey() {
+    if (self.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+}
+
+class OutboxRefused extends Error {}
+
+async function outboxCheck(res) {
+    if (res.ok) return res;
+    if (res.status >= 400 && res.status < 500 && ![404, 408, 409, 422, 429].includes(res.status)) {
+        throw new OutboxRefused('HTTP ' + res.status);
+    }
+    return res;
+}
+
+function outboxLength(entry) {
+    return (entry.baseOffset || 0) + entry.blob.size;
+}
+
+async function outboxOffset(entry) {
+    if (entry.uploadUrl) {
+        const res = await outboxCheck(await fetch(entry.uploadUrl, { method: 'HEAD', cache: 'no-store' }));
+        if (res.ok) return Number(res.headers.get('Upload-Offset'));
+        if (res.status !== 404) throw new Error('HTTP ' + res.status);
+        // The streamed head of this take expired on the server and only the tail is here
+        if (entry.baseOffset) throw new OutboxRefused('upload expired');
+    }
+    // New (or expired on the server): start a resumable upload
+    const res = await outboxCheck(await fetch('/api/uploads', {
+        method: 'POST', headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ target: entry.target, filename: entry.filename, length: outboxLength(entry) }),
+    }));
+    if (!res.ok) throw new Error('HTTP ' + res.status);
+    entry.uploadUrl = res.headers.get('Location');
+    entry.chunkSize = (await res.json()).chunk_size;
+    await outboxPut(entry);
+    return 0;
+}
+
+// Sends one take through /api/uploads in chunks, resuming where the server stopped.
+// entry.blob holds the bytes from entry.baseOffset on (non-zero for streamed takes).
+// Resolves true when stored (or already stored) and false when the server refused
+// the upload for good; rejects when it is worth retrying later.
+async function outboxSend(entry, onProgress) {
+    try {
+        const base = entry.baseOffset || 0;
+        const length = outboxLength(entry);
+        let offset = await outboxOffset(entry);
+        let conflicts = 0;
+        // At least one PATCH, even an empty one, so a deferred length gets declared
+        do {
+            if (onProgress) onProgress(entry, offset / length);
+            const res = await outboxCheck(await fetch(entry.uploadUrl, {
+                method: 'PATCH',
+                headers: {
+                    'Upload-Offset': String(offset), 'Upload-Length': String(length),
+                    'Content-Type': 'application/offset+octet-stream',
+                },
+                body: entry.blob.slice(offset - base, offset - base + (entry.chunkSize || 4194304)),
+            }));
+            if (res.status === 409 || res.status === 404) {
+                if (++conflicts > 3) throw new Error('HTTP ' + res.status);
+                offset = await outboxOffset(entry);
+            } else if (res.ok) {
+                offset = Number(res.headers.get('Upload-Offset'));
+                conflicts = 0;
+            } else {
+                throw new Error('HTTP ' + res.status);
+            }
+        } while (offset < length);
+        if (onProgress) onProgress(entry, 1);
+        const form = new FormData();
+        Object.entries(entry.fields).forEach(([name, value]) => form.append(name, value));
+        if (entry.sha256) form.append('sha256', entry.sha256);
+        const res = await outboxCheck(await fetch(entry.uploadUrl + '/finalize', {
+            method: 'POST', body: form, headers: { 'Idempotency-Key': entry.key },
+        }));
+        // 410 (the server gave up on this upload) is refused by outboxCheck
+        if (!res.ok) throw new Error('HTTP ' + res.status);  // 422: checksum failed, resend from 0
+        return true;
+    } catch (err) {
+        if (err instanceof OutboxRefused) return false;
+        throw err;
+    }
+}
+
+async function sha256Hex(blob) {
+    if (!(self.crypto && crypto.subtle)) return null;  // insecure context: length check only
+    const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+// Sends every queued take once; concurrent callers share the same run.
+// Resolves with the keys the server refused, rejects if anything must be retried.
+let outboxRun = null;
+function outboxFlush(onProgress) {
+    if (!outboxRun) {
+        outboxRun = (async () => {
+            const refused = [];
+            let retry = null;
+            for (const entry of await outboxAll()) {
+                try {
+                    if (!await outboxSend(entry, onProgress)) refused.push(entry.key);
+                    await outboxDelete(entry.key);
+                } catch (err) {
+                    retry = err;
+                }
+            }
+            if (retry) throw retry;
+            return refused;
+        })().finally(() => { outboxRun = null; });
+    }
+    return outboxRun;
+}
+"""
+
 @app.route('/recording-studio')
+@cached_page
 def recording_studio():
-    return render_layout(RECORDING_STUDIO_HTML)
+    return render_layout('recording_studio.html')
 
 RECORDING_STUDIO_HTML = """
 <style>
@@ -3282,6 +6536,60 @@ RECORDING_STUDIO_HTML = """
     let stream;
     let recordedBlob;
 
+    // Streaming mode: MediaRecorder hands over a chunk every STREAM_TIMESLICE_MS and
+    // each one is appended to a deferred-length resumable upload while recording
+    // goes on. Only chunks the server has not acknowledged stay in memory, and
+    // saving just declares the length and finalizes. If the stream breaks, the
+    // unsent tail goes through the outbox like any buffered take.
+    const STREAM_TIMESLICE_MS = 3000;
+    const STREAM_RETRIES = 3;
+    let streamUpload = null;
+
+    function startStreamUpload() {
+        const upload = { url: null, offset: 0, pending: [], pumping: null, broken: false };
+        upload.ready = fetch('/api/uploads', {
+            method: 'POST', headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ target: 'gallery', filename: 'studio_recording.webm', defer_length: true }),
+        }).then(res => {
+            if (!res.ok) throw new Error('HTTP ' + res.status);
+            upload.url = res.headers.get('Location');
+        }).catch(err => {
+            console.warn('Streaming upload tidak tersedia, rekaman disimpan di perangkat:', err);
+            upload.broken = true;
+        });
+        return upload;
+    }
+
+    function pumpStreamUpload(upload) {
+        if (!upload.pumping) {
+            upload.pumping = (async () => {
+                await upload.ready;
+                let failures = 0;
+                while (!upload.broken && upload.pending.length) {
+                    const chunk = upload.pending[0];
+                    try {
+                        const res = await fetch(upload.url, {
+                            method: 'PATCH', body: chunk,
+                            headers: { 'Upload-Offset': String(upload.offset), 'Content-Type': 'application/offset+octet-stream' },
+                        });
+                        if (!res.ok) throw new Error('HTTP ' + res.status);
+                        upload.offset = Number(res.headers.get('Upload-Offset'));
+                        upload.pending.shift();
+                        failures = 0;
+                    } catch (err) {
+                        if (++failures >= STREAM_RETRIES) {
+                            console.warn('Streaming upload terputus:', err);
+                            upload.broken = true;
+                        } else {
+                            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+                        }
+                    }
+                }
+            })().finally(() => { upload.pumping = null; });
+        }
+        return upload.pumping;
+    }
+
     async function initCamera() {
         try {
             stream = await navigator.mediaDevices.getUserMedia({ video: true, audio: true });
@@ -3301,6 +6609,7 @@ RECORDING_STUDIO_HTML = """
 
     function startRecording() {
         recordedChunks = [];
+        streamUpload = navigator.onLine === false ? null : startStreamUpload();
         try {
             // Attempt to use webm, fallback to mp4
             let options = { mimeType: 'video/webm;codecs=vp9,opus' };
@@ -3315,14 +6624,17 @@ RECORDING_STUDIO_HTML = """
         mediaRecorder.ondataavailable = handleDataAvailable;
         mediaRecorder.onstop = handleStop;
         
-        mediaRecorder.start();
+        mediaRecorder.start(STREAM_TIMESLICE_MS);
         recordBtn.classList.add('recording');
         statusIndicator.classList.add('recording');
         statusText.innerText = "REC";
     }
 
     function handleDataAvailable(event) {
-        if (event.data.size > 0) {
+        if (event.data.size > 0 && streamUpload) {
+            streamUpload.pending.push(event.data);
+            pumpStreamUpload(streamUpload);
+        } else if (event.data.size > 0) {
             recordedChunks.push(event.data);
         }
     }
@@ -3334,11 +6646,19 @@ RECORDING_STUDIO_HTML = """
         statusText.innerText = "Ready";
     }
 
-    function handleStop() {
-        recordedBlob = new Blob(recordedChunks, { type: 'video/webm' });
-        const videoURL = URL.createObjectURL(recordedBlob);
-        
-        playbackVideo.src = videoURL;
+    async function handleStop() {
+        if (streamUpload) {
+            statusText.innerText = "Menyimpan...";
+            await pumpStreamUpload(streamUpload);
+            statusText.innerText = "Ready";
+            // Whatever the server has not acknowledged is kept locally as the tail
+            recordedBlob = new Blob(streamUpload.pending, { type: 'video/webm' });
+            playbackVideo.src = streamUpload.url && streamUpload.offset > 0 && !recordedBlob.size
+                ? streamUpload.url : URL.createObjectURL(recordedBlob);
+        } else {
+            recordedBlob = new Blob(recordedChunks, { type: 'video/webm' });
+            playbackVideo.src = URL.createObjectURL(recordedBlob);
+        }
         
         // UI Transition
         cameraSection.style.display = 'none';
@@ -3346,6 +6666,10 @@ RECORDING_STUDIO_HTML = """
     }
 
     function retakeVideo() {
+        if (streamUpload && streamUpload.url) {
+            fetch(streamUpload.url, { method: 'DELETE' }).catch(() => {});
+        }
+        streamUpload = null;
         playbackVideo.pause();
         playbackVideo.removeAttribute('src');
         playbackVideo.load();
@@ -3354,46 +6678,81 @@ RECORDING_STUDIO_HTML = """
         cameraSection.style.display = 'block';
     }
 
-    function uploadToGallery() {
-        if (!recordedBlob) return;
+    {% include 'outbox.js' %}
+
+    function resetUploadButton() {
+        uploadBtn.disabled = false;
+        uploadBtn.innerHTML = '<i class="fas fa-cloud-upload-alt me-2"></i> Simpan ke Galeri';
+    }
+
+    // Background Sync retries from the service worker even after this tab is closed;
+    // without it (Safari, Firefox) the page retries when the connection comes back
+    async function scheduleOutboxRetry() {
+        const registration = 'serviceWorker' in navigator ? await navigator.serviceWorker.getRegistration() : null;
+        if (registration && 'sync' in registration) {
+            try {
+                await registration.sync.register(OUTBOX_SYNC_TAG);
+                return;
+            } catch (err) {
+                console.warn('Background Sync tidak tersedia:', err);
+            }
+        }
+        window.addEventListener('online', () => outboxFlush().catch(scheduleOutboxRetry), { once: true });
+    }
+
+    async function uploadToGallery() {
+        if (!recordedBlob || (!recordedBlob.size && !(streamUpload && streamUpload.offset))) return;
         
         uploadBtn.disabled = true;
         uploadBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i> Mengunggah...';
         
-        // Construct FormData to match /gallery POST requirements
-        const formData = new FormData();
-        // Fallback filename. The allowed extensions in Python includes webm/mp4
-        const file = new File([recordedBlob], "studio_recording.webm", { type: "video/webm" });
-        formData.append('image', file); // Field name is 'image' in python code
-        formData.append('student_name', "Siswa (Studio Mode)");
-        
-        let now = new Date();
-        formData.append('title', "Latihan Rekaman " + now.toLocaleTimeString());
-
-        fetch('/gallery', {
-            method: 'POST',
-            body: formData
-        })
-        .then(response => {
-            if (response.ok) {
+        // Matches the /gallery POST form; the allowed extensions include webm/mp4
+        const now = new Date();
+        const entry = {
+            key: newIdempotencyKey(),
+            target: 'gallery',
+            filename: 'studio_recording.webm',
+            blob: recordedBlob,
+            // A streamed take already has its head on the server: only the tail is local
+            uploadUrl: streamUpload && streamUpload.offset ? streamUpload.url : undefined,
+            baseOffset: streamUpload && streamUpload.offset ? streamUpload.offset : 0,
+            sha256: streamUpload && streamUpload.offset ? null : await sha256Hex(recordedBlob).catch(() => null),
+            fields: { student_name: "Siswa (Studio Mode)", title: "Latihan Rekaman " + now.toLocaleTimeString() },
+            createdAt: now.getTime(),
+        };
+        const showProgress = (sending, fraction) => {
+            if (sending.key === entry.key) {
+                uploadBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i> Mengunggah... ' + Math.round(fraction * 100) + '%';
+            }
+        };
+        // Persist the take first so a dropped connection cannot lose it
+        const queued = await outboxPut(entry).then(() => true, err => { console.warn('Outbox tidak tersedia:', err); return false; });
+        try {
+            const accepted = queued ? !(await outboxFlush(showProgress)).includes(entry.key) : await outboxSend(entry, showProgress);
+            if (accepted) {
                 alert("Berhasil disimpan ke Galeri Karya!");
                 window.location.href = '/gallery';
             } else {
                 alert("Gagal menyimpan video.");
-                uploadBtn.disabled = false;
-                uploadBtn.innerHTML = '<i class="fas fa-cloud-upload-alt me-2"></i> Simpan ke Galeri';
+                resetUploadButton();
             }
-        })
-        .catch(err => {
+        } catch (err) {
             console.error(err);
-            alert("Terjadi kesalahan jaringan.");
-            uploadBtn.disabled = false;
-            uploadBtn.innerHTML = '<i class="fas fa-cloud-upload-alt me-2"></i> Simpan ke Galeri';
-        });
+            if (queued) {
+                await scheduleOutboxRetry();
+                alert("Koneksi terputus. Video tersimpan di perangkat dan akan diunggah otomatis saat koneksi kembali.");
+                uploadBtn.innerHTML = '<i class="fas fa-clock me-2"></i> Menunggu koneksi...';
+            } else {
+                alert("Terjadi kesalahan jaringan.");
+                resetUploadButton();
+            }
+        }
     }
 
     // Initialize camera on load
     window.addEventListener('load', initCamera);
+    // Send takes left over from an earlier visit
+    window.addEventListener('load', () => outboxFlush().catch(scheduleOutboxRetry));
     
     // Stop stream when leaving
     window.addEventListener('beforeunload', () => {
@@ -3405,8 +6764,9 @@ RECORDING_STUDIO_HTML = """
 """
 
 @app.route('/scrolling-sheet')
+@cached_page
 def scrolling_sheet():
-    return render_layout(SCROLLING_SHEET_HTML)
+    return render_layout('scrolling_sheet.html')
 
 SCROLLING_SHEET_HTML = """
 <style>
@@ -3480,12 +6840,15 @@ SCROLLING_SHEET_HTML = """
             <button id="playSheetBtn" class="btn btn-primary rounded-pill px-4 fw-bold">
                 <i class="fas fa-play me-2"></i> MULAI
             </button>
+            <button id="fpsToggle" class="btn btn-sm btn-outline-light rounded-pill" title="Tampilkan FPS">FPS</button>
         </div>
         <p class="text-white-50 small mt-3 mb-0">Baca dan mainkan not yang melewati garis target hijau!</p>
     </div>
 </div>
 
 <script>
+    {% include 'canvas_sprites.js' %}
+
     const canvas = document.getElementById('sheetCanvas');
     const ctx = canvas.getContext('2d');
     const wrapper = document.getElementById('canvasWrapper');
@@ -3493,18 +6856,19 @@ SCROLLING_SHEET_HTML = """
     const tempoVal = document.getElementById('tempoVal');
     const playBtn = document.getElementById('playSheetBtn');
     
+    let staffSprite = null;
     function resizeCanvas() {
         canvas.width = wrapper.clientWidth;
         canvas.height = wrapper.clientHeight;
+        staffSprite = renderStaff(canvas.width, canvas.height);
         drawStaffLines(); // Redraw static background immediately
     }
     window.addEventListener('resize', resizeCanvas);
     
     let isPlaying = false;
     let animationId;
-    let notes = [];
     let bpm = 80;
-    let speed = 2; // pixels per frame
+    let speed = bpm * 2; // pixels per second
     let nextSpawnTime = 0;
     let msPerBeat = 60000 / bpm;
     
@@ -3530,103 +6894,120 @@ SCROLLING_SHEET_HTML = """
     };
     
     const noteKeys = Object.keys(notePositions);
+    
+    // Enough for a full screen of notes at the fastest tempo
+    const notes = new ObjectPool(64, () => ({ x: 0, y: 0, name: '' }));
+    const frameClock = new FrameClock(wrapper);
+
+    function renderStaff(width, height) {
+        return prerenderSprite(width, height, (g) => {
+            g.strokeStyle = "rgba(255, 255, 255, 0.4)";
+            g.lineWidth = 1;
+            g.shadowBlur = 5;
+            g.shadowColor = "rgba(255, 255, 255, 0.5)";
+            
+            g.beginPath();
+            for (let i = 0; i < staffLines; i++) {
+                let y = staffTopY + (i * lineSpacing);
+                g.moveTo(0, y);
+                g.lineTo(width, y);
+            }
+            g.stroke();
+        });
+    }
 
     function drawStaffLines() {
-        ctx.strokeStyle = "rgba(255, 255, 255, 0.4)";
-        ctx.lineWidth = 1;
-        ctx.shadowBlur = 5;
-        ctx.shadowColor = "rgba(255, 255, 255, 0.5)";
-        
-        ctx.beginPath();
-        for (let i = 0; i < staffLines; i++) {
-            let y = staffTopY + (i * lineSpacing);
-            ctx.moveTo(0, y);
-            ctx.lineTo(canvas.width, y);
-        }
-        ctx.stroke();
-        ctx.shadowBlur = 0;
+        ctx.drawImage(staffSprite, 0, 0);
     }
 
-    function spawnNote() {
-        const randomKey = noteKeys[Math.floor(Math.random() * noteKeys.length)];
-        const yPos = notePositions[randomKey];
-        
-        notes.push({
-            x: canvas.width + 20,
-            y: yPos,
-            name: randomKey,
-            hasLedger: (randomKey === 'C4')
+    // Every note (head glow, stem, ledger line, label) is prerendered once around (NOTE_X, NOTE_Y)
+    const NOTE_X = 30, NOTE_Y = 60;
+    const noteSprites = {};
+    noteKeys.forEach((name) => {
+        const y = notePositions[name];
+        noteSprites[name] = prerenderSprite(2 * NOTE_X, 2 * NOTE_Y, (g) => {
+            const x = NOTE_X, cy = NOTE_Y;
+            // Draw Ledger Line if needed (Middle C)
+            if (name === 'C4') {
+                g.strokeStyle = "white";
+                g.lineWidth = 2;
+                g.beginPath();
+                g.moveTo(x - 12, cy);
+                g.lineTo(x + 12, cy);
+                g.stroke();
+            }
+            
+            // Draw Note Head (Ellipse)
+            g.fillStyle = "#ffffff";
+            g.shadowBlur = 15;
+            g.shadowColor = "#ffffff";
+            g.beginPath();
+            g.ellipse(x, cy, 8, 6, -Math.PI/4, 0, 2 * Math.PI);
+            g.fill();
+            
+            // Draw Stem
+            g.shadowBlur = 0;
+            g.strokeStyle = "#ffffff";
+            g.lineWidth = 2;
+            g.beginPath();
+            if (y > staffTopY + (lineSpacing * 2)) {
+                // Stem goes up (right side)
+                g.moveTo(x + 7, cy - 2);
+                g.lineTo(x + 7, cy - 35);
+            } else {
+                // Stem goes down (left side)
+                g.moveTo(x - 7, cy + 2);
+                g.lineTo(x - 7, cy + 35);
+            }
+            g.stroke();
+            
+            // Text label
+            g.fillStyle = "rgba(255,255,255,0.7)";
+            g.font = "10px Inter";
+            g.fillText(name, x - 6, cy + 20);
         });
-        
-        nextSpawnTime = performance.now() + msPerBeat;
+    });
+
+    function spawnNote(now) {
+        const note = notes.acquire();
+        if (note) {
+            note.name = noteKeys[Math.floor(Math.random() * noteKeys.length)];
+            note.x = canvas.width + 20;
+            note.y = notePositions[note.name];
+        }
+        nextSpawnTime = now + msPerBeat;
     }
 
     function drawNote(note) {
-        // Draw Ledger Line if needed (Middle C)
-        if (note.hasLedger) {
-            ctx.strokeStyle = "white";
-            ctx.lineWidth = 2;
-            ctx.beginPath();
-            ctx.moveTo(note.x - 12, note.y);
-            ctx.lineTo(note.x + 12, note.y);
-            ctx.stroke();
-        }
-        
-        // Draw Note Head (Ellipse)
-        ctx.fillStyle = "#ffffff";
-        ctx.shadowBlur = 15;
-        ctx.shadowColor = "#ffffff";
-        
-        ctx.beginPath();
-        ctx.ellipse(note.x, note.y, 8, 6, -Math.PI/4, 0, 2 * Math.PI);
-        ctx.fill();
-        
-        // Draw Stem
-        ctx.shadowBlur = 0;
-        ctx.strokeStyle = "#ffffff";
-        ctx.lineWidth = 2;
-        ctx.beginPath();
-        if (note.y > staffTopY + (lineSpacing * 2)) {
-            // Stem goes up (right side)
-            ctx.moveTo(note.x + 7, note.y - 2);
-            ctx.lineTo(note.x + 7, note.y - 35);
-        } else {
-            // Stem goes down (left side)
-            ctx.moveTo(note.x - 7, note.y + 2);
-            ctx.lineTo(note.x - 7, note.y + 35);
-        }
-        ctx.stroke();
-        
-        // Text label
-        ctx.fillStyle = "rgba(255,255,255,0.7)";
-        ctx.font = "10px Inter";
-        ctx.fillText(note.name, note.x - 6, note.y + 20);
+        ctx.drawImage(noteSprites[note.name], note.x - NOTE_X, note.y - NOTE_Y);
     }
 
     function animate(timestamp) {
         if (!isPlaying) return;
+        const dt = frameClock.begin(timestamp);
         
         ctx.clearRect(0, 0, canvas.width, canvas.height);
         
         drawStaffLines();
         
         if (timestamp >= nextSpawnTime) {
-            spawnNote();
+            spawnNote(timestamp);
         }
         
         // Update and draw notes
-        for (let i = notes.length - 1; i >= 0; i--) {
-            let note = notes[i];
-            note.x -= speed;
-            
-            drawNote(note);
+        for (let i = notes.count - 1; i >= 0; i--) {
+            const note = notes.items[i];
+            note.x -= speed * dt;
             
             // Remove if offscreen
             if (note.x < -30) {
-                notes.splice(i, 1);
+                notes.release(i);
+            } else {
+                drawNote(note);
             }
         }
         
+        frameClock.end();
         animationId = requestAnimationFrame(animate);
     }
 
@@ -3638,7 +7019,8 @@ SCROLLING_SHEET_HTML = """
             playBtn.classList.replace('btn-danger', 'btn-primary');
         } else {
             isPlaying = true;
-            notes = [];
+            notes.clear();
+            frameClock.reset();
             nextSpawnTime = performance.now();
             playBtn.innerHTML = '<i class="fas fa-stop me-2"></i> BERHENTI';
             playBtn.classList.replace('btn-primary', 'btn-danger');
@@ -3650,21 +7032,22 @@ SCROLLING_SHEET_HTML = """
         bpm = parseInt(e.target.value);
         tempoVal.innerText = bpm + " BPM";
         msPerBeat = 60000 / bpm;
-        // Adjust speed pixel calculation roughly based on BPM
-        speed = (bpm / 60) * 2; 
+        // Scroll speed follows the tempo
+        speed = bpm * 2;
     });
 
     playBtn.addEventListener('click', togglePlay);
+    document.getElementById('fpsToggle').addEventListener('click', () => frameClock.toggleOverlay());
     
     // Initial setup
     resizeCanvas();
-    drawStaffLines();
 </script>
 """
 
 @app.route('/jamming-track')
+@cached_page
 def jamming_track():
-    return render_layout(JAMMING_TRACK_HTML)
+    return render_layout('jamming_track.html', jam_tracks=app.config['JAM_TRACKS'])
 
 JAMMING_TRACK_HTML = """
 <style>
@@ -3730,9 +7113,12 @@ JAMMING_TRACK_HTML = """
     }
     .eq-bar {
         width: 8px;
+        height: 40px;
         background: #00ffcc;
         border-radius: 4px 4px 0 0;
-        transition: height 0.1s ease;
+        transform: scaleY(0.25);
+        transform-origin: bottom;
+        will-change: transform;
     }
     
     .custom-select-wrapper {
@@ -3777,13 +7163,13 @@ JAMMING_TRACK_HTML = """
         <div class="vinyl-record" id="vinyl"></div>
         
         <div class="eq-bars" id="eqBars">
-            <div class="eq-bar" style="height: 10px;"></div>
-            <div class="eq-bar" style="height: 10px;"></div>
-            <div class="eq-bar" style="height: 10px;"></div>
-            <div class="eq-bar" style="height: 10px;"></div>
-            <div class="eq-bar" style="height: 10px;"></div>
-            <div class="eq-bar" style="height: 10px;"></div>
-            <div class="eq-bar" style="height: 10px;"></div>
+            <div class="eq-bar"></div>
+            <div class="eq-bar"></div>
+            <div class="eq-bar"></div>
+            <div class="eq-bar"></div>
+            <div class="eq-bar"></div>
+            <div class="eq-bar"></div>
+            <div class="eq-bar"></div>
         </div>
         
         <div class="row g-3">
@@ -3809,6 +7195,12 @@ JAMMING_TRACK_HTML = """
             </div>
         </div>
         
+        <div class="d-flex align-items-center gap-3">
+            <span class="text-white-50 small fw-bold">TEMPO</span>
+            <input type="range" class="form-range" id="tempoSlider" min="50" max="200" value="100">
+            <span class="text-white fw-bold text-nowrap" id="tempoVal">100 BPM</span>
+        </div>
+        
         <div class="d-flex align-items-center justify-content-center gap-3 mt-4">
             <button class="btn btn-outline-light rounded-circle" style="width: 50px; height: 50px;">
                 <i class="fas fa-backward"></i>
@@ -3829,94 +7221,252 @@ JAMMING_TRACK_HTML = """
     </div>
 </div>
 
-<!-- Hidden audio element -->
-<audio id="jamAudio" loop preload="none"></audio>
-
 <script>
-    const audioEl = document.getElementById('jamAudio');
     const playBtn = document.getElementById('playBtn');
     const vinyl = document.getElementById('vinyl');
     const genreSelect = document.getElementById('genreSelect');
+    const keySelect = document.getElementById('keySelect');
+    const tempoSlider = document.getElementById('tempoSlider');
+    const tempoVal = document.getElementById('tempoVal');
     const volumeSlider = document.getElementById('volumeSlider');
     const eqBars = document.querySelectorAll('.eq-bar');
+    // Key and tempo each track was recorded in (JAM_TRACKS)
+    const JAM_TRACKS = {{ jam_tracks|tojson }};
+    
+    // Decoded PCM is large (~10 MB per stereo minute), so the cache is bounded by bytes
+    const TRACK_CACHE_BYTES = 160 * 1024 * 1024;
+    // Bars cover log-spaced bands between these frequencies
+    const EQ_MIN_HZ = 60, EQ_MAX_HZ = 12000;
+    const EQ_REST = 0.25;  // bar scale while silent (10px of 40px)
     
     let isPlaying = false;
-    let eqInterval;
+    let audioCtx, volumeGain, analyser, bins, bandEdges;
+    let source = null;
+    let currentUrl = null;
+    let startedAt = 0;  // context time at which offset 0 of the track would have played
+    let pausedAt = 0;   // track offset to resume from
+    let eqFrame = 0;
+    const barLevels = new Float32Array(eqBars.length).fill(EQ_REST);
+
+    // Least recently used decoded tracks: url -> Promise<AudioBuffer>
+    class TrackCache {
+        constructor(maxBytes) {
+            this.maxBytes = maxBytes;
+            this.entries = new Map();
+            this.sizes = new Map();
+        }
 
-    function setAudioSource() {
-        // Construct URL based on selection
-        const genreFile = genreSelect.value;
-        audioEl.src = '/static/audio/' + genreFile;
+        get(url) {
+            let entry = this.entries.get(url);
+            if (entry) {
+                this.entries.delete(url);  // re-insert as most recently used
+            } else {
+                entry = fetchTrack(url)
+                    .then((data) => audioCtx.decodeAudioData(data))
+                    .then((buffer) => {
+                        this.sizes.set(url, buffer.length * buffer.numberOfChannels * 4);
+                        this.evict();
+                        return buffer;
+                    })
+                    .catch((err) => {
+                        this.entries.delete(url);
+                        throw err;
+                    });
+            }
+            this.entries.set(url, entry);
+            return entry;
+        }
+
+        evict() {
+            let total = 0;
+            this.sizes.forEach((size) => { total += size; });
+            for (const url of this.entries.keys()) {
+                if (total <= this.maxBytes) break;
+                if (url === currentUrl || !this.sizes.has(url)) continue;
+                total -= this.sizes.get(url);
+                this.sizes.delete(url);
+                this.entries.delete(url);
+            }
+        }
+    }
+    const trackCache = new TrackCache(TRACK_CACHE_BYTES);
+
+    // The plain file in its recorded key and tempo, otherwise a variant rendered by the server
+    function trackUrl(genre = genreSelect.value, key = keySelect.value, bpm = parseInt(tempoSlider.value)) {
+        const url = '/static/audio/' + genre;
+        const track = JAM_TRACKS[genre];
+        if (!track || (key === track.key && bpm === track.bpm)) return url;
+        return `${url}?key=${encodeURIComponent(key)}&bpm=${bpm}`;
+    }
+
+    async function fetchTrack(url) {
+        // 202 means the server is still rendering that key/tempo; ask again when told to
+        for (let attempt = 0; attempt < 40; attempt++) {
+            const response = await fetch(url);
+            if (response.status !== 202) {
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return response.arrayBuffer();
+            }
+            const wait = parseFloat(response.headers.get('Retry-After')) || 3;
+            await new Promise((resolve) => setTimeout(resolve, wait * 1000));
+        }
+        throw new Error('variant still rendering');
+    }
+
+    function setTempoRange(genre) {
+        const track = JAM_TRACKS[genre] || { bpm: 100 };
+        tempoSlider.min = Math.ceil(track.bpm / 2);
+        tempoSlider.max = track.bpm * 2;
+        tempoSlider.value = track.bpm;
+        tempoVal.innerText = track.bpm + ' BPM';
+        tempoSlider.disabled = !JAM_TRACKS[genre];
+        keySelect.disabled = !JAM_TRACKS[genre];
     }
+    setTempoRange(genreSelect.value);
 
-    function animateEQ() {
-        eqBars.forEach(bar => {
-            const h = 5 + Math.random() * 35;
-            bar.style.height = h + 'px';
+    function initAudio() {
+        if (audioCtx) return;
+        audioCtx = new (window.AudioContext || window.webkitAudioContext)();
+        volumeGain = audioCtx.createGain();
+        volumeGain.gain.value = volumeSlider.value;
+        analyser = audioCtx.createAnalyser();
+        analyser.fftSize = 2048;
+        analyser.smoothingTimeConstant = 0.75;
+        volumeGain.connect(analyser);
+        analyser.connect(audioCtx.destination);
+        bins = new Uint8Array(analyser.frequencyBinCount);
+        // First FFT bin of each bar's band, plus the end of the last one
+        const hzPerBin = audioCtx.sampleRate / analyser.fftSize;
+        bandEdges = Array.from({ length: eqBars.length + 1 }, (_, i) => {
+            const hz = EQ_MIN_HZ * Math.pow(EQ_MAX_HZ / EQ_MIN_HZ, i / eqBars.length);
+            return Math.min(bins.length, Math.max(i, Math.round(hz / hzPerBin)));
         });
     }
 
-    function stopEQ() {
-        eqBars.forEach(bar => {
-            bar.style.height = '10px';
+    // The only loop touching the bars: transforms only, and only when a bar changes
+    function drawEQ() {
+        if (isPlaying) analyser.getByteFrequencyData(bins);
+        let moving = isPlaying;
+        eqBars.forEach((bar, i) => {
+            let target = EQ_REST;
+            if (isPlaying) {
+                let peak = 0;
+                for (let b = bandEdges[i]; b < Math.max(bandEdges[i + 1], bandEdges[i] + 1); b++) {
+                    peak = Math.max(peak, bins[b]);
+                }
+                target = 0.1 + 0.9 * peak / 255;
+            }
+            // Ease back to rest after pausing instead of snapping
+            const level = isPlaying ? target : barLevels[i] + (target - barLevels[i]) * 0.2;
+            if (Math.abs(level - barLevels[i]) > 0.005) {
+                barLevels[i] = level;
+                bar.style.transform = `scaleY(${level.toFixed(3)})`;
+                moving = true;
+            }
         });
+        eqFrame = moving ? requestAnimationFrame(drawEQ) : 0;
     }
 
-    function toggleAudio() {
-        if (!audioEl.src || audioEl.src === window.location.href) {
-            setAudioSource();
+    function startEQ() {
+        if (!eqFrame) eqFrame = requestAnimationFrame(drawEQ);
+    }
+
+    function stopSource() {
+        if (source) {
+            source.onended = null;
+            source.stop();
+            source.disconnect();
+            source = null;
+        }
+    }
+
+    async function startTrack(offset) {
+        const url = trackUrl();
+        currentUrl = url;
+        let buffer;
+        try {
+            buffer = await trackCache.get(url);
+        } catch (error) {
+            // Because files might not exist actually, keep the player UI without sound
+            console.log("Audio playback failed (dummy file likely empty). Simulating playback.");
+            return;
         }
+        // Paused or switched again while the track was loading
+        if (!isPlaying || currentUrl !== url) return;
+        stopSource();
+        source = audioCtx.createBufferSource();
+        source.buffer = buffer;
+        source.loop = true;
+        source.connect(volumeGain);
+        offset = offset % buffer.duration;
+        source.start(0, offset);
+        startedAt = audioCtx.currentTime - offset;
+        // Warm the other genres (in this key, at their own tempo) so switching is instant
+        Array.from(genreSelect.options).forEach((option) => {
+            const track = JAM_TRACKS[option.value];
+            const other = trackUrl(option.value, keySelect.value, track ? track.bpm : 0);
+            if (other !== url) trackCache.get(other).catch(() => {});
+        });
+    }
+
+    function toggleAudio() {
+        initAudio();
         
         if (isPlaying) {
-            audioEl.pause();
+            if (source) pausedAt = audioCtx.currentTime - startedAt;
+            stopSource();
             isPlaying = false;
             playBtn.innerHTML = '<i class="fas fa-play" style="margin-left: 5px;"></i>';
             playBtn.classList.replace('btn-danger', 'btn-primary');
             vinyl.classList.remove('spinning');
-            clearInterval(eqInterval);
-            stopEQ();
         } else {
-            // Because files might not exist actually, we handle promise rejection to avoid console spam breaking things visually
-            let playPromise = audioEl.play();
-            if (playPromise !== undefined) {
-                playPromise.then(_ => {
-                    // Playback started!
-                }).catch(error => {
-                    console.log("Audio playback failed (dummy file likely empty). Simulating playback.");
-                });
-            }
-            
+            if (audioCtx.state === 'suspended') audioCtx.resume();
             isPlaying = true;
+            startTrack(pausedAt);
             playBtn.innerHTML = '<i class="fas fa-pause"></i>';
             playBtn.classList.replace('btn-primary', 'btn-danger');
             vinyl.classList.add('spinning');
-            eqInterval = setInterval(animateEQ, 100);
         }
+        startEQ();
     }
 
     genreSelect.addEventListener('change', () => {
-        const wasPlaying = isPlaying;
-        if (wasPlaying) {
-            toggleAudio(); // Stop current
+        // A new genre starts from the top, at its own tempo
+        pausedAt = 0;
+        setTempoRange(genreSelect.value);
+        variantBpm = parseInt(tempoSlider.value);
+        if (isPlaying) {
+            startTrack(0);
         }
-        setAudioSource();
-        if (wasPlaying) {
-            toggleAudio(); // Play new
+    });
+
+    // Same musical position in the new variant: offsets scale inversely with tempo
+    let variantBpm = parseInt(tempoSlider.value);
+    function changeVariant() {
+        const bpm = parseInt(tempoSlider.value);
+        const offset = isPlaying && source ? audioCtx.currentTime - startedAt : pausedAt;
+        pausedAt = offset * variantBpm / bpm;
+        variantBpm = bpm;
+        if (isPlaying) {
+            startTrack(pausedAt);
         }
+    }
+    keySelect.addEventListener('change', changeVariant);
+    tempoSlider.addEventListener('input', () => {
+        tempoVal.innerText = tempoSlider.value + ' BPM';
     });
+    tempoSlider.addEventListener('change', changeVariant);
 
     volumeSlider.addEventListener('input', (e) => {
-        audioEl.volume = e.target.value;
+        if (volumeGain) volumeGain.gain.setTargetAtTime(e.target.value, audioCtx.currentTime, 0.01);
     });
-    
-    // Set initial volume
-    audioEl.volume = volumeSlider.value;
 </script>
 """
 
 @app.route('/developer')
+@cached_page
 def developer():
-    return render_layout(DEVELOPER_HTML_CONTENT)
+    return render_layout('developer.html')
 
 DEVELOPER_HTML_CONTENT = """
 <div class="container d-flex flex-column justify-content-center align-items-center mb-5" style="min-height: 80vh; padding-top: 20px;">
@@ -4073,5 +7623,512 @@ DEVELOPER_HTML_CONTENT = """
 </div>
 """
 
+# --- TEMPLATE REGISTRATION ---
+TEMPLATE_SOURCES.update({
+    'service-worker.js': SW_CONTENT,
+    'outbox.js': OUTBOX_JS,
+    'layout.html': BASE_LAYOUT,
+    'navbar.html': NAVBAR_HTML,
+    'infinite_scroll.html': INFINITE_SCROLL_HTML,
+    'media.html': MEDIA_MACROS_HTML,
+    'doremi.html': HTML_DOREMI_CONTENT,
+    'gallery.html': GALLERY_HTML_CONTENT,
+    'tutors.html': TUTORS_HTML_CONTENT,
+    'pricing.html': PRICING_HTML_CONTENT,
+    'slots.html': SLOTS_HTML_CONTENT,
+    'join.html': JOIN_HTML_CONTENT,
+    'news.html': NEWS_HTML_CONTENT,
+    'metronome.html': METRONOME_HTML_CONTENT,
+    'metronome_clock.js': METRONOME_CLOCK_JS,
+    'ear_training.html': EAR_TRAINING_HTML_CONTENT,
+    'rhythm_trainer.html': RHYTHM_TRAINER_HTML,
+    'canvas_sprites.js': CANVAS_SPRITES_JS,
+    'visual_chord.html': VISUAL_CHORD_HTML,
+    'vocal_detector.html': VOCAL_DETECTOR_HTML,
+    'pitch_tracker.js': PITCH_TRACKER_JS,
+    'pitch_worklet.js': PITCH_WORKLET_JS,
+    'pitch_benchmark.html': PITCH_BENCHMARK_HTML,
+    'recording_studio.html': RECORDING_STUDIO_HTML,
+    'scrolling_sheet.html': SCROLLING_SHEET_HTML,
+    'jamming_track.html': JAMMING_TRACK_HTML,
+    'developer.html': DEVELOPER_HTML_CONTENT,
+})
+
+# The music tools compile on first use instead: most processes never serve all of
+# them, and `serve` compiles everything once in the master before forking
+LAZY_TEMPLATES = {
+    'doremi.html', 'metronome.html', 'metronome_clock.js', 'ear_training.html', 'rhythm_trainer.html',
+    'canvas_sprites.js', 'visual_chord.html', 'vocal_detector.html', 'pitch_tracker.js', 'pitch_worklet.js',
+    'pitch_benchmark.html', 'recording_studio.html', 'scrolling_sheet.html', 'jamming_track.html',
+}
+
+def precompile_templates(names=None):
+    # Compile templates up front so requests only ever render
+    for name in names or [n for n in TEMPLATE_SOURCES if n not in LAZY_TEMPLATES]:
+        app.jinja_env.get_template(name)
+
+# Changes whenever any template changes, so cached pages and ETags from an older
+# deploy are never served
+TEMPLATE_BUILD_ID = hashlib.sha256(
+    '\0'.join(f"{name}\0{src}" for name, src in sorted(TEMPLATE_SOURCES.items())).encode('utf-8') + LAYOUT_HEAD.encode('utf-8')
+).hexdigest()[:16]
+
+# --- APP FACTORY ---
+# Importing this module only defines routes, models and template sources. Whatever
+# touches the disk or the database (folders, engine, create_all, migrations, core
+# templates) happens in create_app(), once per process: called explicitly (tests,
+# `python <this file>`, `serve`), or else on the first app context, e.g. when
+# gunicorn imports `app` directly. Routes live on the module-level `app`, so
+# create_app() configures that one app rather than building a new one.
+_app_ready = False
+_app_starting = False
+_app_ready_lock = threading.RLock()
+
+def create_app(config=None):
+    """Apply `config` overrides and set up folders, database and templates; returns the app."""
+    global _app_ready, _app_starting
+    with _app_ready_lock:
+        if _app_starting:
+            return app  # re-entered from the app context pushed below
+        if _app_ready:
+            if config:
+                raise RuntimeError("create_app(config) must be called before the app is first used")
+            return app
+        _app_starting = True
+        try:
+            app.config.update(config or {})
+            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+            if 'sqlalchemy' not in app.extensions:
+                db.init_app(app)
+            with app.app_context():
+                if db.engine.dialect.name == 'sqlite':
+                    event.listen(db.engine, 'connect', _apply_sqlite_pragmas)
+                db.create_all()
+                run_migrations()
+            precompile_templates()
+        finally:
+            _app_starting = False
+        _app_ready = True
+    return app
+
+def _create_app_on_first_context(sender, **kwargs):
+    if not _app_ready:
+        create_app()
+
+appcontext_pushed.connect(_create_app_on_first_context, app)
+
+# --- CLI ---
+@app.cli.command('bench')
+@click.argument('paths', nargs=-1)
+@click.option('--requests', '-n', 'count', default=300, show_default=True, help='Requests per path.')
+def bench_command(paths, count):
+    """Measure in-process requests/sec for GET pages (default: /, /gallery, /news)."""
+    client = app.test_client()
+    for path in paths or ('/', '/gallery', '/news'):
+        client.get(path)  # warm-up
+        start = time.perf_counter()
+        for _ in range(count):
+            response = client.get(path)
+        elapsed = time.perf_counter() - start
+        click.echo(f"{path:<20} {response.status_code}  {count / elapsed:8.1f} req/s")
+
+def _bench_db_worker(role, seconds, seed, results):
+    import random
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    with app.app_context():
+        db.engine.dispose(close=False)  # never share the parent's connections after fork
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                if role == 'reader':
+                    keyset_page(rng.choice(list(LISTING_ORDER)))
+                    slots_listing().all()
+                else:
+                    db.session.add(JoinRequests(name='__bench__', age=rng.randint(4, 18), interest='Piano', whatsapp='0'))
+                    db.session.commit()
+                latencies.append(time.perf_counter() - start)
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+            finally:
+                db.session.remove()
+    results.put((role, latencies, errors))
+
+@app.cli.command('bench-db')
+@click.option('--readers', default=4, show_default=True, help='Reader processes.')
+@click.option('--writers', default=2, show_default=True, help='Writer processes.')
+@click.option('--seconds', default=5.0, show_default=True, help='Duration per process.')
+def bench_db_command(readers, writers, seconds):
+    """Run concurrent reader/writer processes against the models and report latency.
+
+    Writers insert JoinRequests rows named '__bench__', removed afterwards. Point
+    SQLALCHEMY_DATABASE_URI at a copy of the database to keep production untouched.
+    """
+    import multiprocessing
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    db.session.remove()
+    db.engine.dispose()
+    procs = [ctx.Process(target=_bench_db_worker, args=(role, seconds, i, results))
+             for i, role in enumerate(['reader'] * readers + ['writer'] * writers)]
+    for p in procs:
+        p.start()
+    collected = {'reader': ([], 0), 'writer': ([], 0)}
+    for _ in procs:
+        role, latencies, errors = results.get()
+        prev, prev_errors = collected[role]
+        collected[role] = (prev + latencies, prev_errors + errors)
+    for p in procs:
+        p.join()
+    click.echo(f"profile={app.config['SQLITE_PROFILE']} readers={readers} writers={writers} seconds={seconds}")
+    for role, (latencies, errors) in collected.items():
+        if not latencies:
+            click.echo(f"{role:<7} no successful operations, {errors} errors")
+            continue
+        latencies.sort()
+        pct = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        click.echo(f"{role:<7} ops={len(latencies):<7} ops/s={len(latencies) / seconds:9.1f} "
+                   f"p50={pct(0.50):7.2f}ms p99={pct(0.99):7.2f}ms max={latencies[-1] * 1000:7.2f}ms errors={errors}")
+    JoinRequests.query.filter_by(name='__bench__').delete()
+    db.session.commit()
+
+# Run by `bench-import` in a fresh interpreter: argv = module path, 'cold' or 'warm'
+BENCH_IMPORT_SCRIPT = """
+import importlib.util, json, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('bimbel_bench', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+if sys.argv[2] == 'cold':
+    module.app.jinja_env.bytecode_cache = None
+module.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+print(json.dumps({'import': imported - start, 'create_app': time.perf_counter() - imported}))
+"""
+
+@app.cli.command('bench-import')
+@click.option('--runs', '-n', default=5, show_default=True, help='Fresh interpreters to start.')
+@click.option('--top', default=8, show_default=True, help='Slowest top-level imports to list.')
+@click.option('--cold', is_flag=True, help='Compile templates without the bytecode cache, as on a new instance.')
+@click.option('--max-ms', type=float, default=None, help='Fail if the median import + create_app() is slower.')
+def bench_import_command(runs, top, cold, max_ms):
+    """Time importing this module and create_app() in fresh interpreters (-X importtime).
+
+    create_app() runs against an empty in-memory database, so this is safe on a live host.
+    """
+    import statistics
+    from collections import defaultdict
+    path = os.path.abspath(__file__)
+    totals, cumulative = defaultdict(list), defaultdict(list)
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', BENCH_IMPORT_SCRIPT, path,
+                                 'cold' if cold else 'warm'], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise click.ClickException(result.stderr.strip().splitlines()[-1])
+        for phase, seconds in json.loads(result.stdout.strip().splitlines()[-1]).items():
+            totals[phase].append(seconds * 1000)
+        for line in result.stderr.splitlines():
+            # "import time: <self us> | <cumulative us> | <name, indented by depth>"
+            parts = line.split('|')
+            if len(parts) == 3 and line.startswith('import time:') and not parts[2].startswith('  '):
+                try:
+                    ms = int(parts[1]) / 1000
+                except ValueError:
+                    continue  # the header line
+                cumulative[parts[2].strip()].append(ms)
+    median = {phase: statistics.median(ms) for phase, ms in totals.items()}
+    click.echo(f"import      {median['import']:8.1f} ms (median of {runs})")
+    click.echo(f"create_app  {median['create_app']:8.1f} ms ({'cold' if cold else 'warm'} template cache)")
+    click.echo("slowest top-level imports:")
+    for name, ms in sorted(cumulative.items(), key=lambda item: -statistics.median(item[1]))[:top]:
+        click.echo(f"  {statistics.median(ms):8.1f} ms  {name}")
+    if max_ms is not None and median['import'] + median['create_app'] > max_ms:
+        raise click.ClickException(f"startup took {median['import'] + median['create_app']:.1f} ms, over {max_ms} ms")
+
+@app.cli.command('gc-uploads')
+@click.option('--grace-hours', default=24.0, show_default=True, help='Keep unreferenced blobs younger than this.')
+@click.option('--dry-run', is_flag=True, help='Only report what would be removed.')
+def gc_uploads_command(grace_hours, dry_run):
+    """Recount upload references and delete unreferenced content-addressed blobs."""
+    from collections import Counter
+    refs = Counter()
+    for model, column in UPLOAD_REFERENCES:
+        for (name,) in db.session.query(getattr(model, column)).filter(getattr(model, column) != ''):
+            if is_content_addressed(name):
+                refs[name] += 1
+    settings = get_site_settings()
+    roots = {settings.get('bg_image'), settings.get('logo_file')}
+    # Resized variants share the first 64 characters (the hash) with their original
+    live_hashes = {name[:64] for name in list(refs) + [r for r in roots if is_content_addressed(r)]}
+    cutoff = time.time() - grace_hours * 3600
+    removed = 0
+    upload_root = app.config['UPLOAD_FOLDER']
+    for dirpath, dirnames, filenames in os.walk(upload_root):
+        rel = os.path.relpath(dirpath, upload_root)
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if rel == '.tmp' or rel.startswith('.tmp' + os.sep):
+                stale = os.path.getmtime(path) < cutoff  # abandoned partial upload
+            elif is_content_addressed(name):
+                stale = name[:64] not in live_hashes and os.path.getmtime(path) < cutoff
+            else:
+                stale = False
+            if stale:
+                removed += 1
+                click.echo(f"{'would remove' if dry_run else 'removing'} {path}")
+                if not dry_run:
+                    os.unlink(path)
+    if not dry_run:
+        expired = datetime.datetime.utcnow() - datetime.timedelta(hours=grace_hours)
+        ResumableUpload.query.filter(ResumableUpload.updated_at < expired).delete(synchronize_session=False)
+        for blob in UploadBlob.query.all():
+            blob.refcount = refs.get(blob.name, 0)
+            if not blob.refcount and not os.path.exists(upload_path(blob.name)):
+                db.session.delete(blob)
+        for name, count in refs.items():
+            if db.session.get(UploadBlob, name) is None and os.path.exists(upload_path(name)):
+                db.session.add(UploadBlob(name=name, size=os.path.getsize(upload_path(name)), refcount=count))
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    click.echo(f"{removed} file(s) {'to remove' if dry_run else 'removed'}")
+
+@app.cli.command('build-image-variants')
+def build_image_variants_command():
+    """Resize every stored image that has no variants yet (e.g. after installing Pillow)."""
+    if Image is None:
+        raise click.ClickException("Pillow is not installed")
+    built = 0
+    for blob in UploadBlob.query.filter(UploadBlob.variants.is_(None)).all():
+        if blob.name.rsplit('.', 1)[1] not in RASTER_IMAGE_EXTENSIONS or not os.path.exists(upload_path(blob.name)):
+            continue
+        try:
+            blob.variants = json.dumps(render_image_variants(blob.name))
+            db.session.commit()
+            built += 1
+        except Exception as e:
+            db.session.rollback()
+            click.echo(f"failed {blob.name}: {e}")
+    invalidate_pages('gallery', 'api_gallery', 'tutors', 'api_tutors', 'news', 'api_news')
+    click.echo(f"built variants for {built} image(s)")
+
+@app.cli.command('media-worker')
+@click.option('--once', is_flag=True, help='Exit when the queue is empty instead of polling.')
+def media_worker_command(once):
+    """Process queued media jobs (video posters/renditions, ...). Run one or more per host."""
+    import socket
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    click.echo(f"media worker {worker_id} started (ffmpeg: {shutil.which('ffmpeg') or 'missing'})")
+    try:
+        while True:
+            job = claim_media_job(worker_id)
+            if job is None:
+                if once:
+                    break
+                db.session.remove()
+                time.sleep(app.config['MEDIA_WORKER_POLL_SECONDS'])
+                continue
+            job = run_media_job(job)
+            _mark_gallery_video_failed(job)
+            click.echo(f"job {job.id} {job.kind} {job.target}: {job.status}{' - ' + job.error if job.error else ''}")
+            db.session.remove()
+    except KeyboardInterrupt:
+        click.echo("media worker stopped")
+
+@app.cli.command('analyze-pitch')
+@click.option('--workers', type=int, default=None, help='Processes to use (default: all cores).')
+@click.option('--redo', is_flag=True, help='Also re-analyse recordings that already have results.')
+def analyze_pitch_command(workers, redo):
+    """Pitch-analyse gallery recordings in a process pool (backlogs, re-runs after tuning)."""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    try:
+        require_numpy()
+    except MediaJobError as e:
+        raise click.ClickException(str(e))
+    if shutil.which('ffmpeg') is None:
+        raise click.ClickException("ffmpeg is not installed")
+    done = {a.gallery_id: a.upload for a in PitchAnalysis.query.all()}
+    pending = [item for item in Gallery.query.order_by(Gallery.id).all()
+               if item.media_kind != 'image' and (redo or done.get(item.id) != item.image)
+               and os.path.exists(upload_path(item.image))]
+    click.echo(f"{len(pending)} recording(s) to analyse")
+    settings = dict(app.config['PITCH_ANALYSIS'])
+    failed = 0
+    # Workers only decode and analyse; results are written here, by a single process
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyse_pitch, upload_path(item.image), settings): item for item in pending}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                click.echo(f"gallery {item.id}: failed - {e}")
+                continue
+            store_pitch_analysis(item, result)
+            s = result['summary']
+            click.echo(f"gallery {item.id}: {s['duration']}s, voiced {s['voiced_ratio']:.0%}, "
+                       f"mean |cents| {s['mean_abs_cents']}, range {s['lowest_note']}-{s['highest_note']}")
+    if failed:
+        raise click.ClickException(f"{failed} recording(s) failed")
+
+@app.cli.command('backfill-peaks')
+def backfill_peaks_command():
+    """Queue waveform peaks/loudness for referenced media uploads that have none yet."""
+    pending = {job.target for job in MediaJob.query.filter(MediaJob.kind == 'peaks',
+                                                            MediaJob.status.in_(('queued', 'running')))}
+    queued = 0
+    for blob in UploadBlob.query.filter(UploadBlob.refcount > 0).all():
+        if (blob.name.rsplit('.', 1)[1] not in VIDEO_EXTENSIONS | AUDIO_EXTENSIONS or blob.name in pending
+                or blob.media_meta_dict().get('revision') == MEDIA_PEAKS_REVISION):
+            continue
+        enqueue_upload_analysis(blob.name)
+        queued += 1
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    click.echo(f"queued {queued} upload(s); run `flask media-worker` to process them")
+
+@app.cli.command('sample-bank')
+def sample_bank_command():
+    """Render the ear-training sample bank now instead of waiting for the media worker."""
+    try:
+        added = build_sample_bank()
+    except MediaJobError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"sample bank {sample_bank_id()}: {added} sample(s) added")
+
+def listing_queries():
+    """Every listing query the pages run, as (label, query, must_seek) tuples."""
+    queries = []
+    for listing, (model, columns) in LISTING_ORDER.items():
+        sample = [datetime.datetime(2000, 1, 1) if isinstance(c.type, db.DateTime)
+                  else 1 if isinstance(c.type, db.Integer) else 'x' for c in columns]
+        queries.append((f"{listing} (first page)", keyset_query(listing).limit(25), False))
+        queries.append((f"{listing} (cursor page)", keyset_query(listing, sample).limit(25), True))
+    queries.append(("pricing", pricing_listing(), False))
+    queries.append(("slots", slots_listing(), False))
+    return queries
+
+# --- PRODUCTION SERVER ---
+# `serve` runs the app under gunicorn with preload_app: this module is imported
+# once in the master (templates compiled, create_all and migrations run there) and
+# the workers are forked from it, so they start in milliseconds and share the
+# master's memory pages. gthread workers suit the upload and media routes, which
+# block on disk; gevent (if installed) suits many idle keep-alive clients.
+# Signals go to the master: HUP starts new workers with the reloaded settings and
+# lets the old ones finish their requests (no dropped connections); since the app
+# is preloaded, new code needs USR2 (a second master) followed by TERM to the old one.
+def _after_worker_fork(server, worker):
+    # The master's connections (create_all, migrations) must not be shared across processes
+    with app.app_context():
+        db.engine.dispose(close=False)
+    _page_cache_local.conn = None
+
+@app.cli.command('serve')
+@click.option('--bind', '-b', default='127.0.0.1:8000', envvar='SERVE_BIND', show_default=True,
+              help='host:port or unix:/path to listen on.')
+@click.option('--workers', '-w', type=click.IntRange(1), default=None, envvar='SERVE_WORKERS',
+              help='Worker processes (default: 2 x cores + 1).')
+@click.option('--worker-class', '-k', type=click.Choice(['gthread', 'gevent']), default='gthread',
+              envvar='SERVE_WORKER_CLASS', show_default=True)
+@click.option('--threads', type=click.IntRange(1), default=4, envvar='SERVE_THREADS', show_default=True,
+              help='Threads per gthread worker.')
+@click.option('--worker-connections', type=click.IntRange(1), default=1000, show_default=True,
+              help='Concurrent clients per gevent worker.')
+@click.option('--keepalive', type=click.IntRange(0), default=5, envvar='SERVE_KEEPALIVE', show_default=True,
+              help='Seconds an idle keep-alive connection stays open.')
+@click.option('--timeout', type=click.IntRange(1), default=120, show_default=True,
+              help='Seconds a busy worker may stay silent before it is restarted (large uploads).')
+@click.option('--graceful-timeout', type=click.IntRange(1), default=30, show_default=True,
+              help='Seconds old workers get to finish their requests on HUP/TERM.')
+@click.option('--max-requests', type=click.IntRange(0), default=0, show_default=True,
+              help='Recycle a worker after this many requests (0: never).')
+@click.option('--access-log', is_flag=True, help='Log every request to stdout.')
+def serve_command(bind, workers, worker_class, threads, worker_connections, keepalive, timeout,
+                  graceful_timeout, max_requests, access_log):
+    """Serve the app with gunicorn: loaded once, forked workers, SIGHUP for a graceful reload."""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise click.ClickException("gunicorn is not installed (pip install gunicorn)")
+    if worker_class == 'gevent':
+        try:
+            import gevent  # noqa: F401
+        except ImportError:
+            raise click.ClickException("gevent is not installed (pip install gevent)")
+    options = {
+        'bind': bind,
+        'workers': workers or 2 * (os.cpu_count() or 1) + 1,
+        'worker_class': worker_class,
+        'threads': threads,
+        'worker_connections': worker_connections,
+        'keepalive': keepalive,
+        'timeout': timeout,
+        'graceful_timeout': graceful_timeout,
+        'max_requests': max_requests,
+        'max_requests_jitter': max_requests // 10,  # workers do not all restart at once
+        'preload_app': True,
+        'post_fork': _after_worker_fork,
+        'accesslog': '-' if access_log else None,
+        'proc_name': 'bimbel',
+    }
+    if os.path.isdir('/dev/shm'):
+        options['worker_tmp_dir'] = '/dev/shm'  # heartbeat files off a possibly slow disk
+    precompile_templates(TEMPLATE_SOURCES)  # the lazy ones too: compiled once, shared by every fork
+
+    class BimbelServer(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    BimbelServer().run()
+
+def listing_query_plans(queries=None):
+    """(label, plan steps, regressed steps) for each listing query, from SQLite's EXPLAIN QUERY PLAN.
+
+    A step regresses when it scans a whole table or sorts in a temp B-tree, or
+    when a cursor page walks its index from the start instead of seeking.
+    """
+    bad_step = re.compile(r'^SCAN (TABLE )?\w+$|TEMP B-TREE')
+    plans = []
+    for label, query, must_seek in listing_queries() if queries is None else queries:
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        params = tuple(v.isoformat(' ') if isinstance(v, datetime.datetime) else v
+                       for v in (compiled.params[name] for name in compiled.positiontup))
+        plan = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).fetchall()
+        steps = [row[-1] for row in plan]
+        plans.append((label, steps, [s for s in steps if bad_step.search(s) or (must_seek and s.startswith('SCAN '))]))
+    return plans
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if any listing query needs a full table scan or a temp B-tree sort,
+    or a cursor page walks its index from the start instead of seeking."""
+    if db.engine.dialect.name != 'sqlite':
+        click.echo(f"Skipped: EXPLAIN QUERY PLAN check only supports SQLite, not {db.engine.dialect.name}")
+        return
+    failed = False
+    for label, steps, regressed in listing_query_plans():
+        failed = failed or bool(regressed)
+        click.echo(f"{'FAIL' if regressed else 'ok  '}  {label}: {' | '.join(steps)}")
+    if failed:
+        raise SystemExit(1)
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    if len(sys.argv) > 1:
+        # CLI commands, e.g. `python <this file> bench -n 500`
+        from flask.cli import FlaskGroup
+        FlaskGroup(create_app=create_app)()
+    else:
+        # Development server; in production use `python <this file> serve`
+        create_app().run(debug=True, port=5000)
@@ -0,0 +1,38 @@
+import importlib.util
+import pathlib
+
+import pytest
+
+APP_FILE = next(pathlib.Path(__file__).resolve().parent.parent.glob('les-latihan-bimbel-*.py'))
+
+
+def load_bimbel(root):
+    """A fresh instance of the app module, set up against a SQLite DB and folders under `root`."""
+    spec = importlib.util.spec_from_file_location('bimbel', APP_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{root / 'bimbel.db'}",
+        'UPLOAD_FOLDER': str(root / 'uploads'),
+        'AUDIO_FOLDER': str(root / 'audio'),
+        'PAGE_CACHE_FILE': str(root / 'page_cache.sqlite3'),
+        'SITE_CONFIG_FILE': str(root / 'site_config.json'),
+    })
+    return module
+
+
+@pytest.fixture(scope='session')
+def bimbel(tmp_path_factory):
+    """The app module, set up once against a throwaway SQLite DB and upload/audio folders."""
+    return load_bimbel(tmp_path_factory.mktemp('bimbel'))
+
+
+@pytest.fixture
+def app(bimbel):
+    return bimbel.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,102 @@
+import io
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+
+def post_gallery(client, key, title='Lagu'):
+    return client.post('/gallery', headers={'Idempotency-Key': key}, content_type='multipart/form-data',
+                       data={'student_name': 'Ani', 'title': title, 'image': (io.BytesIO(b'GIF89a' + key.encode()), 'a.gif')})
+
+
+def test_retried_gallery_upload_adds_one_row(bimbel, app, client):
+    assert post_gallery(client, 'gallery-retry-1').status_code == 302
+    assert post_gallery(client, 'gallery-retry-1').status_code == 302
+    with app.app_context():
+        assert bimbel.Gallery.query.filter_by(idempotency_key='gallery-retry-1').count() == 1
+
+
+def test_concurrent_retry_is_swallowed(bimbel, app, tmp_path):
+    with app.app_context():
+        name = bimbel.store_local_file(str(_file(tmp_path, b'first')), 'gif')
+        bimbel.create_gallery_item(name, student_name='Ani', title='a', idempotency_key='gallery-race-1')
+        # The route's pre-check missed it: the unique index rejects the insert, which counts as done
+        bimbel.create_gallery_item(name, student_name='Ani', title='a', idempotency_key='gallery-race-1')
+        assert bimbel.Gallery.query.filter_by(idempotency_key='gallery-race-1').count() == 1
+
+
+def test_other_integrity_errors_are_raised(bimbel, app, tmp_path, monkeypatch):
+    def broken_retain(name):
+        raise IntegrityError('INSERT INTO upload_blobs', {}, Exception('constraint failed'))
+    monkeypatch.setattr(bimbel, 'retain_upload', broken_retain)
+    with app.app_context():
+        name = bimbel.store_local_file(str(_file(tmp_path, b'second')), 'gif')
+        with pytest.raises(IntegrityError):
+            bimbel.create_gallery_item(name, student_name='Ani', title='b', idempotency_key='gallery-broken-1')
+        assert bimbel.Gallery.query.filter_by(idempotency_key='gallery-broken-1').count() == 0
+
+
+def _file(tmp_path, data):
+    path = tmp_path / 'upload.gif'
+    path.write_bytes(b'GIF89a' + data)
+    return path
+
+
+def send_upload(client, target, data=b'GIF89a-resumable'):
+    """Upload `data` in one PATCH; returns the upload's URL."""
+    created = client.post('/api/uploads', json={'target': target, 'filename': 'photo.gif', 'length': len(data)})
+    assert created.status_code == 201
+    location = created.headers['Location']
+    assert client.patch(location, data=data, headers={'Upload-Offset': '0', 'Content-Type': 'application/offset+octet-stream'}).status_code == 204
+    return location
+
+
+def finalize_upload(client, target, key, fields, data=b'GIF89a-resumable'):
+    """Upload `data` in one PATCH and finalize it with the Idempotency-Key."""
+    location = send_upload(client, target, data)
+    return client.post(f"{location}/finalize", data=fields, headers={'Idempotency-Key': key})
+
+
+@pytest.mark.parametrize('target, model, fields', [
+    ('tutors', 'Tutors', {'name': 'Budi', 'bio': 'Piano'}),
+    ('news', 'News', {'title': 'Konser', 'content': 'Sabtu', 'date': '2026-10-18'}),
+])
+def test_retried_finalize_adds_one_row(bimbel, app, client, target, model, fields):
+    key = f"{target}-finalize-1"
+    # A client that lost the first response starts a fresh upload with the same key
+    assert finalize_upload(client, target, key, fields).status_code == 200
+    assert finalize_upload(client, target, key, fields).status_code == 200
+    with app.app_context():
+        assert getattr(bimbel, model).query.filter_by(idempotency_key=key).count() == 1
+
+
+def test_retried_news_post_adds_one_row(bimbel, app, client):
+    form = {'title': 'Libur', 'content': 'Senin', 'date': '2026-10-19'}
+    for _ in range(2):
+        assert client.post('/news', data=form, headers={'Idempotency-Key': 'news-form-1'}).status_code == 302
+    with app.app_context():
+        assert bimbel.News.query.filter_by(idempotency_key='news-form-1').count() == 1
+
+
+def test_malformed_key_does_not_cost_the_upload(bimbel, app, client):
+    location = send_upload(client, 'gallery', b'GIF89a-bad-key')
+    fields = {'student_name': 'Ani', 'title': 'Kunci'}
+    assert client.post(f"{location}/finalize", data=fields, headers={'Idempotency-Key': 'bad key!'}).status_code == 400
+    response = client.post(f"{location}/finalize", data=fields, headers={'Idempotency-Key': 'gallery-bad-key-1'})
+    assert response.status_code == 200
+    with app.app_context():
+        assert bimbel.Gallery.query.filter_by(idempotency_key='gallery-bad-key-1').count() == 1
+
+
+def test_failed_finalize_is_gone_for_good(bimbel, client, monkeypatch):
+    def broken_create(name, **values):
+        raise OSError('disk full')
+    monkeypatch.setitem(bimbel.UPLOAD_TARGETS, 'gallery', (broken_create, ('student_name', 'title')))
+    location = send_upload(client, 'gallery', b'GIF89a-failed')
+    fields = {'student_name': 'Ani', 'title': 'Gagal'}
+    with pytest.raises(OSError):
+        client.post(f"{location}/finalize", data=fields, headers={'Idempotency-Key': 'gallery-failed-1'})
+    # 410 is outside the statuses OUTBOX_JS retries, so the take leaves the outbox
+    response = client.post(f"{location}/finalize", data=fields, headers={'Idempotency-Key': 'gallery-failed-1'})
+    assert response.status_code == 410
+    assert response.get_json()['status'] == 'failed'
@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def track(app):
+    os.makedirs(app.config['AUDIO_FOLDER'], exist_ok=True)
+    path = os.path.join(app.config['AUDIO_FOLDER'], 'pop_rock.mp3')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(4096))  # a new mtime, so every test renders fresh variants
+    return '/static/audio/pop_rock.mp3'
+
+
+@pytest.fixture
+def renders(bimbel, monkeypatch):
+    """Replace ffmpeg: each render waits for `release` and then writes b'variant'."""
+    state = {'calls': 0, 'release': threading.Event(), 'evict': False}
+
+    def fake_render(src, dest, semitones, tempo):
+        state['calls'] += 1
+        state['release'].wait(5)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, 'wb') as f:
+            f.write(b'variant')
+        if state['evict']:
+            state['evict'] = False
+            os.remove(dest)  # trim_jam_variants() won the race
+    monkeypatch.setattr(bimbel, 'render_jam_variant', fake_render)
+    return state
+
+
+def test_quick_render_is_served_directly(client, track, renders):
+    renders['release'].set()
+    response = client.get(f"{track}?key=D")
+    assert response.status_code == 200
+    assert response.data == b'variant'
+    assert renders['calls'] == 1
+
+
+def test_slow_render_gets_202_and_others_do_not_wait(app, client, track, renders, monkeypatch):
+    monkeypatch.setitem(app.config, 'JAM_RENDER_WAIT_SECONDS', 0.2)
+    first = client.get(f"{track}?key=E")
+    assert first.status_code == 202 and first.headers['Retry-After']
+    start = time.monotonic()
+    second = client.get(f"{track}?key=E")
+    assert second.status_code == 202
+    assert time.monotonic() - start < 0.1  # the render in flight is not waited for again
+    assert renders['calls'] == 1
+    renders['release'].set()
+    for _ in range(50):
+        response = client.get(f"{track}?key=E")
+        if response.status_code == 200:
+            break
+        time.sleep(0.05)
+    assert response.data == b'variant'
+
+
+def test_variant_evicted_after_render_is_rendered_again(client, track, renders):
+    renders['release'].set()
+    renders['evict'] = True
+    response = client.get(f"{track}?key=F")
+    assert response.status_code == 202
+    for _ in range(50):
+        response = client.get(f"{track}?key=F")
+        if response.status_code == 200:
+            break
+        time.sleep(0.05)
+    assert response.data == b'variant'
+    assert renders['calls'] == 2
+
+
+def test_invalid_variant_is_rejected(client, track):
+    assert client.get(f"{track}?key=H").status_code == 400
@@ -0,0 +1,42 @@
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture(scope='module')
+def response(bimbel):
+    bimbel.require_numpy()
+    return bimbel.k_weighting_response()
+
+
+def test_k_weighting_response_is_truncated_after_it_decays(response):
+    assert len(response) < 4096
+    assert abs(response[-1]) > 1e-8
+
+
+def test_k_weighting_gain(response):
+    # BS.1770: about +0.7 dB at 1 kHz (hence the -0.691 offset), high-passed below ~100 Hz
+    spectrum = np.abs(np.fft.rfft(response, 48000))
+    assert 20 * math.log10(spectrum[1000]) == pytest.approx(0.691, abs=0.05)
+    assert 20 * math.log10(spectrum[20]) < -10
+
+
+def test_r128_loudness_gating(bimbel):
+    bimbel.require_numpy()
+    lufs = lambda value: 10 ** ((value + 0.691) / 10)  # 100 ms power of a constant loudness
+    # Near silence is dropped by the absolute gate, -40 LUFS by the relative one
+    power = np.concatenate([np.full(200, lufs(-23)), np.full(200, 1e-12), np.full(50, lufs(-40))])
+    assert bimbel.r128_loudness(power)[0] == pytest.approx(-23.0, abs=0.05)
+    # A 10 dB step: the 10th-95th percentile spread of short-term loudness
+    power = np.concatenate([np.full(200, lufs(-20)), np.full(200, lufs(-30))])
+    assert bimbel.r128_loudness(power)[1] == pytest.approx(10.0, abs=0.05)
+    assert bimbel.r128_loudness(np.full(20, lufs(-23))) == (pytest.approx(-23.0, abs=0.05), None)  # under 3 s
+
+
+def test_peaks_dat_layout(bimbel):
+    bimbel.require_numpy()
+    data = bimbel.peaks_dat(np.array([-1.0, -0.5]), np.array([1.0, 0.25]), 256)
+    assert bimbel.PEAKS_DAT_HEADER.unpack_from(data) == (2, 1, 48000, 256, 2, 1)
+    assert list(np.frombuffer(data, dtype=np.int8, offset=bimbel.PEAKS_DAT_HEADER.size)) == [-127, 127, -64, 32]
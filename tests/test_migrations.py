@@ -0,0 +1,71 @@
+import sqlite3
+
+from conftest import load_bimbel
+
+# bimbel.db as created by db.create_all() before schema migrations existed
+BASELINE_SCHEMA = """
+CREATE TABLE gallery (id INTEGER NOT NULL, image TEXT NOT NULL, student_name TEXT NOT NULL,
+                      title TEXT NOT NULL, created_at DATETIME, PRIMARY KEY (id));
+CREATE TABLE tutors (id INTEGER NOT NULL, image TEXT NOT NULL, name TEXT NOT NULL,
+                     bio TEXT NOT NULL, created_at DATETIME, PRIMARY KEY (id));
+CREATE TABLE pricing (id INTEGER NOT NULL, title TEXT NOT NULL, price TEXT NOT NULL,
+                      details TEXT NOT NULL, created_at DATETIME, PRIMARY KEY (id));
+CREATE TABLE slots (id INTEGER NOT NULL, day TEXT NOT NULL, time TEXT NOT NULL, status TEXT,
+                    type TEXT, created_at DATETIME, PRIMARY KEY (id));
+CREATE TABLE join_requests (id INTEGER NOT NULL, name TEXT NOT NULL, age INTEGER NOT NULL,
+                            interest TEXT NOT NULL, whatsapp TEXT NOT NULL, created_at DATETIME, PRIMARY KEY (id));
+CREATE TABLE news (id INTEGER NOT NULL, title TEXT NOT NULL, content TEXT NOT NULL, date TEXT NOT NULL,
+                   image TEXT, created_at DATETIME, PRIMARY KEY (id));
+INSERT INTO gallery (image, student_name, title, created_at) VALUES ('old.png', 'Ani', 'Lama', '2024-01-01 00:00:00');
+INSERT INTO tutors (image, name, bio, created_at) VALUES ('t.png', 'Budi', 'Gitar', '2024-01-01 00:00:00');
+INSERT INTO news (title, content, date, created_at) VALUES ('Libur', 'Tutup', '2024-01-01', '2024-01-01 00:00:00');
+"""
+
+
+def make_db(root, script):
+    conn = sqlite3.connect(root / 'bimbel.db')
+    conn.executescript(script)
+    conn.close()
+
+
+def assert_fully_migrated(bimbel, root):
+    conn = sqlite3.connect(root / 'bimbel.db')
+    applied = {name for (name,) in conn.execute("SELECT name FROM schema_migrations")}
+    indexes = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    assert applied == {name for name, _ in bimbel.MIGRATIONS}
+    assert {index.name for table in bimbel.db.metadata.sorted_tables for index in table.indexes} <= indexes
+
+
+def test_baseline_database_migrates(tmp_path):
+    make_db(tmp_path, BASELINE_SCHEMA)
+    bimbel = load_bimbel(tmp_path)
+    assert_fully_migrated(bimbel, tmp_path)
+    with bimbel.app.app_context():
+        assert [g.title for g in bimbel.Gallery.query] == ['Lama']
+        assert bimbel.Tutors.query.one().idempotency_key is None
+    assert bimbel.app.test_client().get('/gallery').status_code == 200
+
+
+def test_database_at_0003_migrates(tmp_path):
+    make_db(tmp_path, BASELINE_SCHEMA + """
+    CREATE INDEX ix_gallery_created_at_id ON gallery (created_at, id);
+    CREATE INDEX ix_tutors_created_at_id ON tutors (created_at, id);
+    CREATE INDEX ix_pricing_created_at ON pricing (created_at);
+    CREATE INDEX ix_slots_day_time ON slots (day, time);
+    CREATE INDEX ix_news_date_created_at_id ON news (date, created_at, id);
+    ALTER TABLE gallery ADD COLUMN media_status TEXT;
+    ALTER TABLE gallery ADD COLUMN media_info TEXT;
+    ALTER TABLE gallery ADD COLUMN poster TEXT;
+    ALTER TABLE gallery ADD COLUMN preview TEXT;
+    ALTER TABLE gallery ADD COLUMN rendition TEXT;
+    CREATE TABLE upload_blobs (name TEXT NOT NULL, size INTEGER NOT NULL, refcount INTEGER NOT NULL,
+                               variants TEXT, created_at DATETIME, PRIMARY KEY (name));
+    CREATE TABLE schema_migrations (name TEXT NOT NULL, applied_at DATETIME, PRIMARY KEY (name));
+    INSERT INTO schema_migrations (name) VALUES ('0001_listing_indexes'), ('0002_upload_blob_variants'),
+                                                ('0003_gallery_media');
+    """)
+    bimbel = load_bimbel(tmp_path)
+    assert_fully_migrated(bimbel, tmp_path)
+    with bimbel.app.app_context():
+        assert bimbel.News.query.one().idempotency_key is None
@@ -0,0 +1,17 @@
+def test_pages_revalidate_by_revision_etag(client):
+    first = client.get('/news')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert 'Last-Modified' not in first.headers
+    assert client.get('/news', headers={'If-None-Match': etag}).status_code == 304
+    # A write in the same second as the first response still changes the page
+    assert client.post('/news', data={'title': 'Baru', 'content': 'Isi', 'date': '2026-10-20'}).status_code == 302
+    second = client.get('/news', headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != etag
+
+
+def test_if_modified_since_alone_never_revalidates(client):
+    client.get('/gallery')
+    response = client.get('/gallery', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code == 200
@@ -0,0 +1,43 @@
+import pytest
+
+
+@pytest.fixture
+def plans(bimbel, app):
+    with app.app_context():
+        yield bimbel.listing_query_plans()
+
+
+def test_every_listing_query_is_checked(bimbel, plans):
+    labels = [label for label, _, _ in plans]
+    for listing in bimbel.LISTING_ORDER:
+        assert f"{listing} (first page)" in labels
+        assert f"{listing} (cursor page)" in labels
+    assert 'pricing' in labels and 'slots' in labels
+
+
+def test_listing_queries_use_their_index(plans):
+    for label, steps, regressed in plans:
+        assert not regressed, f"{label}: {' | '.join(steps)}"
+        for step in steps:
+            assert 'TEMP B-TREE' not in step, f"{label}: {step}"
+            if step.startswith('SCAN '):
+                assert ' USING ' in step and 'INDEX' in step, f"{label} scans its table: {step}"
+
+
+def test_cursor_pages_seek_instead_of_scanning(plans):
+    for label, steps, _ in plans:
+        if label.endswith('(cursor page)'):
+            assert not any(step.startswith('SCAN ') for step in steps), f"{label}: {' | '.join(steps)}"
+
+
+def test_unindexed_order_is_reported(bimbel, app):
+    with app.app_context():
+        query = bimbel.Gallery.query.order_by(bimbel.Gallery.title).limit(5)
+        [(label, steps, regressed)] = bimbel.listing_query_plans([('gallery by title', query, False)])
+    assert regressed, steps
+
+
+def test_cli_wraps_the_same_check(app):
+    result = app.test_cli_runner().invoke(args=['check-query-plans'])
+    assert result.exit_code == 0, result.output
+    assert 'FAIL' not in result.output